@@ -2,16 +2,48 @@ import digitalio
 import time
 import sys
 
+CHANNEL_LEFT = 0
+CHANNEL_RIGHT = 1
+CHANNEL_BOTH = 2
+
+def _volume_bits(volume):
+	attenuation = 0 if volume > 100 else (((volume * 83) // -100) + 83)
+	data = 0
+	data |= ((21 - (attenuation // 4)) << 2)     # D2...D6 (0...84 in steps of 4)
+	data |= ((3 - (attenuation % 4)) << 7)      # D7 & D8 (0...3)
+	data |= (0b11 << 9);                        # D9 and D10 must both be 1
+	return data
+
+# Data words for every volume (0...100) and channel, D0 (channel select: 0=ch1, 1=ch2) D1 (individual/both select: 0=both, 1=individual)
+_WORDS = (
+	tuple(_volume_bits(volume) | (0 << 0) | (1 << 1) for volume in range(101)),
+	tuple(_volume_bits(volume) | (1 << 0) | (1 << 1) for volume in range(101)),
+	tuple(_volume_bits(volume) | (0 << 0) | (0 << 1) for volume in range(101)),
+)
+
 class M62429(object):
-	"""docstring for MS62429"""
-	def __init__(self, pin_data, pin_clock, speed=0.001):
+	"""
+	Volume is 0...100 per channel.
+	`speed` is an extra delay per clock edge, in seconds. With the default 0 the pulses only last as long as the pin
+	writes take, which was not measured on a board and may be shorter than the datasheet minimums (1.6us clock pulse
+	width, 0.8us data setup/hold) on a fast one. mock_hardware.MockM62429 flags pulses under these minimums,
+	set a non zero `speed` if the chip misses words.
+	"""
+	def __init__(self, pin_data, pin_clock, speed=0):
 		super(M62429, self).__init__()
 		self.pin_data = digitalio.DigitalInOut(pin_data)
 		self.pin_data.direction = digitalio.Direction.OUTPUT
 		self.pin_clock = digitalio.DigitalInOut(pin_clock)
 		self.pin_clock.direction = digitalio.Direction.OUTPUT
 		self.speed = speed
-	
+
+		# Last volume written to each channel, None until the first write
+		self.volume = [None, None]
+		self.writes = 0
+		self.skipped = 0
+		# Fades: channel -> (start volume, target volume, start time, duration)
+		self._fades = {}
+
 	def deinit(self):
 		self.pin_data.deinit()
 		self.pin_clock.deinit()
@@ -25,27 +57,108 @@ class M62429(object):
 	def setVolume(self, volume):
 		self.setVolumeInternal(volume, channel=0, both=True)
 
-	def setVolumeInternal(self, volume, channel=0, both=False):
-		volume = 0 if volume > 100 else (((volume * 83) // -100) + 83)
-		data = 0
-		data |= (1 << 0) if channel else (0 << 0)  # D0 (channel select: 0=ch1, 1=ch2)
-		data |= (0 << 1) if both else (1 << 1)     # D1 (individual/both select: 0=both, 1=individual)
-		data |= ((21 - (volume // 4)) << 2)         # D2...D6 (0...84 in steps of 4)
-		data |= ((3 - (volume % 4)) << 7)          # D7 & D8 (0...3)
-		data |= (0b11 << 9);                       # D9 and D10 must both be 1
-		print(data)
+	def setVolumeInternal(self, volume, channel=0, both=False, force=False):
+		volume = min(max(int(volume), 0), 100)
+		# A direct write cancels the fades of the channels it touches
+		if both:
+			self._fades.clear()
+		else:
+			self._fades.pop(channel, None)
+		self._set(volume, CHANNEL_BOTH if both else channel, force=force)
+
+	def _set(self, volume, channel, force=False):
+		current = self.volume
+		if channel == CHANNEL_BOTH:
+			if not force and current[0] == volume and current[1] == volume:
+				self.skipped += 1
+				return
+			current[0] = current[1] = volume
+		else:
+			if not force and current[channel] == volume:
+				self.skipped += 1
+				return
+			current[channel] = volume
+		self._write_word(_WORDS[channel][volume])
 
+	def _write_word(self, data):
+		pin_data = self.pin_data
+		pin_clock = self.pin_clock
+		speed = self.speed
+		if speed:
+			delay = time.sleep
+		# Data is sampled on the rising clock edge and latched by a falling clock edge while data is high,
+		# so data has to go low before the clock does (only needed if the previous bit was a 1)
+		previous = 1
 		for bit in range(0,11):
-			time.sleep(self.speed)
-			self.pin_data.value = False
-			time.sleep(self.speed)
-			self.pin_clock.value = False
-			time.sleep(self.speed)
-			self.pin_data.value = 1 if ((data >> bit) & 0x01) else 0
-			time.sleep(self.speed)
-			self.pin_clock.value = True
-		
-		time.sleep(self.speed)
-		self.pin_data.value = True
-		time.sleep(self.speed)
-		self.pin_clock.value = False
\ No newline at end of file
+			value = (data >> bit) & 0x01
+			if previous:
+				pin_data.value = False
+			pin_clock.value = False
+			if value:
+				pin_data.value = True
+			if speed:
+				delay(speed)
+			pin_clock.value = True
+			if speed:
+				delay(speed)
+			previous = value
+
+		# Latch: clock low while data is high (D10 is always 1)
+		pin_data.value = True
+		if speed:
+			delay(speed)
+		pin_clock.value = False
+		self.writes += 1
+
+	def fade(self, volume, duration=0.5, channel=CHANNEL_BOTH):
+		"""
+		Start a fade to `volume` over `duration` seconds, nothing is written until update() is called.
+		Calling it again before the end restarts the fade from where the channel currently is.
+		"""
+		volume = min(max(int(volume), 0), 100)
+		now = time.monotonic()
+		for ch in ((0, 1) if channel == CHANNEL_BOTH else (channel,)):
+			start = self.volume[ch]
+			if start is None:
+				start = volume
+			self._fades[ch] = (start, volume, now, duration)
+
+	@property
+	def fading(self):
+		return bool(self._fades)
+
+	def update(self, now=None):
+		"""
+		Call from the main loop: writes the volume the running fades should be at (once per channel at most,
+		once for both when they're equal). Returns True while a fade is still running.
+		"""
+		if not self._fades:
+			return False
+		now = time.monotonic() if now is None else now
+		targets = {}
+		for ch, (start, target, started, duration) in list(self._fades.items()):
+			progress = (now - started) / duration if duration > 0 else 1
+			if progress >= 1:
+				targets[ch] = target
+				del self._fades[ch]
+			else:
+				targets[ch] = int(start + (target - start) * progress + 0.5)
+
+		if len(targets) == 2 and targets[0] == targets[1]:
+			self._set(targets[0], CHANNEL_BOTH)
+		else:
+			for ch, volume in targets.items():
+				self._set(volume, ch)
+		return bool(self._fades)
+
+if __name__ == '__main__':
+	print("Tested on a raspberry pico. Check the pins")
+	import board
+	vol = M62429(board.GP0, board.GP1)
+	vol.fade(100, duration=2)
+	while vol.update():
+		time.sleep(0.005)
+	vol.fade(0, duration=2)
+	while vol.update():
+		time.sleep(0.005)
+	print("Writes:", vol.writes, "skipped:", vol.skipped)
@@ -30,6 +30,9 @@ COMMAND_DECREMENT = 0B10
 
 STATUS_SHUTDOWN_MASK = 0B10
 
+SPI_BAUDRATE = 5000000
+MAX_BATCH = 16
+
 class MCP4XXX(object):
 	"""docstring for MCP4XXX"""
 	def __init__(self, spi, cs=None, resolution=Resolution.BIT_8, wiper=Wiper.Potentiometer):
@@ -43,6 +46,19 @@ class MCP4XXX(object):
 		self.pin_cs = digitalio.DigitalInOut(cs)
 		self.pin_cs.direction = digitalio.Direction.OUTPUT
 		self.pin_cs.value = True
+
+		# Preallocated transfer buffers, every command is at most 2 bytes
+		self._wbuf = bytearray(2 * MAX_BATCH)
+		self._rbuf = bytearray(2 * MAX_BATCH)
+
+		# Shadow registers, None means unknown (read from the chip on next access)
+		self._tcon = None
+		self._wipers = [None, None]
+
+	def invalidate(self):
+		"""Forget the shadow registers (call it if something else may have written to the chip)"""
+		self._tcon = None
+		self._wipers = [None, None]
 	
 	@property
 	def max_value(self):
@@ -51,7 +67,7 @@ class MCP4XXX(object):
 	def _select(self):
 		while not self.spi.try_lock():
 			pass
-		self.spi.configure(baudrate=5000000, polarity=0, phase=0, bits=8)
+		self.spi.configure(baudrate=SPI_BAUDRATE, polarity=0, phase=0, bits=8)
 		self.pin_cs.value = False
 
 	def _deselect(self):
@@ -62,31 +78,91 @@ class MCP4XXX(object):
 		self.pin_cs.deinit()
 		self.spi.unlock()
 
-	def _build_command(self, address, command, data=None):
-		data_bytes = [ ((address << 4) & ADDRESS_MASK) | ((command << 2) & COMMAND_MASK) | CMDERR_MASK ]
-		if data != None:
-			data_bytes.append((data & DATA_MASK_WORD) & 0xFF)
-		return data_bytes
+	def _pack_command(self, offset, address, command, data=None):
+		# Writes the command in the preallocated buffer, returns its length (8 or 16 bit command)
+		wbuf = self._wbuf
+		wbuf[offset] = ((address << 4) & ADDRESS_MASK) | ((command << 2) & COMMAND_MASK) | CMDERR_MASK
+		if data is None:
+			return 1
+		wbuf[offset] |= (data >> 8) & DATA_MASK # D8, full scale on the 8 bit parts is 256
+		wbuf[offset + 1] = data & 0xFF
+		return 2
+
+	def _unpack_data(self, offset):
+		return ((self._rbuf[offset] & DATA_MASK) << 8) | self._rbuf[offset + 1]
 
 	def _transfer(self, address, command, data=None):
-		byts = self._build_command(address, command, data=data)
-		rbuf = bytearray(len(byts))
+		length = self._pack_command(0, address, command, data=data)
 		self._select()
-		self.spi.write_readinto(bytes(byts),rbuf)
+		self.spi.write_readinto(self._wbuf, self._rbuf, out_end=length, in_end=length)
 		self._deselect()
-		return list(rbuf)
+		return None if data is None else self._unpack_data(0)
+
+	def transfer_batch(self, commands):
+		"""
+		Send several (address, command, data) tuples under a single lock / chip select assertion.
+		Returns the 9 bit data of every read (None for the other commands)
+		"""
+		results = []
+		for start in range(0, len(commands), MAX_BATCH):
+			chunk = commands[start:start + MAX_BATCH]
+			offsets = []
+			length = 0
+			for address, command, data in chunk:
+				offsets.append(length)
+				length += self._pack_command(length, address, command, data=data)
+			self._select()
+			self.spi.write_readinto(self._wbuf, self._rbuf, out_end=length, in_end=length)
+			self._deselect()
+			for (address, command, data), offset in zip(chunk, offsets):
+				if command == COMMAND_READ:
+					results.append(self._unpack_data(offset))
+				else:
+					results.append(None)
+					self._track_write(address, command, data)
+		return results
+
+	def _track_write(self, address, command, data):
+		# Keeps the shadow registers in sync with raw commands sent through transfer_batch
+		if address == ADDRESS_TCON and command == COMMAND_WRITE:
+			self._tcon = data & 0xFF
+		elif address in (ADDRESS_POT0_WIPER, ADDRESS_POT1_WIPER):
+			self._wipers[address] = data if command == COMMAND_WRITE else None
 
 	def increment(self, port=Port.P0):
 		self._transfer(port, COMMAND_INCREMENT)
+		if self._wipers[port] is not None:
+			self._wipers[port] = min(self._wipers[port] + 1, self.max_value)
 
 	def decrement(self, port=Port.P0):
 		self._transfer(port, COMMAND_DECREMENT)
-
-	def set(self, value, port=Port.P0):
-		self._transfer(port, COMMAND_WRITE, data=int(min(value, self.max_value)))
-
-	def get(self, port=Port.P0):
-		return self._transfer(port, COMMAND_READ, data=DATA_MASK_WORD)[1]
+		if self._wipers[port] is not None:
+			self._wipers[port] = max(self._wipers[port] - 1, 0)
+
+	def set(self, value, port=Port.P0, force=False):
+		value = int(min(value, self.max_value))
+		if not force and self._wipers[port] == value:
+			return
+		self._transfer(port, COMMAND_WRITE, data=value)
+		self._wipers[port] = value
+
+	def set_both(self, value_p0, value_p1):
+		"""Write both wipers in a single transaction"""
+		value_p0 = int(min(value_p0, self.max_value))
+		value_p1 = int(min(value_p1, self.max_value))
+		commands = []
+		if self._wipers[Port.P0] != value_p0:
+			commands.append((Port.P0, COMMAND_WRITE, value_p0))
+		if self._wipers[Port.P1] != value_p1:
+			commands.append((Port.P1, COMMAND_WRITE, value_p1))
+		if commands:
+			self.transfer_batch(commands)
+		self._wipers = [value_p0, value_p1]
+
+	def get(self, port=Port.P0, cached=True):
+		if not cached or self._wipers[port] is None:
+			self._wipers[port] = self._transfer(port, COMMAND_READ, data=DATA_MASK_WORD)
+		return self._wipers[port]
 
 	def _set_tcon(self, mask, value, port=Port.P0):
 		if(port == Port.P1): # The values for pot #1 are 4 bits higher in the TCON register.
@@ -94,12 +170,17 @@ class MCP4XXX(object):
 
 		tcon = self._get_tcon()
 		if value:
-			self._transfer(ADDRESS_TCON, COMMAND_WRITE, data=tcon | mask)
+			new_tcon = tcon | mask
 		else:
-			self._transfer(ADDRESS_TCON, COMMAND_WRITE, data=tcon & (~mask & 0xFF))
+			new_tcon = tcon & (~mask & 0xFF)
+		if new_tcon != tcon:
+			self._transfer(ADDRESS_TCON, COMMAND_WRITE, data=new_tcon)
+			self._tcon = new_tcon
 
 	def _get_tcon(self, mask=None, port=Port.P0):
-		tcon_byte = self._transfer(ADDRESS_TCON, COMMAND_READ, data=DATA_MASK_WORD)[1]
+		if self._tcon is None:
+			self._tcon = self._transfer(ADDRESS_TCON, COMMAND_READ, data=DATA_MASK_WORD) & 0xFF
+		tcon_byte = self._tcon
 		if mask==None:
 			return tcon_byte
 		else:
@@ -107,9 +188,21 @@ class MCP4XXX(object):
 				mask <<= 4;
 			return tcon_byte & mask
 
+	def refresh(self):
+		"""Read TCON, STATUS and both wipers in one transaction, updates the shadow registers and returns STATUS"""
+		tcon, status, wiper0, wiper1 = self.transfer_batch([
+			(ADDRESS_TCON, COMMAND_READ, DATA_MASK_WORD),
+			(ADDRESS_STATUS, COMMAND_READ, DATA_MASK_WORD),
+			(ADDRESS_POT0_WIPER, COMMAND_READ, DATA_MASK_WORD),
+			(ADDRESS_POT1_WIPER, COMMAND_READ, DATA_MASK_WORD),
+		])
+		self._tcon = tcon & 0xFF
+		self._wipers = [wiper0, wiper1]
+		return status
+
 	@property
 	def hardware_shutdown_status(self):
-		return bool(self._transfer(ADDRESS_STATUS, COMMAND_READ, data=DATA_MASK_WORD)[1] & STATUS_SHUTDOWN_MASK)
+		return bool(self._transfer(ADDRESS_STATUS, COMMAND_READ, data=DATA_MASK_WORD) & STATUS_SHUTDOWN_MASK)
 
 	def get_shutdown(self, port=Port.P0):
 		return not self._get_tcon(mask=TCON_SHUTDOWN_MASK, port=port)
@@ -142,7 +235,9 @@ if __name__ == '__main__':
 	spi = busio.SPI(clock=board.GP2, MOSI=board.GP3, MISO=board.GP4)
 	res = MCP4XXX(spi,cs=board.GP5)
 
-	print("Hardware shutdown status:\t",res.hardware_shutdown_status)
+	# One transaction for the whole dump, every getter below is served from the shadow registers
+	status = res.refresh()
+	print("Hardware shutdown status:\t",bool(status & STATUS_SHUTDOWN_MASK))
 	print("Shutdown status:\t\t",res.get_shutdown(port=Port.P0),"\t",res.get_shutdown(port=Port.P1))
 	print("Wiper connected:\t\t",res.get_wiper_connected(port=Port.P0),"\t",res.get_wiper_connected(port=Port.P1))
 	print("A connected:\t\t\t",res.get_A_connected(port=Port.P0),"\t",res.get_A_connected(port=Port.P1))
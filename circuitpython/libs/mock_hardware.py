@@ -0,0 +1,319 @@
+"""
+Mock CircuitPython hardware to run and benchmark the libraries of this folder on a regular python install.
+
+	import mock_hardware
+	mock_hardware.install()  # registers the fake digitalio module
+	from MCP4XXX import MCP4XXX
+	pot = MCP4XXX(mock_hardware.MockSPI(mock_hardware.MockMCP4XXX()), cs="CS")
+	from M62429 import M62429
+	vol = M62429("DATA", "CLOCK")
+	chip = mock_hardware.MockM62429(vol.pin_data, vol.pin_clock)
+"""
+import sys
+import time
+
+def enum(**enums):
+    return type('Enum', (), enums)
+
+Direction = enum(INPUT="INPUT", OUTPUT="OUTPUT")
+Pull = enum(UP="UP", DOWN="DOWN")
+DriveMode = enum(PUSH_PULL="PUSH_PULL", OPEN_DRAIN="OPEN_DRAIN")
+
+class DigitalInOut(object):
+	"""digitalio.DigitalInOut stand-in, counts the writes and notifies the `listeners` on every change"""
+	def __init__(self, pin=None):
+		super(DigitalInOut, self).__init__()
+		self.pin = pin
+		self.direction = Direction.INPUT
+		self.pull = None
+		self.drive_mode = DriveMode.PUSH_PULL
+		self._value = False
+		self.writes = 0
+		self.listeners = []
+
+	def deinit(self):
+		self.listeners = []
+
+	def switch_to_output(self, value=False, drive_mode=DriveMode.PUSH_PULL):
+		self.direction = Direction.OUTPUT
+		self.drive_mode = drive_mode
+		self.value = value
+
+	def switch_to_input(self, pull=None):
+		self.direction = Direction.INPUT
+		self.pull = pull
+
+	@property
+	def value(self):
+		return self._value
+
+	@value.setter
+	def value(self, value):
+		value = bool(value)
+		self.writes += 1
+		if value != self._value:
+			self._value = value
+			for listener in self.listeners:
+				listener(self, value)
+
+def install():
+	"""Register this module as `digitalio` if the real one isn't available"""
+	try:
+		import digitalio
+	except ImportError:
+		sys.modules["digitalio"] = sys.modules[__name__]
+
+class MockMCP4XXX(object):
+	"""Register model of a MCP41xx/42xx: decodes the 8/16 bit commands and answers like the chip on MISO"""
+	def __init__(self, wiper=0x80):
+		super(MockMCP4XXX, self).__init__()
+		self.registers = {0b0000: wiper, 0b0001: wiper, 0b0100: 0x1FF, 0b0101: 0x1F0}
+		self.commands = 0
+
+	def exchange(self, data_out, data_in):
+		pos = 0
+		while pos < len(data_out):
+			command = data_out[pos]
+			address = command >> 4
+			operation = (command >> 2) & 0b11
+			self.commands += 1
+			if operation in (0b00, 0b11): # 16 bit write / read
+				if pos + 1 >= len(data_out):
+					break
+				if operation == 0b00:
+					self.registers[address] = ((command & 0b1) << 8) | data_out[pos + 1]
+				value = self.registers.get(address, 0x1FF)
+				data_in[pos] = 0xFE | ((value >> 8) & 0b1)
+				data_in[pos + 1] = value & 0xFF
+				pos += 2
+			else: # 8 bit increment / decrement
+				if address in (0b0000, 0b0001):
+					value = self.registers[address] + (1 if operation == 0b01 else -1)
+					self.registers[address] = min(max(value, 0), 0x100)
+				data_in[pos] = 0xFF
+				pos += 1
+
+class MockM62429(object):
+	"""
+	Listens to the data/clock pins of a M62429 driver, decodes the words on the latch condition,
+	records the shortest clock high/low and data setup/hold times seen and counts the ones under the datasheet minimums.
+	The times are the ones of the python running the mock, not of a board.
+	"""
+	# Datasheet minimums, in seconds
+	MIN_TIMINGS = {"clock_high": 1.6e-6, "clock_low": 1.6e-6, "data_setup": 0.8e-6, "data_hold": 0.8e-6}
+
+	def __init__(self, pin_data, pin_clock):
+		super(MockM62429, self).__init__()
+		self.pin_data = pin_data
+		self.pin_clock = pin_clock
+		self.attenuation = [None, None] # dB, 0 is full volume
+		self.words = []
+		self.errors = 0
+		self.min_clock_high = None
+		self.min_clock_low = None
+		self.min_data_setup = None
+		self.min_data_hold = None
+		self.violations = dict.fromkeys(self.MIN_TIMINGS, 0)
+		self._bits = []
+		self._last_clock_edge = None
+		self._last_rising_edge = None
+		self._last_data_change = None
+		pin_clock.listeners.append(self._on_clock)
+		pin_data.listeners.append(self._on_data)
+
+	def _record(self, name, width):
+		attribute = "min_" + name
+		current = getattr(self, attribute)
+		setattr(self, attribute, width if current is None else min(current, width))
+		if width < self.MIN_TIMINGS[name]:
+			self.violations[name] += 1
+
+	def _on_data(self, pin, value):
+		now = time.perf_counter()
+		if self._last_rising_edge is not None:
+			# First data change after a rising edge: hold time of the bit sampled on that edge
+			self._record("data_hold", now - self._last_rising_edge)
+			self._last_rising_edge = None
+		self._last_data_change = now
+
+	def _on_clock(self, pin, value):
+		now = time.perf_counter()
+		if self._last_clock_edge is not None:
+			# A rising edge ends a low period, a falling one a high period
+			self._record("clock_low" if value else "clock_high", now - self._last_clock_edge)
+		self._last_clock_edge = now
+		if value:
+			if self._last_data_change is not None:
+				# Data changed since the previous rising edge: setup time of this bit
+				self._record("data_setup", now - self._last_data_change)
+				self._last_data_change = None
+			self._last_rising_edge = now
+		if value:
+			self._bits.append(1 if self.pin_data.value else 0)
+		elif self.pin_data.value:
+			self._latch()
+
+	def _latch(self):
+		# Falling clock edge while data is high
+		bits, self._bits = self._bits, []
+		if len(bits) != 11 or bits[9] != 1 or bits[10] != 1:
+			self.errors += 1
+			return
+		word = sum(bit << i for i, bit in enumerate(bits))
+		self.words.append(word)
+		coarse = (word >> 2) & 0b11111
+		fine = (word >> 7) & 0b11
+		attenuation = (21 - coarse) * 4 + (3 - fine)
+		if word & 0b10:
+			self.attenuation[word & 0b1] = attenuation
+		else:
+			self.attenuation = [attenuation, attenuation]
+
+	def timing_warnings(self):
+		"""Datasheet minimums that were not met, as readable strings"""
+		return [
+			"%s %.2fus < %.2fus (%d times)" % (name, getattr(self, "min_" + name) * 1e6, minimum * 1e6, self.violations[name])
+			for name, minimum in self.MIN_TIMINGS.items() if self.violations[name]
+		]
+
+class MockSPI(object):
+	"""
+	busio.SPI stand-in. Forwards the transfers to `device` (if any) and accumulates the time the bytes
+	would have taken on the wire at the configured baudrate so throughput can be estimated off-device
+	"""
+	def __init__(self, device=None):
+		super(MockSPI, self).__init__()
+		self.device = device
+		self.locked = False
+		self.baudrate = 100000
+		self.transactions = 0
+		self.locks = 0
+		self.configures = 0
+		self.bytes = 0
+		self.bus_time = 0.0
+
+	def try_lock(self):
+		if self.locked:
+			return False
+		self.locked = True
+		self.locks += 1
+		return True
+
+	def unlock(self):
+		self.locked = False
+
+	def configure(self, baudrate=100000, polarity=0, phase=0, bits=8):
+		if not self.locked:
+			raise RuntimeError("SPI bus must be locked before configure")
+		self.baudrate = baudrate
+		self.configures += 1
+
+	def _account(self, count):
+		self.transactions += 1
+		self.bytes += count
+		self.bus_time += count * 8.0 / self.baudrate
+
+	def write(self, buffer, start=0, end=None):
+		end = len(buffer) if end is None else end
+		self._account(end - start)
+		if self.device is not None:
+			self.device.exchange(bytes(buffer[start:end]), bytearray(end - start))
+
+	def write_readinto(self, buffer_out, buffer_in, out_start=0, out_end=None, in_start=0, in_end=None):
+		out_end = len(buffer_out) if out_end is None else out_end
+		in_end = len(buffer_in) if in_end is None else in_end
+		if out_end - out_start != in_end - in_start:
+			raise ValueError("buffer slices must be of equal length")
+		self._account(out_end - out_start)
+		data_in = bytearray(b"\xff" * (in_end - in_start))
+		if self.device is not None:
+			self.device.exchange(bytes(buffer_out[out_start:out_end]), data_in)
+		buffer_in[in_start:in_end] = data_in
+
+	@property
+	def __dict__(self):
+		return {
+			"transactions": self.transactions,
+			"locks": self.locks,
+			"bytes": self.bytes,
+			"bus_time": round(self.bus_time, 6),
+		}
+
+def benchmark_mcp4xxx(iterations=1000):
+	"""Same sweep with and without the shadow registers / batching, returns the bus statistics of both"""
+	install()
+	from MCP4XXX import MCP4XXX, Port
+	results = {}
+	for name in ("uncached", "cached"):
+		spi = MockSPI(MockMCP4XXX())
+		pot = MCP4XXX(spi, cs="CS")
+		start = time.perf_counter()
+		for i in range(iterations):
+			value = (i // 4) % pot.max_value # Several writes of the same value, like a slow fader
+			if name == "uncached":
+				pot.set(value, port=Port.P0, force=True)
+				pot.set(value, port=Port.P1, force=True)
+				pot.get(port=Port.P0, cached=False)
+				pot.invalidate()
+				pot.set_shutdown(False)
+			else:
+				pot.set_both(value, value)
+				pot.get(port=Port.P0)
+				pot.set_shutdown(False)
+		elapsed = time.perf_counter() - start
+		result = spi.__dict__
+		result["cpu_time"] = round(elapsed, 6)
+		results[name] = result
+	return results
+
+def benchmark_m62429(iterations=1000):
+	"""
+	Volume write rate, pulse timings (flagged when under the datasheet minimums) and decoded result of a fade,
+	without delay, with a 2us delay and with the former 1ms per clock edge timing
+	"""
+	install()
+	from M62429 import M62429
+	results = {}
+	for name, speed, count in (("speed=0", 0, iterations), ("speed=2e-06", 2e-6, iterations // 10), ("speed=0.001", 0.001, 10)):
+		vol = M62429("DATA", "CLOCK", speed=speed)
+		device = MockM62429(vol.pin_data, vol.pin_clock)
+		start = time.perf_counter()
+		for i in range(count):
+			vol.setVolumeInternal(i % 101, channel=i % 2, both=False)
+		elapsed = time.perf_counter() - start
+		results[name] = {
+			"writes_per_second": round(vol.writes / elapsed, 1),
+			"pin_writes_per_word": (vol.pin_data.writes + vol.pin_clock.writes) // max(vol.writes, 1),
+			"min_clock_high_us": round(device.min_clock_high * 1e6, 2),
+			"min_clock_low_us": round(device.min_clock_low * 1e6, 2),
+			"min_data_setup_us": round(device.min_data_setup * 1e6, 2),
+			"min_data_hold_us": round(device.min_data_hold * 1e6, 2),
+			"timing_warnings": device.timing_warnings(),
+			"decode_errors": device.errors,
+		}
+
+	# 1s fade polled every millisecond: the writes are coalesced to the distinct volume steps
+	vol = M62429("DATA", "CLOCK")
+	device = MockM62429(vol.pin_data, vol.pin_clock)
+	vol.setVolume(0)
+	vol.fade(100, duration=1.0)
+	now = time.monotonic()
+	polls = 0
+	for step in range(1001):
+		vol.update(now=now + step / 1000.0)
+		polls += 1
+	results["fade"] = {
+		"polls": polls,
+		"writes": vol.writes,
+		"skipped": vol.skipped,
+		"final_attenuation": device.attenuation,
+	}
+	return results
+
+if __name__ == '__main__':
+	for name, result in benchmark_mcp4xxx().items():
+		print(name, result)
+	for name, result in benchmark_m62429().items():
+		print(name, result)
+		for warning in result.get("timing_warnings", ()):
+			print("WARNING: %s pulses under the M62429 datasheet minimum: %s" % (name, warning))
@@ -0,0 +1,190 @@
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import tty
+
+import serial
+
+from artnet_receiver import ArtnetPacket, Receiver
+from artnet_serial_bridge import BridgeReceiver, BridgeSender
+
+ARTNET_PORT = 0x1936
+FRAME_COUNTER = struct.Struct("!H")  # Last two channels of every generated universe
+
+
+class PtyMasterPort:
+	"""
+	Write side of a pty pair with the write()/baudrate BridgeSender uses. The receiver opens `slave_path` with a real
+	serial.Serial, the same way the CLI opens its port, so the measured latency includes pyserial's read behaviour
+	"""
+	def __init__(self, baudrate):
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.master)
+		tty.setraw(self.slave)
+		self.slave_path = os.ttyname(self.slave)
+		self.baudrate = baudrate
+
+	def write(self, data):
+		view = memoryview(data)
+		while view:
+			view = view[os.write(self.master, view):]
+		return len(data)
+
+	def close(self):
+		os.close(self.master)
+		os.close(self.slave)
+
+
+def show_frame(universe, counter, fps, moving_channels=24, scene_every=5.0, channels=512):
+	"""
+	Synthetic lighting show: a static scene changing every `scene_every` seconds, `moving_channels` sine fades
+	and the frame counter in the last two channels (used to measure latency and check the reconstruction)
+	"""
+	scene = int(counter / fps // scene_every)
+	frame = bytearray(random.Random(universe * 100003 + scene).randbytes(channels))
+	t = counter / fps
+	for channel in range(moving_channels):
+		frame[channel] = int(127.5 + 127.5 * math.sin(t * 2 + channel * 0.3))
+	FRAME_COUNTER.pack_into(frame, channels - FRAME_COUNTER.size, counter & 0xFFFF)
+	return bytes(frame)
+
+
+def percentile(sorted_values, p):
+	if not sorted_values:
+		return 0
+	return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def run_benchmark(baudrate=115200, universes=1, fps=44, duration=5.0, keyframe_interval=1.0, moving_channels=24, artnet=None):
+	"""
+	Art-Net (UDP to `artnet`, a running artnet_receiver.Receiver, or straight to the sender if None) -> BridgeSender -> pty ->
+	serial.Serial -> BridgeReceiver -> Art-Net (UDP to a local socket), measures delivered frame rate, latency and reconstruction errors
+	"""
+	pty = PtyMasterPort(baudrate)
+	# Same settings as the receive CLI
+	ser = serial.Serial(pty.slave_path, baudrate, timeout=0.1)
+
+	output = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	output.bind(("127.0.0.1", 0))
+	output.settimeout(0.1)
+	bridge_receiver = BridgeReceiver(ser, target=output.getsockname())
+	sender = BridgeSender(pty, keyframe_interval=keyframe_interval)
+
+	if artnet is not None:
+		artnet.callback = sender.callback
+
+	sent_at = {}
+	latencies = []
+	delivered = {universe: 0 for universe in range(universes)}
+	stats = {"mismatches": 0, "unknown": 0}
+	running = True
+
+	def collect():
+		while running:
+			try:
+				data, _ = output.recvfrom(2048)
+			except socket.timeout:
+				continue
+			now = time.perf_counter()
+			packet = ArtnetPacket.unpack_raw_artnet_packet(data)
+			(counter,) = FRAME_COUNTER.unpack_from(packet.data, len(packet.data) - FRAME_COUNTER.size)
+			key = (packet.universe, counter)
+			if key not in sent_at:
+				stats["unknown"] += 1
+				continue
+			start, expected = sent_at[key]
+			if packet.data != expected:
+				stats["mismatches"] += 1
+			# Keyframes repeat a frame already delivered, only the first delivery has a meaningful latency
+			if start is not None:
+				latencies.append(now - start)
+				sent_at[key] = (None, expected)
+				delivered[packet.universe] += 1
+
+	collector = threading.Thread(target=collect, daemon=True)
+	bridge_receiver.start()
+	sender.start()
+	collector.start()
+
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	frames = int(duration * fps)
+	start = time.perf_counter()
+	for counter in range(frames):
+		deadline = start + counter / fps
+		delay = deadline - time.perf_counter()
+		if delay > 0:
+			time.sleep(delay)
+		for universe in range(universes):
+			data = show_frame(universe, counter, fps, moving_channels=moving_channels)
+			sent_at[(universe, counter & 0xFFFF)] = (time.perf_counter(), data)
+			if artnet is not None:
+				sock.sendto(ArtnetPacket.pack_raw_artnet_packet(universe, data, counter % 255 + 1), ("127.0.0.1", ARTNET_PORT))
+			else:
+				sender.submit(universe, data)
+	elapsed = time.perf_counter() - start
+	time.sleep(0.5)
+
+	running = False
+	sender.stop()
+	bridge_receiver.stop()
+	if artnet is not None:
+		artnet.callback = None
+	collector.join()
+	sender.join()
+	bridge_receiver.join()
+	ser.close()
+	pty.close()
+	sock.close()
+	output.close()
+
+	latencies.sort()
+	delivered_frames = sum(delivered.values())
+	return {
+		"baudrate": baudrate,
+		"universes": universes,
+		"input_fps": round(frames / elapsed, 1),
+		"delivered_fps_per_universe": round(delivered_frames / universes / elapsed, 1),
+		"delivered_ratio": round(delivered_frames / (frames * universes), 3),
+		"latency_ms_p50": round(percentile(latencies, 50) * 1000, 2),
+		"latency_ms_p99": round(percentile(latencies, 99) * 1000, 2),
+		"mismatches": stats["mismatches"],
+		"link_bytes_per_second": round(sender.bytes_sent / elapsed, 1),
+		"link_capacity_bytes_per_second": baudrate // 10,
+		# Plain ArtDmx frames at the input rate, what a SLIP link would have had to carry (before SLIP/IP/UDP overhead)
+		"raw_artdmx_bytes_per_second": round(frames * universes * (18 + 512) / elapsed, 1),
+		"sender": sender.__dict__,
+		"receiver": bridge_receiver.__dict__,
+	}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="End to end Art-Net -> serial bridge -> Art-Net benchmark over a local pty pair")
+	parser.add_argument("--baud", type=int, nargs="+", default=[115200], help="Simulated link speed(s), the sender paces itself to it")
+	parser.add_argument("--universes", type=int, default=1)
+	parser.add_argument("--fps", type=float, default=44)
+	parser.add_argument("--duration", type=float, default=5.0)
+	parser.add_argument("--keyframe-interval", type=float, default=1.0)
+	parser.add_argument("--moving-channels", type=int, default=24, help="Channels fading every frame")
+	parser.add_argument("--direct", action="store_true", help="Hand the frames to the sender directly instead of going through UDP and artnet_receiver")
+	args = parser.parse_args()
+
+	# One receiver for every run, it owns the Art-Net port until the process exits
+	artnet = None
+	if not args.direct:
+		artnet = Receiver()
+		artnet.daemon = True
+		artnet.start()
+
+	results = []
+	for baudrate in args.baud:
+		results.append(run_benchmark(
+			baudrate=baudrate, universes=args.universes, fps=args.fps, duration=args.duration,
+			keyframe_interval=args.keyframe_interval, moving_channels=args.moving_channels, artnet=artnet
+		))
+	print(json.dumps(results, indent=4))
@@ -1,3 +1,5 @@
+import argparse
+import logging
 import socket
 from threading import Thread
 import time
@@ -5,6 +7,11 @@ import sys
 import time
 import struct
 
+from metrics import REGISTRY, MetricsServer, Snapshotter
+
+ARTNET_PACKETS = REGISTRY.counter("artnet_packets_total", "Art-Net datagrams received, by result (parsed or dropped when not an ArtDmx packet)", ("result",))
+ARTNET_BYTES = REGISTRY.counter("artnet_received_bytes_total", "Bytes of the received Art-Net datagrams")
+
 
 class ArtnetPacket:
 	ARTNET_HEADER = b'Art-Net\x00'
@@ -43,10 +50,17 @@ class ArtnetPacket:
 		(packet.universe,) = struct.unpack('<H', raw_data[14:16])
 		(packet.data,) = struct.unpack('{0}s'.format(int(packet.length)), raw_data[18:18 + int(packet.length)])
 
-		packet.dmx = [int(str(b)) for b in packet.data]
+		packet.dmx = list(packet.data)
 
 		return packet
 
+	@staticmethod
+	def pack_raw_artnet_packet(universe, data, sequence=0, physical=0):
+		# ArtDmx payloads have an even length between 2 and 512
+		if len(data) % 2:
+			data = bytes(data) + b'\x00'
+		return struct.pack('!8sHHBB', ArtnetPacket.ARTNET_HEADER, ArtnetPacket.OP_OUTPUT, 14, sequence & 0xFF, physical) + struct.pack('<H', universe) + struct.pack('!H', len(data)) + bytes(data)
+
 
 class Receiver(Thread):
 	def __init__(self):
@@ -60,13 +74,52 @@ class Receiver(Thread):
 		self.sock.bind((UDP_IP, UDP_PORT))
 		self.callback = None
 
+		self._parsed = ARTNET_PACKETS.labels("parsed")
+		self._dropped = ARTNET_PACKETS.labels("dropped")
+
 	def stop(self):
 		self.running = False
 
 	def run(self):
+		# Bound once, the loop only pays a per thread counter increment per packet
+		count_parsed = self._parsed.inc
+		count_dropped = self._dropped.inc
+		count_bytes = ARTNET_BYTES.labels().inc
 		while self.running:
 			data, addr = self.sock.recvfrom(1024)
-			packet = ArtnetPacket.unpack_raw_artnet_packet(data)
+			count_bytes(len(data))
+			try:
+				packet = ArtnetPacket.unpack_raw_artnet_packet(data)
+			except struct.error:
+				# Truncated datagram
+				packet = None
 			if packet is not None:
+				count_parsed()
 				if self.callback is not None:
 					self.callback(packet)
+			else:
+				count_dropped()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Art-Net receiver with the metrics endpoint and periodic snapshots")
+	parser.add_argument("--metrics-host", default="127.0.0.1")
+	parser.add_argument("--metrics-port", type=int, default=9464)
+	parser.add_argument("--interval", type=float, default=10.0, help="Seconds between metrics snapshots")
+	parser.add_argument("--snapshot-file", default=None, help="Append the snapshots to this file instead of logging them")
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+
+	receiver = Receiver()
+	receiver.daemon = True
+	receiver.start()
+	server = MetricsServer(host=args.metrics_host, port=args.metrics_port).start()
+	snapshotter = Snapshotter(interval=args.interval, path=args.snapshot_file).start()
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	snapshotter.stop()
+	server.stop()
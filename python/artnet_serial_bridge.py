@@ -0,0 +1,404 @@
+import argparse
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+
+import serial
+
+from artnet_receiver import ArtnetPacket, Receiver
+from metrics import REGISTRY
+from serial_bench.framing import FrameParser, build_frame
+
+logger = logging.getLogger(__name__)
+
+KEYFRAME = 0x01
+DELTA = 0x02
+# kind, universe, dmx length, version (per universe, +1 every frame sent so the far side detects missing deltas)
+PAYLOAD_HEADER = struct.Struct("<BHHB")
+DMX_CHANNELS = 512
+
+# Channel ops: SKIP n unchanged channels, LITERAL n values, RUN n times the same value
+OP_SKIP = 0x00
+OP_LITERAL = 0x40
+OP_RUN = 0x80
+MAX_SKIP = 64
+MAX_LITERAL = 64
+MAX_RUN = 128
+
+BRIDGE_FRAMES = REGISTRY.counter("artnet_bridge_frames_total", "DMX frames handled by the serial bridge sender, by result", ("result",))
+BRIDGE_BYTES = REGISTRY.counter("artnet_bridge_serial_bytes_total", "Bytes written to the serial link by the bridge sender")
+
+
+class BridgeException(Exception):
+	pass
+
+
+def encode_channels(data, previous=None):
+	"""
+	Channel ops turning `previous` into `data` (keyframes are encoded against an all zero universe).
+	Unchanged channels are skipped (trailing ones are not even encoded), runs of 3+ equal values are run length encoded
+	"""
+	out = bytearray()
+	length = len(data)
+	if previous is None:
+		previous = bytes(length)
+	elif len(previous) != length:
+		raise BridgeException("Can't encode a %d channels universe against a %d channels one" % (length, len(previous)))
+	literal = bytearray()
+
+	def flush_literal():
+		for start in range(0, len(literal), MAX_LITERAL):
+			chunk = literal[start:start + MAX_LITERAL]
+			out.append(OP_LITERAL | (len(chunk) - 1))
+			out.extend(chunk)
+		literal.clear()
+
+	i = 0
+	while i < length:
+		if data[i] == previous[i]:
+			j = i + 1
+			while j < length and data[j] == previous[j]:
+				j += 1
+			# A single unchanged channel inside changed ones is cheaper as part of the literal
+			if j - i >= 2 or not literal:
+				flush_literal()
+				if j == length:
+					break
+				skip = j - i
+				while skip:
+					n = min(skip, MAX_SKIP)
+					out.append(OP_SKIP | (n - 1))
+					skip -= n
+				i = j
+				continue
+
+		value = data[i]
+		j = i + 1
+		while j < length and j - i < MAX_RUN and data[j] == value:
+			j += 1
+		if j - i >= 3:
+			flush_literal()
+			out.append(OP_RUN | (j - i - 1))
+			out.append(value)
+			i = j
+		else:
+			literal.append(value)
+			i += 1
+	flush_literal()
+	return bytes(out)
+
+
+def decode_channels(ops, state):
+	"""
+	Apply channel ops to `state` (bytearray) in place
+	"""
+	pos = 0
+	i = 0
+	length = len(state)
+	end = len(ops)
+	while pos < end:
+		op = ops[pos]
+		pos += 1
+		if op & OP_RUN:
+			n = (op & 0x7F) + 1
+			if i + n > length or pos >= end:
+				raise BridgeException("Run past the end of the universe")
+			state[i:i + n] = bytes((ops[pos],)) * n
+			pos += 1
+		elif op & OP_LITERAL:
+			n = (op & 0x3F) + 1
+			if i + n > length or pos + n > end:
+				raise BridgeException("Literal past the end of the universe")
+			state[i:i + n] = ops[pos:pos + n]
+			pos += n
+		else:
+			n = (op & 0x3F) + 1
+		i += n
+	return state
+
+
+class UniverseEncoder:
+	"""
+	Sender side state of one universe: what the far side has (last frame sent), its version and keyframe schedule
+	"""
+	def __init__(self, universe, keyframe_interval=1.0):
+		self.universe = universe
+		self.keyframe_interval = keyframe_interval
+		self.sent = None
+		self.version = 0
+		self.next_keyframe = 0
+
+	def encode(self, data, now, force_keyframe=False):
+		"""
+		Returns the payload to send, None if nothing changed and no keyframe is due
+		"""
+		keyframe = force_keyframe or self.sent is None or len(data) != len(self.sent) or now >= self.next_keyframe
+		if not keyframe and data == self.sent:
+			return None
+		if keyframe:
+			kind = KEYFRAME
+			ops = encode_channels(data)
+			self.next_keyframe = now + self.keyframe_interval
+		else:
+			kind = DELTA
+			ops = encode_channels(data, self.sent)
+		self.version = (self.version + 1) & 0xFF
+		self.sent = bytes(data)
+		return PAYLOAD_HEADER.pack(kind, self.universe, len(data), self.version) + ops
+
+
+class BridgeSender(threading.Thread):
+	"""
+	Art-Net -> serial. Frames are handed over with submit() (or as the callback of artnet_receiver.Receiver),
+	the sender thread paces its writes to what the link can carry (`baudrate` / 10 * `utilization` bytes/s)
+	and only the latest frame of each universe is kept while it waits: the frame rate adapts to the link.
+	"""
+	def __init__(self, ser, baudrate=None, utilization=0.9, keyframe_interval=1.0, keyframe_share=0.25):
+		threading.Thread.__init__(self, name="Art-Net bridge sender", daemon=True)
+		self.ser = ser
+		self.bytes_per_second = (baudrate or ser.baudrate) / 10.0 * utilization
+		self.keyframe_interval = keyframe_interval
+		# On slow links the keyframes are spaced out so they use at most this fraction of the link
+		self.keyframe_share = keyframe_share
+		self.running = True
+		self._condition = threading.Condition()
+		self._pending = {}
+		self._encoders = {}
+		self._sequence = 0
+		self._next_slot = 0
+
+		self.frames_in = 0
+		self.frames_sent = 0
+		self.keyframes = 0
+		self.coalesced = 0
+		self.unchanged = 0
+		self.write_errors = 0
+		self.bytes_sent = 0
+		self.raw_bytes = 0  # what the same frames would have been as ArtDmx packets
+		self._sent_total = BRIDGE_FRAMES.labels("sent")
+		self._coalesced_total = BRIDGE_FRAMES.labels("coalesced")
+		self._unchanged_total = BRIDGE_FRAMES.labels("unchanged")
+		self._bytes_total = BRIDGE_BYTES.labels()
+
+	def submit(self, universe, data):
+		with self._condition:
+			self.frames_in += 1
+			if universe in self._pending:
+				# The link did not keep up, the previous frame of this universe is dropped
+				self.coalesced += 1
+				self._coalesced_total.inc()
+			self._pending[universe] = bytes(data)
+			self._condition.notify()
+
+	def callback(self, packet):
+		self.submit(packet.universe, packet.data)
+
+	def stop(self):
+		with self._condition:
+			self.running = False
+			self._condition.notify()
+
+	def _next_keyframe(self):
+		if not self._encoders:
+			return None
+		return min(encoder.next_keyframe for encoder in self._encoders.values())
+
+	def _wait_for_work(self):
+		"""
+		Wait for a frame or a keyframe, then for the next free slot on the link. Returns the frames to encode
+		"""
+		with self._condition:
+			while self.running and not self._pending:
+				next_keyframe = self._next_keyframe()
+				timeout = None if next_keyframe is None else next_keyframe - time.monotonic()
+				if timeout is not None and timeout <= 0:
+					break
+				self._condition.wait(timeout)
+			if not self.running:
+				return None
+			delay = self._next_slot - time.monotonic()
+			if delay > 0:
+				# Frames submitted meanwhile replace the pending ones (coalesced)
+				self._condition.wait_for(lambda: not self.running, timeout=delay)
+			pending = self._pending
+			self._pending = {}
+		now = time.monotonic()
+		# Keyframes due for universes without a new frame are sent from the last state sent
+		for universe, encoder in self._encoders.items():
+			if universe not in pending and now >= encoder.next_keyframe:
+				pending[universe] = encoder.sent
+		return pending
+
+	def _write(self, frame):
+		try:
+			self.ser.write(frame)
+		except serial.SerialTimeoutException:
+			self.write_errors += 1
+			return
+		self.bytes_sent += len(frame)
+		self._bytes_total.inc(len(frame))
+		now = time.monotonic()
+		self._next_slot = max(self._next_slot, now) + len(frame) / self.bytes_per_second
+
+	def run(self):
+		while self.running:
+			pending = self._wait_for_work()
+			if pending is None:
+				return
+			now = time.monotonic()
+			for universe, data in pending.items():
+				encoder = self._encoders.get(universe)
+				if encoder is None:
+					encoder = self._encoders[universe] = UniverseEncoder(universe, self.keyframe_interval)
+				payload = encoder.encode(data, now)
+				if payload is None:
+					self.unchanged += 1
+					self._unchanged_total.inc()
+					continue
+				frame = build_frame(self._sequence, payload)
+				if payload[0] == KEYFRAME:
+					self.keyframes += 1
+					minimum_interval = len(self._encoders) * len(frame) / (self.bytes_per_second * self.keyframe_share)
+					encoder.next_keyframe = now + max(self.keyframe_interval, minimum_interval)
+				self._write(frame)
+				self._sequence += 1
+				self.frames_sent += 1
+				self.raw_bytes += 18 + len(data)
+				self._sent_total.inc()
+
+	@property
+	def __dict__(self):
+		return {
+			"frames_in": self.frames_in,
+			"frames_sent": self.frames_sent,
+			"keyframes": self.keyframes,
+			"coalesced": self.coalesced,
+			"unchanged": self.unchanged,
+			"write_errors": self.write_errors,
+			"bytes_sent": self.bytes_sent,
+			"compression_ratio": round(self.raw_bytes / self.bytes_sent, 2) if self.bytes_sent else None,
+		}
+
+
+class BridgeReceiver(threading.Thread):
+	"""
+	serial -> Art-Net. Rebuilds every universe from the keyframes and deltas and sends it as an ArtDmx packet to
+	`target` (host, port) and/or hands (universe, data) to `callback`. After a lost frame the universe is frozen until the next keyframe.
+	`read_size` caps a single read of the serial port.
+	"""
+	def __init__(self, ser, target=None, callback=None, read_size=4096):
+		threading.Thread.__init__(self, name="Art-Net bridge receiver", daemon=True)
+		self.ser = ser
+		self.target = target
+		self.callback = callback
+		self.read_size = read_size
+		self.running = True
+		self.parser = FrameParser(max_payload=PAYLOAD_HEADER.size + DMX_CHANNELS * 2)
+		self.universes = {}
+		self._versions = {}
+		self._sequences = {}
+		self.sock = None
+		if target is not None:
+			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+
+		self.frames = 0
+		self.keyframes = 0
+		self.desynced = 0
+		self.decode_errors = 0
+
+	def stop(self):
+		self.running = False
+
+	def handle_payload(self, payload):
+		kind, universe, length, version = PAYLOAD_HEADER.unpack_from(payload)
+		ops = payload[PAYLOAD_HEADER.size:]
+		if kind == KEYFRAME:
+			state = bytearray(length)
+			self.keyframes += 1
+		else:
+			state = self.universes.get(universe)
+			if state is None or len(state) != length or self._versions.get(universe) != (version - 1) & 0xFF:
+				# A frame of this universe was lost, its deltas can't be applied until the next keyframe
+				self.desynced += 1
+				self._versions.pop(universe, None)
+				return
+		try:
+			decode_channels(ops, state)
+		except BridgeException as e:
+			self.decode_errors += 1
+			logger.debug("Universe %d: %s", universe, e)
+			self._versions.pop(universe, None)
+			return
+		self.universes[universe] = state
+		self._versions[universe] = version
+		self.frames += 1
+		self._emit(universe, state)
+
+	def _emit(self, universe, state):
+		if self.sock is not None:
+			sequence = self._sequences.get(universe, 0) % 255 + 1  # 0 means sequencing disabled
+			self._sequences[universe] = sequence
+			self.sock.sendto(ArtnetPacket.pack_raw_artnet_packet(universe, state, sequence), self.target)
+		if self.callback is not None:
+			self.callback(universe, bytes(state))
+
+	def run(self):
+		while self.running:
+			# Only what already arrived (at least 1 byte, waiting up to the port timeout): asking for more would make
+			# pyserial wait for the whole timeout on every frame smaller than read_size
+			data = self.ser.read(min(self.ser.in_waiting, self.read_size) or 1)
+			if not data:
+				continue
+			for _, payload in self.parser.feed(data):
+				self.handle_payload(payload)
+
+	@property
+	def __dict__(self):
+		stats = {
+			"frames": self.frames,
+			"keyframes": self.keyframes,
+			"desynced": self.desynced,
+			"decode_errors": self.decode_errors,
+		}
+		stats.update({"link_" + key: value for key, value in self.parser.__dict__.items()})
+		return stats
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Art-Net over a serial link with delta/RLE encoding (see artnet_bridge_bench.py for a local benchmark)")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	send = subparsers.add_parser("send", help="Forward the Art-Net received on 127.0.0.1:6454 to the serial port")
+	send.add_argument("--port", required=True)
+	send.add_argument("--baud", type=int, default=115200)
+	send.add_argument("--keyframe-interval", type=float, default=1.0, help="Seconds between full frames of a universe")
+	send.add_argument("--utilization", type=float, default=0.9, help="Fraction of the link rate the sender may use")
+	receive = subparsers.add_parser("receive", help="Rebuild the Art-Net stream from the serial port")
+	receive.add_argument("--port", required=True)
+	receive.add_argument("--baud", type=int, default=115200)
+	receive.add_argument("--target", default="127.0.0.1", help="Art-Net node to send the universes to")
+	receive.add_argument("--target-port", type=int, default=0x1936)
+	parser.add_argument("--stats-interval", type=float, default=10.0)
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+
+	if args.command == "send":
+		ser = serial.Serial(args.port, args.baud, write_timeout=1)
+		bridge = BridgeSender(ser, keyframe_interval=args.keyframe_interval, utilization=args.utilization)
+		artnet = Receiver()
+		artnet.daemon = True
+		artnet.callback = bridge.callback
+		artnet.start()
+	else:
+		ser = serial.Serial(args.port, args.baud, timeout=0.1)
+		bridge = BridgeReceiver(ser, target=(args.target, args.target_port))
+	bridge.start()
+	try:
+		while bridge.is_alive():
+			bridge.join(args.stats_interval)
+			logger.info("%s", json.dumps(bridge.__dict__))
+	except KeyboardInterrupt:
+		bridge.stop()
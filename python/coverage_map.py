@@ -0,0 +1,289 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import math
+import os
+import time
+
+import ephem
+import numpy as np
+
+from tle_index import build_index
+
+logger = logging.getLogger(__name__)
+
+UNIX_EPOCH = ephem.Date("1970/1/1")
+# WGS84
+EARTH_A = 6378137.0
+EARTH_E2 = 6.69437999014e-3
+
+
+def geodetic_to_ecef(lat, lon, height):
+	"""
+	lat/lon in radians, height in meters (arrays of any shape), returns (..., 3) ECEF coordinates in meters
+	"""
+	sin_lat = np.sin(lat)
+	n = EARTH_A / np.sqrt(1 - EARTH_E2 * sin_lat * sin_lat)
+	cos_lat = np.cos(lat)
+	return np.stack((
+		(n + height) * cos_lat * np.cos(lon),
+		(n + height) * cos_lat * np.sin(lon),
+		(n * (1 - EARTH_E2) + height) * sin_lat,
+	), axis=-1)
+
+
+def up_vectors(lat, lon):
+	"""
+	Unit normal to the ellipsoid (local zenith) for geodetic lat/lon in radians
+	"""
+	cos_lat = np.cos(lat)
+	return np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1)
+
+
+class CoverageResult:
+	"""
+	Per grid point arrays of shape (len(lats), len(lons)), ready for a heatmap (imshow(result.visible_fraction, origin="lower"))
+	"""
+	def __init__(self, names, lats, lons, start, step, steps, min_elevation, arrays, elapsed):
+		self.names = names
+		self.lats = lats
+		self.lons = lons
+		self.start = start
+		self.step = step
+		self.steps = steps
+		self.min_elevation = min_elevation
+		self.elapsed = elapsed
+		shape = (len(lats), len(lons))
+		# Fraction of the time steps with at least one satellite above min_elevation
+		self.visible_fraction = arrays["visible_steps"].reshape(shape) / steps
+		# Highest elevation reached by any satellite (deg)
+		self.max_elevation = np.degrees(np.arcsin(np.clip(arrays["max_sin_elevation"], -1, 1))).reshape(shape)
+		# Number of coverage intervals (a pass of two overlapping satellites counts once)
+		self.pass_count = arrays["passes"].reshape(shape)
+		# Revisit statistics: longest and mean time without any coverage (s), gaps still open at the end of the window included
+		self.max_gap = arrays["max_gap"].reshape(shape) * step
+		gap_count = arrays["gap_count"]
+		with np.errstate(invalid="ignore", divide="ignore"):
+			self.mean_gap = np.where(gap_count > 0, arrays["gap_sum"] / gap_count, np.nan).reshape(shape) * step
+		# Per satellite visible fraction, shape (satellites, lats, lons)
+		self.satellite_fraction = arrays["satellite_steps"].reshape((len(names),) + shape) / steps
+
+	def save(self, path):
+		np.savez_compressed(
+			path, names=np.array(self.names), lats=self.lats, lons=self.lons, start=self.start, step=self.step,
+			min_elevation=self.min_elevation, visible_fraction=self.visible_fraction, max_elevation=self.max_elevation,
+			pass_count=self.pass_count, max_gap=self.max_gap, mean_gap=self.mean_gap, satellite_fraction=self.satellite_fraction
+		)
+
+	def __str__(self):
+		return "<CoverageResult Satellites:%d Grid:%dx%d Steps:%d>" % (len(self.names), len(self.lats), len(self.lons), self.steps)
+
+	def __repr__(self):
+		return self.__str__()
+
+	@property
+	def __dict__(self):
+		return {
+			"satellites": self.names,
+			"grid": [len(self.lats), len(self.lons)],
+			"start": self.start,
+			"step": self.step,
+			"steps": self.steps,
+			"min_elevation": self.min_elevation,
+			"mean_visible_fraction": round(float(self.visible_fraction.mean()), 4),
+			"never_covered_points": int((self.pass_count == 0).sum()),
+			"worst_max_gap": float(self.max_gap.max()),
+			"elapsed": round(self.elapsed, 3),
+		}
+
+
+# Satellite positions shared with the worker processes once (ProcessPoolExecutor initializer)
+_worker_satellites = None
+
+
+def _init_worker(satellites):
+	global _worker_satellites
+	_worker_satellites = satellites
+
+
+def _evaluate_points(ground, up, sin_min_elevation, chunk_steps, satellites=None):
+	"""
+	Streams the time window over a chunk of grid points, `satellites` is the (steps, satellites, 3) ECEF array.
+	Only (chunk_steps, satellites, points) arrays are alive at once, the revisit state is carried between time chunks
+	"""
+	satellites = _worker_satellites if satellites is None else satellites
+	steps, satellite_count = satellites.shape[:2]
+	points = ground.shape[0]
+
+	visible_steps = np.zeros(points, dtype=np.int32)
+	satellite_steps = np.zeros((satellite_count, points), dtype=np.int32)
+	max_sin_elevation = np.full(points, -1.0)
+	passes = np.zeros(points, dtype=np.int32)
+	max_gap = np.zeros(points, dtype=np.int64)
+	gap_sum = np.zeros(points, dtype=np.int64)
+	gap_count = np.zeros(points, dtype=np.int32)
+	# Revisit state carried between time chunks: last step with coverage (-1: not covered yet) and coverage at the previous step
+	last_visible = np.full(points, -1, dtype=np.int64)
+	previous = np.zeros(points, dtype=bool)
+	up_dot_ground = np.einsum("pk,pk->p", up, ground)
+	ground_squared = np.einsum("pk,pk->p", ground, ground)
+
+	for start in range(0, steps, chunk_steps):
+		positions = satellites[start:start + chunk_steps]
+		count = positions.shape[0]
+		flat = positions.reshape(-1, 3)
+		# Satellite to ground point range vectors, elevation = asin(range . up / |range|)
+		# both terms are expanded into matrix products to avoid materializing the (steps, satellites, points, 3) vectors
+		along_up = flat @ up.T
+		along_up -= up_dot_ground
+		distance = flat @ ground.T
+		distance *= -2
+		distance += ground_squared
+		distance += np.einsum("nk,nk->n", flat, flat)[:, None]
+		np.sqrt(distance, out=distance)
+		along_up /= distance
+		sin_elevation = along_up.reshape(count, satellite_count, points)
+
+		visible_by = sin_elevation >= sin_min_elevation
+		satellite_steps += visible_by.sum(axis=0, dtype=np.int32)
+		np.maximum(max_sin_elevation, sin_elevation.max(axis=(0, 1)), out=max_sin_elevation)
+		visible = visible_by.any(axis=1)
+		visible_steps += visible.sum(axis=0, dtype=np.int32)
+
+		# Index of the last covered step at every step of the chunk, the gap length is the distance to it
+		index = np.arange(start, start + count)[:, None]
+		marks = np.where(visible, index, -1)
+		np.maximum.accumulate(marks, axis=0, out=marks)
+		np.maximum(marks, last_visible, out=marks)
+		np.maximum(max_gap, (index - marks).max(axis=0), out=max_gap)
+
+		previous_marks = np.concatenate((last_visible[None], marks[:-1]))
+		previous_visible = np.concatenate((previous[None], visible[:-1]))
+		rising = visible & ~previous_visible
+		passes += rising.sum(axis=0, dtype=np.int32)
+		# A gap ends with a rising edge, only gaps between two coverage intervals count as revisits
+		ended = rising & (previous_marks >= 0)
+		gap_sum += np.where(ended, index - previous_marks - 1, 0).sum(axis=0)
+		gap_count += ended.sum(axis=0, dtype=np.int32)
+		last_visible = marks[-1]
+		previous = visible[-1]
+
+	return {
+		"visible_steps": visible_steps,
+		"satellite_steps": satellite_steps,
+		"max_sin_elevation": max_sin_elevation,
+		"passes": passes,
+		"max_gap": max_gap,
+		"gap_sum": gap_sum,
+		"gap_count": gap_count,
+	}
+
+
+class CoverageMap:
+	"""
+	Visibility / revisit statistics of a set of satellites over a lat/lon grid.
+
+	`satellites` is TLEManger.satellites (name -> CustomSatellite) or a name -> ephem.EarthSatellite dict.
+	Every satellite is propagated once per time step with pyephem (sub-satellite point), the grid geometry is
+	evaluated with NumPy in chunks of `chunk_points` points x `chunk_steps` time steps, chunks spread over `workers` processes.
+	"""
+	def __init__(self, satellites, lat_range=(-90, 90), lon_range=(-180, 180), resolution=1.0, min_elevation=0.0, altitude=0.0):
+		self.names = []
+		self.bodies = []
+		for name, satellite in satellites.items():
+			self.names.append(name)
+			self.bodies.append(getattr(satellite, "pyephem_sat", satellite))
+		if not self.bodies:
+			raise ValueError("No satellites to compute the coverage of")
+
+		self.lats = np.arange(lat_range[0], lat_range[1] + resolution / 2, resolution)
+		self.lons = np.arange(lon_range[0], lon_range[1] + resolution / 2, resolution)
+		if lon_range[1] - lon_range[0] >= 360:
+			self.lons = self.lons[self.lons < lon_range[0] + 360]  # -180 and 180 are the same meridian
+		self.min_elevation = min_elevation
+
+		lat_grid, lon_grid = np.meshgrid(np.radians(self.lats), np.radians(self.lons), indexing="ij")
+		self.ground = geodetic_to_ecef(lat_grid.ravel(), lon_grid.ravel(), altitude)
+		self.up = up_vectors(lat_grid.ravel(), lon_grid.ravel())
+
+	def __str__(self):
+		return "<CoverageMap Satellites:%d Grid:%dx%d>" % (len(self.names), len(self.lats), len(self.lons))
+
+	def __repr__(self):
+		return self.__str__()
+
+	def satellite_positions(self, start, step, steps):
+		"""
+		(steps, satellites, 3) ECEF positions in meters
+		"""
+		lat = np.empty((steps, len(self.bodies)))
+		lon = np.empty((steps, len(self.bodies)))
+		height = np.empty((steps, len(self.bodies)))
+		for i in range(steps):
+			date = ephem.Date(UNIX_EPOCH + (start + i * step) / 86400.0)
+			for j, body in enumerate(self.bodies):
+				body.compute(date)
+				lat[i, j] = body.sublat
+				lon[i, j] = body.sublong
+				height[i, j] = body.elevation
+		return geodetic_to_ecef(lat, lon, height)
+
+	def compute(self, start=None, duration=86400, step=60, workers=None, chunk_points=2048, chunk_steps=256):
+		"""
+		Evaluate the window [start, start + duration) (unix time, default now) every `step` seconds.
+		workers=None uses every core, workers=1 runs in this process
+		"""
+		started = time.perf_counter()
+		start = time.time() if start is None else start
+		steps = int(duration // step)
+		positions = self.satellite_positions(start, step, steps)
+		propagated = time.perf_counter()
+
+		sin_min_elevation = math.sin(math.radians(self.min_elevation))
+		chunks = [(i, min(i + chunk_points, len(self.ground))) for i in range(0, len(self.ground), chunk_points)]
+		workers = workers or os.cpu_count() or 1
+		if workers == 1 or len(chunks) == 1:
+			results = [_evaluate_points(self.ground[a:b], self.up[a:b], sin_min_elevation, chunk_steps, satellites=positions) for a, b in chunks]
+		else:
+			with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(positions,)) as executor:
+				futures = [executor.submit(_evaluate_points, self.ground[a:b], self.up[a:b], sin_min_elevation, chunk_steps) for a, b in chunks]
+				results = [future.result() for future in futures]
+
+		arrays = {key: np.concatenate([result[key] for result in results], axis=-1) for key in results[0]}
+		elapsed = time.perf_counter() - started
+		logger.info(
+			"%d satellites x %d points x %d steps in %.2fs (propagation %.2fs, %d chunks on %d workers)",
+			len(self.bodies), len(self.ground), steps, elapsed, propagated - started, len(chunks), min(workers, len(chunks))
+		)
+		return CoverageResult(self.names, self.lats, self.lons, start, step, steps, self.min_elevation, arrays, elapsed)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Satellite coverage / revisit map over a lat/lon grid")
+	parser.add_argument("--tle-url", default="https://celestrak.com/NORAD/elements/noaa.txt")
+	parser.add_argument("--resolution", type=float, default=2.0, help="Grid step in degrees")
+	parser.add_argument("--lat-range", type=float, nargs=2, default=(-90, 90))
+	parser.add_argument("--lon-range", type=float, nargs=2, default=(-180, 180))
+	parser.add_argument("--min-elevation", type=float, default=10.0, help="Degrees above the horizon to count as visible")
+	parser.add_argument("--duration", type=float, default=86400, help="Seconds")
+	parser.add_argument("--step", type=float, default=60, help="Seconds")
+	parser.add_argument("--workers", type=int, default=None, help="Processes (default: one per core)")
+	parser.add_argument("--output", default=None, help="Save the arrays to this .npz file")
+	parser.add_argument("satellites", nargs="+")
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+
+	import requests
+	index = build_index(requests.get(args.tle_url, timeout=30).text.splitlines())
+	bodies = {name: ephem.readtle(name, *index[name]) for name in args.satellites if name in index}
+	for name in args.satellites:
+		if name not in index:
+			logger.warning("%s not found in %s", name, args.tle_url)
+
+	coverage = CoverageMap(bodies, lat_range=args.lat_range, lon_range=args.lon_range, resolution=args.resolution, min_elevation=args.min_elevation)
+	result = coverage.compute(duration=args.duration, step=args.step, workers=args.workers)
+	print(json.dumps(result.__dict__, indent=4))
+	if args.output:
+		result.save(args.output)
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 import math
 import socket
+import logging
 import ephem
 import time
 import sys
@@ -9,6 +10,9 @@ import zmq
 import pmt
 import requests
 
+from metrics import REGISTRY
+from tle_index import build_index
+
 C = 300000000.0
 F0 = 137.1e6
 
@@ -26,11 +30,7 @@ class tle_reader(object):
         self._tle = None
         self.reload()
 
-    def build_index(self, tle_lines):
-        index = {}
-        for i in range(0, len(tle_lines), 3):
-            index[tle_lines[i].strip()] = (tle_lines[i + 1], tle_lines[i + 2])
-        return index
+    build_index = staticmethod(build_index)
 
     def reload(self):
         print("Loading: %s" % self._tle_file)
@@ -57,61 +57,78 @@ class tle_reader(object):
         return time.time() - self._tle_age > self._tle_max_age
 
 
+REMOTE_UPDATES = REGISTRY.counter("doppler_frequency_updates_total", "Frequency updates pushed to a zmq receiver", ("endpoint", "slave", "result"))
+REMOTE_SEND_SECONDS = REGISTRY.histogram("doppler_send_seconds", "Time spent sending a frequency update", ("endpoint",))
+
+
 class remote(object):
     """
     For remote control of rtl_fm command line program
     """
-    def __init__(self,host="tcp://*:5556"):
+    def __init__(self,host="tcp://*:5556", slave="RTL-SDR_1"):
         self._host = host
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.PUSH)
-        self.socket.bind("tcp://*:5556")
-        self.slave = "RTL-SDR_1"
-
-    def set_freq(self, freq):
+        self.socket.bind(self._host)
+        self.slave = slave
+        self._send_seconds = REMOTE_SEND_SECONDS.labels(host)
+
+    def set_freq(self, freq, slave=None, block=True):
+        """
+        With block=False raises zmq.Again instead of waiting when no receiver is connected
+        """
         # freq = 106.8e6
-        print(self.slave+":frequency:"+str(freq))
-        self.socket.send (pmt.serialize_str(pmt.to_pmt(self.slave+":frequency:"+str(freq))))
+        slave = self.slave if slave is None else slave
+        logging.debug(slave+":frequency:"+str(freq))
+        start = time.perf_counter()
+        try:
+            self.socket.send(pmt.serialize_str(pmt.to_pmt(slave+":frequency:"+str(freq))), 0 if block else zmq.NOBLOCK)
+        except zmq.Again:
+            REMOTE_UPDATES.labels(self._host, slave, "dropped").inc()
+            raise
+        self._send_seconds.observe(time.perf_counter() - start)
+        REMOTE_UPDATES.labels(self._host, slave, "sent").inc()
 
     def __del__(self):
         self.socket.close()
         self.context.term()
 
 
-rtl = remote()
-noaa = tle_reader(tle_name="NOAA 19 [+]", tle_max_age=5520)  # 92 minutes
+if __name__ == "__main__":
+    rtl = remote()
+    noaa = tle_reader(tle_name="NOAA 19 [+]", tle_max_age=5520)  # 92 minutes
 
-if noaa.tle is None:
-    sys.exit(0)
+    if noaa.tle is None:
+        sys.exit(0)
 
-myloc = ephem.Observer()
-dpr = 180.0 / math.pi
-myloc.lon = 7.395691 / dpr
-myloc.lat = 47.967760 / dpr
-myloc.elevation = 200
+    myloc = ephem.Observer()
+    dpr = 180.0 / math.pi
+    myloc.lon = 7.395691 / dpr
+    myloc.lat = 47.967760 / dpr
+    myloc.elevation = 200
 
-running = True
+    running = True
 
-try:
-    while running:
-        time.sleep(1)
-        myloc.date = time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime())
+    try:
+        while running:
+            time.sleep(1)
+            myloc.date = time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime())
 
-        noaa.tle.compute(myloc)
-        alt = math.degrees(noaa.tle.alt)
+            noaa.tle.compute(myloc)
+            alt = math.degrees(noaa.tle.alt)
 
-        # if alt > 0:  # iss is flying over our location
+            # if alt > 0:  # iss is flying over our location
 
-        new_freq = int(F0 - noaa.tle.range_velocity * F0 / C)  # doppler
-        print( new_freq, round(alt, 2), myloc.date)
-        rtl.set_freq(new_freq)  # set new frequency in rtl_fm
+            new_freq = int(F0 - noaa.tle.range_velocity * F0 / C)  # doppler
+            print( new_freq, round(alt, 2), myloc.date)
+            rtl.set_freq(new_freq)  # set new frequency in rtl_fm
 
-        # elif noaa.tle_expired:
-            # noaa.reload()  # we could be running for days / weeks
-        # else:
-            # print(alt)
-            # time.sleep(1)  # do nothing, wait for noaa to arrive
-except KeyboardInterrupt:
-    running = False
+            # elif noaa.tle_expired:
+                # noaa.reload()  # we could be running for days / weeks
+            # else:
+                # print(alt)
+                # time.sleep(1)  # do nothing, wait for noaa to arrive
+    except KeyboardInterrupt:
+        running = False
 
-print("Bye")
+    print("Bye")
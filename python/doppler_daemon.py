@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+
+import ephem
+import requests
+import zmq
+
+from doppler import C, tle_reader, remote
+
+logger = logging.getLogger(__name__)
+
+EXAMPLE_CONFIG = {
+	"location": {"lat": 47.967760, "lon": 7.395691, "elevation": 200},
+	"interval": 1.0,
+	"tle_max_age": 5520,
+	"assignments": [
+		{
+			"satellite": "NOAA 19 [+]",
+			"tle_file": "https://celestrak.com/NORAD/elements/noaa.txt",
+			"frequency": 137.1e6,
+			"threshold": 50,
+			"receivers": [
+				{"type": "zmq", "bind": "tcp://*:5556", "name": "RTL-SDR_1"},
+				{"type": "rigctl", "host": "192.168.1.88", "port": 4532},
+			]
+		}
+	]
+}
+
+
+class TLECatalog:
+	"""
+	One download per TLE file for every satellite tracked from it, reloaded from a worker thread
+	so the tracking loop keeps using the previous elements until the new ones are parsed
+	"""
+	def __init__(self, url, max_age):
+		self.url = url
+		self.max_age = max_age
+		self.index = {}
+		self.loaded_at = 0
+
+	@property
+	def expired(self):
+		return time.time() - self.loaded_at > self.max_age
+
+	def fetch(self):
+		tle_lines = requests.get(self.url, timeout=30).text.splitlines()
+		return tle_reader.build_index(tle_lines)
+
+	async def reload(self):
+		loop = asyncio.get_running_loop()
+		try:
+			index = await loop.run_in_executor(None, self.fetch)
+		except Exception as e:
+			logger.warning("Failed to load %s: %s", self.url, e)
+			# Retry in a minute instead of hammering the server every tick
+			self.loaded_at = time.time() - self.max_age + 60
+			return False
+		self.index = index
+		self.loaded_at = time.time()
+		logger.info("Loaded %d TLEs from %s", len(index), self.url)
+		return True
+
+	def body(self, name):
+		tle_data = self.index.get(name)
+		if tle_data is None:
+			logger.warning("%s not found in %s", name, self.url)
+			return None
+		try:
+			return ephem.readtle(name, tle_data[0], tle_data[1])
+		except ValueError as e:
+			logger.warning("Invalid TLE for %s in %s: %s", name, self.url, e)
+			return None
+
+
+class ZMQReceiver:
+	def __init__(self, endpoint: remote, name):
+		self.endpoint = endpoint
+		self.name = name
+
+	def __str__(self):
+		return "zmq:" + self.endpoint._host + "/" + self.name
+
+	def set_frequency(self, frequency):
+		try:
+			self.endpoint.set_freq(frequency, slave=self.name, block=False)
+			return True
+		except zmq.Again:
+			# Nobody connected to the PUSH socket, the next update will retry
+			return False
+
+
+class RigctlReceiver:
+	def __init__(self, host, port=4532):
+		from sdrsharp_controller import SDRSharp
+		self.host = host
+		self.port = port
+		# Background sender: setFrequency() never blocks the tracking loop and coalesces updates
+		self.client = SDRSharp(host, port=port, max_retry=0, background=True)
+
+	def __str__(self):
+		return "rigctl:" + self.host + ":" + str(self.port)
+
+	def set_frequency(self, frequency):
+		self.client.setFrequency(frequency)
+		return True
+
+
+class Assignment:
+	"""
+	Satellite -> receivers, every receiver remembers the last frequency actually sent
+	"""
+	def __init__(self, satellite, catalog, frequency, receivers, observer, threshold=0, min_elevation=None):
+		self.satellite = satellite
+		self.catalog = catalog
+		self.frequency = frequency
+		self.receivers = receivers
+		self.observer = observer
+		self.threshold = threshold
+		self.min_elevation = min_elevation
+		self.last_sent = {receiver: None for receiver in receivers}
+		self.sent = 0
+		self.suppressed = 0
+
+	def update(self, range_velocity, elevation):
+		if self.frequency is None:
+			# No downlink frequency known (no SatNOGS transmitter match), nothing to correct
+			return
+		if self.min_elevation is not None and elevation < self.min_elevation:
+			return
+		new_freq = int(self.frequency - range_velocity * self.frequency / C)  # doppler
+		for receiver in self.receivers:
+			last = self.last_sent[receiver]
+			if last is not None and abs(new_freq - last) < self.threshold:
+				self.suppressed += 1
+				continue
+			if receiver.set_frequency(new_freq):
+				self.last_sent[receiver] = new_freq
+				self.sent += 1
+				logger.debug("%s %s -> %s (el %.2f)", self.satellite, receiver, new_freq, elevation)
+
+
+class DopplerDaemon:
+	"""
+	Track many satellite -> receiver assignments from one event loop.
+	Each (satellite, location) pair is propagated once per tick whatever the number of receivers fed from it.
+	"""
+	def __init__(self, config):
+		self.interval = config.get("interval", 1.0)
+		self.tle_max_age = config.get("tle_max_age", 5520)
+		self.default_location = config.get("location")
+		self.catalogs = {}
+		self.zmq_endpoints = {}
+		self.assignments = []
+		self._bodies = {}
+		self._observers = {}
+		self.running = True
+		self.ticks = 0
+		self.propagations = 0
+		self.propagation_errors = 0
+		# Groups whose last propagation failed, logged once until they recover
+		self._failing = set()
+
+		for assignment in config["assignments"]:
+			self.assignments.append(self._build_assignment(assignment))
+
+		# Assignments sharing the same satellite and location share one propagation
+		self._groups = {}
+		for assignment in self.assignments:
+			self._groups.setdefault((assignment.catalog.url, assignment.satellite, assignment.observer), []).append(assignment)
+
+	@staticmethod
+	def _observer(location):
+		observer = ephem.Observer()
+		observer.lat = math.radians(location["lat"])
+		observer.lon = math.radians(location["lon"])
+		observer.elevation = location.get("elevation", 0)
+		return observer
+
+	def _build_receiver(self, spec):
+		if spec["type"] == "zmq":
+			bind = spec.get("bind", "tcp://*:5556")
+			endpoint = self.zmq_endpoints.get(bind)
+			if endpoint is None:
+				endpoint = self.zmq_endpoints[bind] = remote(host=bind)
+			return ZMQReceiver(endpoint, spec.get("name", "RTL-SDR_1"))
+		if spec["type"] == "rigctl":
+			return RigctlReceiver(spec["host"], spec.get("port", 4532))
+		raise ValueError("Unknown receiver type %s" % spec["type"])
+
+	def _build_assignment(self, spec):
+		url = spec.get("tle_file", "https://celestrak.com/NORAD/elements/noaa.txt")
+		catalog = self.catalogs.get(url)
+		if catalog is None:
+			catalog = self.catalogs[url] = TLECatalog(url, self.tle_max_age)
+		location = spec.get("location", self.default_location)
+		frequency = spec.get("frequency")
+		if frequency is None:
+			frequency = self._satnogs_frequency(spec["satellite"], spec["norad_id"])
+			if frequency is None:
+				logger.warning("No SatNOGS transmitter for %s (%s), its receivers won't be tuned", spec["satellite"], spec["norad_id"])
+		return Assignment(
+			spec["satellite"], catalog, frequency,
+			[self._build_receiver(receiver) for receiver in spec["receivers"]],
+			(location["lat"], location["lon"], location.get("elevation", 0)),
+			threshold=spec.get("threshold", 0), min_elevation=spec.get("min_elevation")
+		)
+
+	@staticmethod
+	def _satnogs_frequency(name, norad_id):
+		from tle_manager import CustomSatellite
+		return CustomSatellite(name, norad_id, None).frequency
+
+	async def reload_expired(self):
+		reloads = [catalog.reload() for catalog in self.catalogs.values() if catalog.expired]
+		if reloads:
+			await asyncio.gather(*reloads)
+			self._bodies = {}
+
+	def tick(self, now=None):
+		"""
+		Propagate every (satellite, location) once and fan the result out to the assignments
+		"""
+		date = ephem.now() if now is None else now
+		for (url, satellite, location), assignments in self._groups.items():
+			if (url, satellite) not in self._bodies:
+				# Parsed once per TLE reload, None if the satellite isn't available
+				self._bodies[(url, satellite)] = self.catalogs[url].body(satellite)
+			body = self._bodies[(url, satellite)]
+			if body is None:
+				continue
+			observer = self._observers.get(location)
+			if observer is None:
+				observer = self._observers[location] = self._observer({"lat": location[0], "lon": location[1], "elevation": location[2]})
+			observer.date = date
+			try:
+				body.compute(observer)
+			except (ValueError, RuntimeError) as e:
+				# Stale or decayed TLE: only this satellite stops being tracked
+				self.propagation_errors += 1
+				if (url, satellite, location) not in self._failing:
+					self._failing.add((url, satellite, location))
+					logger.warning("Can't propagate %s, skipping it: %s", satellite, e)
+				continue
+			self._failing.discard((url, satellite, location))
+			self.propagations += 1
+			elevation = math.degrees(body.alt)
+			for assignment in assignments:
+				assignment.update(body.range_velocity, elevation)
+		self.ticks += 1
+
+	async def _reload_loop(self):
+		while self.running:
+			await self.reload_expired()
+			await asyncio.sleep(10)
+
+	async def run(self):
+		await self.reload_expired()
+		reload_task = asyncio.ensure_future(self._reload_loop())
+		loop = asyncio.get_running_loop()
+		next_tick = loop.time()
+		try:
+			while self.running:
+				self.tick()
+				next_tick += self.interval
+				await asyncio.sleep(max(0, next_tick - loop.time()))
+		finally:
+			reload_task.cancel()
+
+	def stop(self):
+		self.running = False
+
+	@property
+	def __dict__(self):
+		return {
+			"ticks": self.ticks,
+			"propagations": self.propagations,
+			"propagation_errors": self.propagation_errors,
+			"assignments": [
+				{"satellite": a.satellite, "receivers": [str(r) for r in a.receivers], "sent": a.sent, "suppressed": a.suppressed}
+				for a in self.assignments
+			]
+		}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Doppler correction daemon for many satellites and receivers")
+	parser.add_argument("config", nargs="?", default=None, help="Json config file (see EXAMPLE_CONFIG)")
+	parser.add_argument("--print-example", action="store_true", help="Print an example config and exit")
+	args = parser.parse_args()
+
+	if args.print_example or args.config is None:
+		print(json.dumps(EXAMPLE_CONFIG, indent=4))
+		raise SystemExit(0)
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+	with open(args.config) as f:
+		daemon = DopplerDaemon(json.load(f))
+	try:
+		asyncio.run(daemon.run())
+	except KeyboardInterrupt:
+		pass
+	print(json.dumps(daemon.__dict__, indent=4))
@@ -0,0 +1,411 @@
+import argparse
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+
+import ephem
+
+from tle_index import build_index
+
+logger = logging.getLogger(__name__)
+
+C = 300000000.0
+SHM_DIRECTORY = "/dev/shm"
+UNIX_EPOCH = ephem.Date("1970/1/1")
+MAGIC = b"EPHSHM02"
+
+# magic, seq (seqlock counter, odd while the producer writes), generation (publications count),
+# satellite count, samples per satellite, start time (unix), step (s), published at (unix), observer lat, lon (deg), elevation (m),
+# capacity (satellite slots in the file), flags
+HEADER = struct.Struct("<8sQQIIddddddII")
+# name, norad id, epoch (ephem date), inclination, raan, eccentricity, argument of perigee, mean anomaly (deg), mean motion (rev/day)
+RECORD = struct.Struct("<24sIddddddd")
+# azimuth (deg), elevation (deg), range (km), range rate (m/s)
+SAMPLE = struct.Struct("<ffff")
+SEQ_OFFSET = 8
+SEQ = struct.Struct("<Q")
+FLAGS_OFFSET = HEADER.size - 4
+FLAGS = struct.Struct("<I")
+# Set on a table replaced by a new publisher (or closed): readers reopen the path
+FLAG_RETIRED = 0x01
+# Samples of a satellite that could not be propagated (stale TLE...)
+INVALID_SAMPLE = SAMPLE.pack(math.nan, math.nan, math.nan, math.nan)
+
+
+class EphemerisException(Exception):
+	pass
+
+
+def shm_path(name):
+	return os.path.join(SHM_DIRECTORY, "ephemeris_" + name)
+
+
+def table_size(max_satellites, sample_count):
+	return HEADER.size + max_satellites * (RECORD.size + sample_count * SAMPLE.size)
+
+
+def _retire(mm):
+	"""
+	Flag a table as replaced, under its seqlock
+	"""
+	(seq,) = SEQ.unpack_from(mm, SEQ_OFFSET)
+	seq += 1 + (seq & 1)
+	SEQ.pack_into(mm, SEQ_OFFSET, seq)
+	(flags,) = FLAGS.unpack_from(mm, FLAGS_OFFSET)
+	FLAGS.pack_into(mm, FLAGS_OFFSET, flags | FLAG_RETIRED)
+	SEQ.pack_into(mm, SEQ_OFFSET, seq + 1)
+
+
+class EphemerisPublisher:
+	"""
+	Producer side: propagates every satellite once for the next `horizon` seconds and publishes the result in a
+	shared memory table (a file in /dev/shm) protected by a seqlock so readers in other processes never see a half written table.
+
+	A live table is never resized: a new publisher fills its own file and moves it over the path on its first publication,
+	then flags the previous table as retired so the readers still mapping it reopen the path
+	"""
+	def __init__(self, name, lat, lon, elevation=0, max_satellites=64, horizon=3600, step=1.0):
+		self.name = name
+		self.path = shm_path(name)
+		self.max_satellites = max_satellites
+		self.sample_count = int(horizon / step) + 1
+		self.step = step
+		self.observer = ephem.Observer()
+		self.observer.lat = math.radians(lat)
+		self.observer.lon = math.radians(lon)
+		self.observer.elevation = elevation
+		self.location = (lat, lon, elevation)
+		self.generation = self._previous_generation()
+		self.seq = 0
+		self.invalid = []
+		self._published = False
+
+		size = table_size(max_satellites, self.sample_count)
+		self._tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+		fd = os.open(self._tmp_path, os.O_CREAT | os.O_TRUNC | os.O_RDWR, 0o644)
+		try:
+			os.ftruncate(fd, size)
+			self._inode = os.fstat(fd).st_ino
+			self._mm = mmap.mmap(fd, size, access=mmap.ACCESS_WRITE)
+		finally:
+			os.close(fd)
+
+	def _previous_generation(self):
+		"""
+		Generations carry on from the table of a previous run so they keep increasing across restarts
+		"""
+		try:
+			with open(self.path, "rb") as f:
+				header = f.read(HEADER.size)
+		except FileNotFoundError:
+			return 0
+		if len(header) != HEADER.size or header[:len(MAGIC)] != MAGIC:
+			return 0
+		return HEADER.unpack(header)[2]
+
+	def _install(self):
+		"""
+		Move the freshly published table over the path and retire the one it replaces
+		"""
+		try:
+			fd = os.open(self.path, os.O_RDWR)
+		except FileNotFoundError:
+			fd = None
+		os.replace(self._tmp_path, self.path)
+		self._published = True
+		if fd is None:
+			return
+		try:
+			if os.fstat(fd).st_size >= HEADER.size and os.pread(fd, len(MAGIC), 0) == MAGIC:
+				old = mmap.mmap(fd, HEADER.size, access=mmap.ACCESS_WRITE)
+				_retire(old)
+				old.close()
+		finally:
+			os.close(fd)
+
+	def close(self, unlink=True):
+		if not self._published:
+			self._mm.close()
+			os.unlink(self._tmp_path)
+			return
+		_retire(self._mm)
+		self._mm.close()
+		if unlink:
+			try:
+				# Only if it's still ours, a newer publisher may have replaced it
+				if os.stat(self.path).st_ino == self._inode:
+					os.unlink(self.path)
+			except FileNotFoundError:
+				pass
+
+	def _build_body(self, bodies, start):
+		body = bytearray()
+		observer = self.observer
+		self.invalid = []
+		for satellite in bodies[:self.max_satellites]:
+			body += RECORD.pack(
+				satellite.name.encode("utf-8")[:24], satellite.catalog_number, float(satellite._epoch),
+				math.degrees(satellite._inc), math.degrees(satellite._raan), satellite._e,
+				math.degrees(satellite._ap), math.degrees(satellite._M), satellite._n
+			)
+			samples = bytearray(self.sample_count * SAMPLE.size)
+			try:
+				for i in range(self.sample_count):
+					observer.date = UNIX_EPOCH + (start + i * self.step) / 86400.0
+					satellite.compute(observer)
+					SAMPLE.pack_into(samples, i * SAMPLE.size, math.degrees(satellite.az), math.degrees(satellite.alt), satellite.range / 1000.0, satellite.range_velocity)
+			except (ValueError, RuntimeError) as e:
+				# Stale or decayed TLE: the slot is published as invalid, the other satellites are not affected
+				logger.warning("Can't propagate %s, publishing it as invalid: %s", satellite.name, e)
+				self.invalid.append(satellite.name)
+				samples = bytearray(INVALID_SAMPLE * self.sample_count)
+			body += samples
+		return body
+
+	def publish(self, bodies, start=None):
+		"""
+		Propagate `bodies` (ephem.EarthSatellite) and swap the table content under the seqlock
+		"""
+		start = time.time() if start is None else start
+		if len(bodies) > self.max_satellites:
+			logger.warning("Only publishing the first %d of %d satellites", self.max_satellites, len(bodies))
+		# The slow part (propagation) is done before taking the lock, readers only wait for the memory copy
+		body = self._build_body(bodies, start)
+
+		mm = self._mm
+		self.seq += 1
+		SEQ.pack_into(mm, SEQ_OFFSET, self.seq)
+		self.generation += 1
+		mm[HEADER.size:HEADER.size + len(body)] = body
+		mm[:HEADER.size] = HEADER.pack(
+			MAGIC, self.seq, self.generation, min(len(bodies), self.max_satellites), self.sample_count,
+			start, self.step, time.time(), self.location[0], self.location[1], self.location[2], self.max_satellites, 0
+		)
+		self.seq += 1
+		SEQ.pack_into(mm, SEQ_OFFSET, self.seq)
+		if not self._published:
+			self._install()
+
+	def run(self, tle_url, names, refresh=None, tle_max_age=5520):
+		"""
+		Republish every `refresh` seconds (default: half the horizon), downloading the TLEs every `tle_max_age` seconds
+		"""
+		import requests
+		refresh = refresh or (self.sample_count - 1) * self.step / 2
+		index = None
+		index_time = 0
+		while True:
+			if index is None or time.time() - index_time > tle_max_age:
+				try:
+					index = build_index(requests.get(tle_url, timeout=30).text.splitlines())
+					index_time = time.time()
+				except Exception as e:
+					logger.warning("Failed to load %s: %s", tle_url, e)
+			if index is not None:
+				bodies = []
+				for name in names:
+					if name not in index:
+						continue
+					try:
+						bodies.append(ephem.readtle(name, *index[name]))
+					except ValueError as e:
+						logger.warning("Invalid TLE for %s: %s", name, e)
+				start = time.perf_counter()
+				self.publish(bodies)
+				logger.info("Published %d satellites (%d samples each) in %.2fs", len(bodies), self.sample_count, time.perf_counter() - start)
+			time.sleep(refresh)
+
+
+class EphemerisReader:
+	"""
+	Consumer side: attach read only to a table published by EphemerisPublisher and read pointing data without propagating
+	"""
+	def __init__(self, name, max_retries=1000):
+		self.path = shm_path(name)
+		self.max_retries = max_retries
+		self._mm = None
+		self._attach()
+
+	def _attach(self):
+		"""
+		(Re)map the table currently at the path, the cached names and generation belong to the previous mapping
+		"""
+		try:
+			fd = os.open(self.path, os.O_RDONLY)
+		except FileNotFoundError:
+			raise EphemerisException("No ephemeris table %s" % self.path)
+		try:
+			mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+		finally:
+			os.close(fd)
+		if len(mm) < HEADER.size:
+			mm.close()
+			raise EphemerisException("%s is not an ephemeris table" % self.path)
+		if self._mm is not None:
+			self._mm.close()
+		self._mm = mm
+		self._generation = None
+		self._names = {}
+		self._header = None
+
+	def close(self):
+		self._mm.close()
+
+	def _consistent(self, read):
+		"""
+		Seqlock read: retry until the sequence is even and unchanged around the copy
+		"""
+		for _ in range(self.max_retries):
+			if FLAGS.unpack_from(self._mm, FLAGS_OFFSET)[0] & FLAG_RETIRED:
+				logger.info("%s was replaced, remapping it", self.path)
+				self._attach()
+			mm = self._mm
+			(seq,) = SEQ.unpack_from(mm, SEQ_OFFSET)
+			if seq & 1:
+				time.sleep(0)
+				continue
+			try:
+				result = read(mm)
+			except Exception:
+				# A torn read can produce garbage, only report the error if the data was stable
+				if SEQ.unpack_from(mm, SEQ_OFFSET)[0] == seq:
+					raise
+				continue
+			if SEQ.unpack_from(mm, SEQ_OFFSET)[0] == seq:
+				return result
+		raise EphemerisException("Could not get a consistent read of %s" % self.path)
+
+	def _read_header(self, mm):
+		header = HEADER.unpack_from(mm, 0)
+		if header[0] != MAGIC:
+			raise EphemerisException("%s is not published yet" % self.path)
+		if len(mm) < table_size(header[11], header[4]):
+			raise EphemerisException("%s is smaller than its %d satellites capacity" % (self.path, header[11]))
+		return header
+
+	def _refresh_names(self):
+		def read(mm):
+			header = self._read_header(mm)
+			count, sample_count = header[3], header[4]
+			record_size = RECORD.size + sample_count * SAMPLE.size
+			names = {}
+			for i in range(count):
+				record = RECORD.unpack_from(mm, HEADER.size + i * record_size)
+				names[record[0].rstrip(b"\x00").decode("utf-8")] = i
+			return header, names
+		self._header, self._names = self._consistent(read)
+		self._generation = self._header[2]
+
+	@property
+	def satellites(self):
+		self._refresh_names()
+		return list(self._names.keys())
+
+	def elements(self, satellite):
+		self._refresh_names()
+		header, index = self._header, self._lookup(satellite)
+		record_size = RECORD.size + header[4] * SAMPLE.size
+		record = self._consistent(lambda mm: RECORD.unpack_from(mm, HEADER.size + index * record_size))
+		return dict(zip(("name", "norad", "epoch", "inclination", "raan", "eccentricity", "arg_perigee", "mean_anomaly", "mean_motion"), (satellite,) + record[1:]))
+
+	def _lookup(self, satellite):
+		index = self._names.get(satellite)
+		if index is None:
+			raise EphemerisException("%s is not in the ephemeris table" % satellite)
+		return index
+
+	def pointing(self, satellite, t=None):
+		"""
+		Returns (azimuth deg, elevation deg, range km, range rate m/s) at unix time t, linearly interpolated between samples
+		"""
+		t = time.time() if t is None else t
+
+		def read(mm):
+			header = self._read_header(mm)
+			if header[2] != self._generation:
+				return None
+			sample_count, start, step = header[4], header[5], header[6]
+			position = (t - start) / step
+			if position < 0 or position > sample_count - 1:
+				raise EphemerisException("%s is outside of the published window" % time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime(t)))
+			i = min(int(position), sample_count - 2)
+			offset = HEADER.size + self._lookup(satellite) * (RECORD.size + sample_count * SAMPLE.size) + RECORD.size + i * SAMPLE.size
+			return position - i, SAMPLE.unpack_from(mm, offset), SAMPLE.unpack_from(mm, offset + SAMPLE.size)
+
+		result = self._consistent(read) if self._generation is not None else None
+		if result is None:
+			# First read or the producer republished: the satellite order may have changed
+			self._refresh_names()
+			result = self._consistent(read)
+			if result is None:
+				raise EphemerisException("Ephemeris table changed during the read")
+
+		fraction, a, b = result
+		if math.isnan(a[1]):
+			raise EphemerisException("%s could not be propagated by the publisher (stale TLE?)" % satellite)
+		azimuth_delta = (b[0] - a[0] + 180) % 360 - 180
+		return (
+			(a[0] + azimuth_delta * fraction) % 360,
+			a[1] + (b[1] - a[1]) * fraction,
+			a[2] + (b[2] - a[2]) * fraction,
+			a[3] + (b[3] - a[3]) * fraction,
+		)
+
+	def doppler_frequency(self, satellite, frequency, t=None):
+		range_rate = self.pointing(satellite, t)[3]
+		return int(frequency - range_rate * frequency / C)  # doppler
+
+	@property
+	def __dict__(self):
+		header = self._consistent(self._read_header)
+		return {
+			"path": self.path,
+			"generation": header[2],
+			"satellites": header[3],
+			"samples": header[4],
+			"start": header[5],
+			"step": header[6],
+			"published_at": header[7],
+			"location": header[8:11],
+			"capacity": header[11],
+		}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Shared memory ephemeris table (publish once, read from every tracker)")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	publish = subparsers.add_parser("publish")
+	publish.add_argument("--name", default="default")
+	publish.add_argument("--tle-url", default="https://celestrak.com/NORAD/elements/noaa.txt")
+	publish.add_argument("--lat", type=float, required=True)
+	publish.add_argument("--lon", type=float, required=True)
+	publish.add_argument("--elevation", type=float, default=0)
+	publish.add_argument("--horizon", type=float, default=3600, help="Seconds of samples published")
+	publish.add_argument("--step", type=float, default=1.0)
+	publish.add_argument("satellites", nargs="+")
+	show = subparsers.add_parser("show")
+	show.add_argument("--name", default="default")
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+	if args.command == "publish":
+		publisher = EphemerisPublisher(args.name, args.lat, args.lon, args.elevation, max_satellites=len(args.satellites), horizon=args.horizon, step=args.step)
+		try:
+			publisher.run(args.tle_url, args.satellites)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			publisher.close()
+	else:
+		reader = EphemerisReader(args.name)
+		print(reader.__dict__)
+		for name in reader.satellites:
+			try:
+				az, el, rng, rate = reader.pointing(name)
+			except EphemerisException as e:
+				print("%-24s %s" % (name, e))
+				continue
+			print("%-24s az %7.2f el %6.2f range %9.1fkm range rate %8.1fm/s" % (name, az, el, rng, rate))
@@ -0,0 +1,123 @@
+import argparse
+import logging
+import socket
+import socketserver
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _RigctlHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		server = self.server.owner
+		self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		while True:
+			try:
+				line = self.rfile.readline()
+			except OSError:
+				return
+			if not line:
+				return
+			line = line.decode("utf-8").strip()
+			if not line:
+				continue
+			server.received.append(line)
+			if server.delay:
+				time.sleep(server.delay)
+
+			reply = server.handle_command(line)
+			if reply is None:
+				return
+			try:
+				self.wfile.write(reply.encode("utf-8"))
+			except OSError:
+				return
+			if server.drop_after is not None and len(server.received) >= server.drop_after:
+				server.drop_after = None
+				return
+
+
+class FakeRigctlServer:
+	"""
+	Minimal rigctld stand-in (F/f/M/m/q) to test rig-control clients without SDR# or hamlib.
+	`delay` adds a per-command processing delay, `drop_after` closes the connection after that many commands
+	"""
+	def __init__(self, host="127.0.0.1", port=0, delay=0.0, drop_after=None):
+		self.delay = delay
+		self.drop_after = drop_after
+		self.frequency = 145800000
+		self.mode = "FM"
+		self.passband = 12500
+		self.received = []
+		self.frequency_history = []
+
+		self._server = socketserver.ThreadingTCPServer((host, port), _RigctlHandler, bind_and_activate=False)
+		self._server.allow_reuse_address = True
+		self._server.daemon_threads = True
+		self._server.owner = self
+		self._server.server_bind()
+		self._server.server_activate()
+		self.host, self.port = self._server.server_address
+		self._thread = None
+
+	def handle_command(self, line):
+		"""
+		Returns the reply to send back, None to close the connection
+		"""
+		command, _, args = line.partition(" ")
+		if command in ("F", "\\set_freq"):
+			try:
+				self.frequency = int(float(args))
+			except ValueError:
+				return "RPRT -1\n"
+			self.frequency_history.append(self.frequency)
+			return "RPRT 0\n"
+		if command in ("f", "\\get_freq"):
+			return str(self.frequency) + "\n"
+		if command in ("M", "\\set_mode"):
+			parts = args.split()
+			if not parts:
+				return "RPRT -1\n"
+			self.mode = parts[0]
+			if len(parts) > 1:
+				self.passband = int(parts[1])
+			return "RPRT 0\n"
+		if command in ("m", "\\get_mode"):
+			return self.mode + "\n" + str(self.passband) + "\n"
+		if command in ("q", "Q"):
+			return None
+		return "RPRT -4\n"
+
+	def start(self):
+		self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._server.shutdown()
+		self._server.server_close()
+		self._thread.join()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Fake rigctld server")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=4532)
+	parser.add_argument("--delay", type=float, default=0.0, help="Processing delay per command in seconds")
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+	server = FakeRigctlServer(host=args.host, port=args.port, delay=args.delay).start()
+	logger.info("Listening on %s:%s" % (server.host, server.port))
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		server.stop()
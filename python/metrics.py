@@ -0,0 +1,388 @@
+import bisect
+import json
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsException(Exception):
+	pass
+
+
+class Counter:
+	"""
+	Monotonic counter. Every thread increments its own cell (no lock on the hot path), the cells are summed when read
+	"""
+	def __init__(self):
+		self._local = threading.local()
+		self._cells = []
+		self._lock = threading.Lock()
+
+	def inc(self, amount=1):
+		try:
+			self._local.cell[0] += amount
+		except AttributeError:
+			cell = [amount]
+			with self._lock:
+				self._cells.append(cell)
+			self._local.cell = cell
+
+	@property
+	def value(self):
+		return sum(cell[0] for cell in tuple(self._cells))
+
+
+class Gauge:
+	"""
+	Value that goes up and down, or is read from `function` at collection time
+	"""
+	def __init__(self):
+		self._value = 0
+		self._lock = threading.Lock()
+		self._function = None
+
+	def set(self, value):
+		self._value = value
+
+	def inc(self, amount=1):
+		with self._lock:
+			self._value += amount
+
+	def dec(self, amount=1):
+		with self._lock:
+			self._value -= amount
+
+	def set_function(self, function):
+		self._function = function
+
+	@property
+	def value(self):
+		if self._function is not None:
+			try:
+				return self._function()
+			except Exception as e:
+				logger.debug("Gauge function failed: %s", e)
+				return math.nan
+		return self._value
+
+
+class Histogram:
+	"""
+	Bucketed distribution with per thread cells like Counter: [per bucket counts (last one is +Inf), sum, count]
+	"""
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self.buckets = tuple(sorted(buckets))
+		self._local = threading.local()
+		self._cells = []
+		self._lock = threading.Lock()
+
+	def observe(self, value):
+		try:
+			cell = self._local.cell
+		except AttributeError:
+			cell = [[0] * (len(self.buckets) + 1), 0.0, 0]
+			with self._lock:
+				self._cells.append(cell)
+			self._local.cell = cell
+		cell[0][bisect.bisect_left(self.buckets, value)] += 1
+		cell[1] += value
+		cell[2] += 1
+
+	@property
+	def value(self):
+		"""
+		Returns (cumulative bucket counts including +Inf, sum, count)
+		"""
+		counts = [0] * (len(self.buckets) + 1)
+		total = 0.0
+		count = 0
+		for cell in tuple(self._cells):
+			for i, bucket_count in enumerate(cell[0]):
+				counts[i] += bucket_count
+			total += cell[1]
+			count += cell[2]
+		cumulative = []
+		running = 0
+		for bucket_count in counts:
+			running += bucket_count
+			cumulative.append(running)
+		return cumulative, total, count
+
+
+class MetricFamily:
+	"""
+	All the children (one per label values) of a metric name, unlabelled families proxy inc/set/observe to their only child
+	"""
+	TYPES = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+	def __init__(self, name, documentation, metric_type, labelnames=(), **options):
+		if metric_type not in MetricFamily.TYPES:
+			raise MetricsException("Unknown metric type %s" % metric_type)
+		self.name = name
+		self.documentation = documentation
+		self.type = metric_type
+		self.labelnames = tuple(labelnames)
+		self.options = options
+		self._children = {}
+		self._lock = threading.Lock()
+		self._default = None if self.labelnames else self.labels()
+
+	def __str__(self):
+		return "<MetricFamily Name:" + self.name + " Type:" + self.type + " Labels:" + str(self.labelnames) + ">"
+
+	def __repr__(self):
+		return str(self)
+
+	def labels(self, *values, **kwvalues):
+		"""
+		Get (or create) the child for these label values. Keep the result around on hot paths
+		"""
+		if kwvalues:
+			values = tuple(kwvalues[name] for name in self.labelnames)
+		values = tuple(str(value) for value in values)
+		if len(values) != len(self.labelnames):
+			raise MetricsException("%s expects labels %s, got %s" % (self.name, self.labelnames, values))
+		child = self._children.get(values)
+		if child is None:
+			with self._lock:
+				child = self._children.get(values)
+				if child is None:
+					child = self._children[values] = MetricFamily.TYPES[self.type](**self.options)
+		return child
+
+	def _unlabelled(self):
+		if self._default is None:
+			raise MetricsException("%s has labels %s, use labels() first" % (self.name, self.labelnames))
+		return self._default
+
+	def inc(self, amount=1):
+		self._unlabelled().inc(amount)
+
+	def dec(self, amount=1):
+		self._unlabelled().dec(amount)
+
+	def set(self, value):
+		self._unlabelled().set(value)
+
+	def set_function(self, function):
+		self._unlabelled().set_function(function)
+
+	def observe(self, value):
+		self._unlabelled().observe(value)
+
+	@property
+	def value(self):
+		return self._unlabelled().value
+
+	def samples(self):
+		"""
+		Yields (label dict, child value) for every child
+		"""
+		for values, child in tuple(self._children.items()):
+			yield dict(zip(self.labelnames, values)), child.value
+
+
+def _format_labels(labels):
+	if not labels:
+		return ""
+	return "{" + ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+	if value is None:
+		return "NaN"
+	if isinstance(value, float):
+		if math.isinf(value):
+			return "+Inf" if value > 0 else "-Inf"
+		if math.isnan(value):
+			return "NaN"
+	return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+	"""
+	Get-or-create store of the metric families, several instances of a service share the same family
+	"""
+	def __init__(self):
+		self._families = {}
+		self._lock = threading.Lock()
+
+	def _family(self, name, documentation, metric_type, labelnames, **options):
+		family = self._families.get(name)
+		if family is None:
+			with self._lock:
+				family = self._families.get(name)
+				if family is None:
+					family = self._families[name] = MetricFamily(name, documentation, metric_type, labelnames, **options)
+		if family.type != metric_type or family.labelnames != tuple(labelnames):
+			raise MetricsException("%s is already registered as %s%s" % (name, family.type, family.labelnames))
+		return family
+
+	def counter(self, name, documentation, labelnames=()):
+		return self._family(name, documentation, "counter", labelnames)
+
+	def gauge(self, name, documentation, labelnames=()):
+		return self._family(name, documentation, "gauge", labelnames)
+
+	def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+		return self._family(name, documentation, "histogram", labelnames, buckets=buckets)
+
+	def families(self):
+		return [self._families[name] for name in sorted(tuple(self._families))]
+
+	def expose(self):
+		"""
+		Prometheus text exposition format (version 0.0.4)
+		"""
+		lines = []
+		for family in self.families():
+			lines.append("# HELP %s %s" % (family.name, family.documentation.replace("\\", "\\\\").replace("\n", "\\n")))
+			lines.append("# TYPE %s %s" % (family.name, family.type))
+			for labels, value in family.samples():
+				if family.type != "histogram":
+					lines.append("%s%s %s" % (family.name, _format_labels(labels), _format_value(value)))
+					continue
+				cumulative, total, count = value
+				for bound, bucket_count in zip(family.options["buckets"] + (math.inf,), cumulative):
+					bucket_labels = dict(labels)
+					bucket_labels["le"] = _format_value(float(bound))
+					lines.append("%s_bucket%s %d" % (family.name, _format_labels(bucket_labels), bucket_count))
+				lines.append("%s_sum%s %s" % (family.name, _format_labels(labels), _format_value(total)))
+				lines.append("%s_count%s %d" % (family.name, _format_labels(labels), count))
+		return "\n".join(lines) + "\n"
+
+	def snapshot(self):
+		"""
+		{name: [{"labels": {...}, "value": ...}]}, histograms as {"count", "sum", "buckets": {le: cumulative count}}
+		"""
+		snapshot = {}
+		for family in self.families():
+			samples = []
+			for labels, value in family.samples():
+				if family.type == "histogram":
+					cumulative, total, count = value
+					value = {
+						"count": count,
+						"sum": total,
+						"buckets": {_format_value(float(bound)): bucket_count for bound, bucket_count in zip(family.options["buckets"] + (math.inf,), cumulative)},
+					}
+				samples.append({"labels": labels, "value": value})
+			snapshot[family.name] = samples
+		return snapshot
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+	"""
+	Serves /metrics (Prometheus text) and /snapshot (json) from a daemon thread, local only by default
+	"""
+	def __init__(self, registry=REGISTRY, host="127.0.0.1", port=9464):
+		self.registry = registry
+		registry_ = registry
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				path = self.path.split("?", 1)[0]
+				if path == "/metrics":
+					body = registry_.expose().encode("utf-8")
+					content_type = "text/plain; version=0.0.4; charset=utf-8"
+				elif path == "/snapshot":
+					body = json.dumps(registry_.snapshot()).encode("utf-8")
+					content_type = "application/json"
+				else:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header("Content-Type", content_type)
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				logger.debug("%s - %s", self.address_string(), format % args)
+
+		self.httpd = ThreadingHTTPServer((host, port), Handler)
+		self.httpd.daemon_threads = True
+		self.host, self.port = self.httpd.server_address[:2]
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self.httpd.serve_forever, name="Metrics server", daemon=True)
+		self._thread.start()
+		logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+		if self._thread is not None:
+			self._thread.join()
+
+
+class Snapshotter:
+	"""
+	Periodically writes a snapshot of the registry as a json line (to `path`, or to the log),
+	counters also get a per second rate computed from the previous snapshot
+	"""
+	def __init__(self, registry=REGISTRY, interval=60.0, path=None):
+		self.registry = registry
+		self.interval = interval
+		self.path = path
+		self.last = None
+		self._previous = {}
+		self._previous_time = None
+		self._stop = threading.Event()
+		self._thread = None
+
+	def take(self):
+		now = time.time()
+		snapshot = self.registry.snapshot()
+		elapsed = None if self._previous_time is None else now - self._previous_time
+		counters = {}
+		for family in self.registry.families():
+			if family.type != "counter":
+				continue
+			for sample in snapshot[family.name]:
+				key = (family.name, tuple(sorted(sample["labels"].items())))
+				counters[key] = sample["value"]
+				if elapsed:
+					sample["rate"] = round((sample["value"] - self._previous.get(key, 0)) / elapsed, 3)
+		self._previous = counters
+		self._previous_time = now
+		self.last = {"time": now, "metrics": snapshot}
+		return self.last
+
+	def _write(self, snapshot):
+		line = json.dumps(snapshot)
+		if self.path is None:
+			logger.info("%s", line)
+			return
+		with open(self.path, "a") as f:
+			f.write(line + "\n")
+
+	def _run(self):
+		while not self._stop.wait(self.interval):
+			try:
+				self._write(self.take())
+			except Exception as e:
+				logger.warning("Failed to write the metrics snapshot: %s", e)
+
+	def start(self):
+		self.take()
+		self._thread = threading.Thread(target=self._run, name="Metrics snapshots", daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+
@@ -1,4 +1,6 @@
+import collections
 import enum
+import random
 import time
 import typing
 from dataclasses import dataclass
@@ -32,10 +34,85 @@ class Profiler:
 				"cached": self.cached,
 			}
 
-	def __init__(self):
+	@dataclass
+	class Aggregate:
+		count: int = 0
+		total: float = 0
+		min: typing.Optional[float] = None
+		max: typing.Optional[float] = None
+
+		def add(self, value: float):
+			self.count += 1
+			self.total += value
+			if self.min is None or value < self.min:
+				self.min = value
+			if self.max is None or value > self.max:
+				self.max = value
+
+		@property
+		def __dict__(self):
+			return {
+				"count": self.count,
+				"total": round(self.total, 2),
+				"mean": 0 if self.count == 0 else round(self.total / self.count, 2),
+				"min": 0 if self.min is None else round(self.min, 2),
+				"max": 0 if self.max is None else round(self.max, 2),
+			}
+
+	def __init__(self, sample_rate: float = 1.0, sample_every: int = 1, facility_rate_limits: typing.Optional[typing.Dict[str, float]] = None, max_events: typing.Optional[int] = None):
+		"""
+		sample_rate: probability (0..1) that an event is kept in self.events
+		sample_every: only keep 1 event out of N, counted separately for every (facility, name) so rare events are sampled too
+		facility_rate_limits: maximum number of kept events per second for a given facility
+		max_events: size of the ring buffer holding the most recent kept events (None = unbounded)
+		Aggregated timings (see self.aggregates) are always computed on every event, sampled or not.
+		"""
+		if not 0 <= sample_rate <= 1:
+			raise ProfilerException("sample_rate must be between 0 and 1")
+		if sample_every < 1:
+			raise ProfilerException("sample_every must be at least 1")
+
+		self.sample_rate = sample_rate
+		self.sample_every = sample_every
+		self.facility_rate_limits = facility_rate_limits or {}
+		self.max_events = max_events
+
 		self.events = []
 		self.start_timestamp = None
 		self.last_event = None
+		self._reset_sampling()
+
+	@property
+	def sampling(self) -> bool:
+		return self.sample_rate < 1 or self.sample_every > 1 or bool(self.facility_rate_limits) or self.max_events is not None
+
+	def _reset_sampling(self):
+		self.events = [] if self.max_events is None else collections.deque(maxlen=self.max_events)
+		self.aggregates: typing.Dict[typing.Tuple[str, str], Profiler.Aggregate] = {}
+		self.seen_events = 0
+		self.dropped_events = 0
+		self._facility_windows: typing.Dict[str, typing.List[float]] = {}
+
+	def _should_keep(self, facility, timestamp, occurrence) -> bool:
+		"""
+		occurrence: how many events with the same facility and name were seen before this one
+		"""
+		if self.sample_every > 1 and occurrence % self.sample_every != 0:
+			return False
+		if self.sample_rate < 1 and random.random() >= self.sample_rate:
+			return False
+
+		limit = self.facility_rate_limits.get(facility)
+		if limit is not None:
+			# window = [start of the current one second window, events kept in it]
+			window = self._facility_windows.setdefault(facility, [timestamp, 0])
+			if timestamp - window[0] >= 1:
+				window[0] = timestamp
+				window[1] = 0
+			if window[1] >= limit:
+				return False
+			window[1] += 1
+		return True
 
 	def log_event(self, name, facility="", event_type=Event.EventType.EVENT, cached: bool = False):
 		if self.start_timestamp is None:
@@ -52,9 +129,26 @@ class Profiler:
 			type=event_type,
 			cached=cached
 		)
-		self.events.append(self.last_event)
+
+		if event_type == Profiler.Event.EventType.INTERNAL_MARKER:
+			self.events.append(self.last_event)
+			return
+
+		key = (facility, name)
+		aggregate = self.aggregates.get(key)
+		if aggregate is None:
+			aggregate = self.aggregates[key] = Profiler.Aggregate()
+		aggregate.add(self.last_event.time_since_last_event)
+
+		keep = self._should_keep(facility, timestamp, aggregate.count - 1)
+		self.seen_events += 1
+		if keep:
+			self.events.append(self.last_event)
+		else:
+			self.dropped_events += 1
 
 	def start(self):
+		self._reset_sampling()
 		self.start_timestamp = time.time()
 		self.last_event = Profiler.Event(
 			facility="",
@@ -72,13 +166,24 @@ class Profiler:
 
 	@property
 	def duration(self) -> float:
-		return round((self.events[-1].absolute_timestamp - self.events[0].absolute_timestamp) * 1000, 2)
+		# The ring buffer may have evicted the start marker, rely on the timestamps instead
+		return round((self.last_event.absolute_timestamp - self.start_timestamp) * 1000, 2)
 
 	@property
 	def __dict__(self):
-		return {
+		ret = {
 			"start_timestamp": self.start_timestamp,
 			"duration": self.duration,
 
 			"events": [event.__dict__ for event in self.events if event.type != Profiler.Event.EventType.INTERNAL_MARKER]
 		}
+		if self.sampling:
+			ret["sampling"] = {
+				"seen_events": self.seen_events,
+				"dropped_events": self.dropped_events,
+				"aggregates": [
+					dict(facility=facility, name=name, **aggregate.__dict__)
+					for (facility, name), aggregate in self.aggregates.items()
+				]
+			}
+		return ret
@@ -1,37 +1,320 @@
 import socket
 import logging
+import threading
+import time
+
+from metrics import REGISTRY
+
+RIGCTL_COMMANDS = REGISTRY.counter("rigctl_commands_total", "rigctl commands sent and acknowledged", ("endpoint",))
+RIGCTL_ERRORS = REGISTRY.counter("rigctl_errors_total", "Failed rigctl exchanges (connection or error reply)", ("endpoint",))
+RIGCTL_RECONNECTS = REGISTRY.counter("rigctl_reconnects_total", "Retries after a failed exchange", ("endpoint",))
+RIGCTL_COALESCED = REGISTRY.counter("rigctl_frequency_coalesced_total", "Frequency updates replaced by a newer one before being sent", ("endpoint",))
+RIGCTL_LATENCY = REGISTRY.histogram("rigctl_send_latency_seconds", "Round trip of a pipelined batch of rigctl commands", ("endpoint",))
+
+
+# Value lines of the reply of every supported command (short and long names), 0 for the set commands which only answer
+# with a return code (RPRT n). An error is a single RPRT line whatever the command.
+REPLY_LINES = {
+	# Set commands
+	"F": 0, "\\set_freq": 0,
+	"M": 0, "\\set_mode": 0,
+	"V": 0, "\\set_vfo": 0,
+	"J": 0, "\\set_rit": 0,
+	"Z": 0, "\\set_xit": 0,
+	"T": 0, "\\set_ptt": 0,
+	"R": 0, "\\set_rptr_shift": 0,
+	"O": 0, "\\set_rptr_offs": 0,
+	"C": 0, "\\set_ctcss_tone": 0,
+	"D": 0, "\\set_dcs_code": 0,
+	"I": 0, "\\set_split_freq": 0,
+	"X": 0, "\\set_split_mode": 0,
+	"S": 0, "\\set_split_vfo": 0,
+	"N": 0, "\\set_ts": 0,
+	"L": 0, "\\set_level": 0,
+	"U": 0, "\\set_func": 0,
+	"P": 0, "\\set_parm": 0,
+	"G": 0, "\\vfo_op": 0,
+	"g": 0, "\\scan": 0,
+	"\\set_powerstat": 0,
+	# Get commands
+	"f": 1, "\\get_freq": 1,
+	"m": 2, "\\get_mode": 2,
+	"v": 1, "\\get_vfo": 1,
+	"j": 1, "\\get_rit": 1,
+	"z": 1, "\\get_xit": 1,
+	"t": 1, "\\get_ptt": 1,
+	"r": 1, "\\get_rptr_shift": 1,
+	"o": 1, "\\get_rptr_offs": 1,
+	"c": 1, "\\get_ctcss_tone": 1,
+	"d": 1, "\\get_dcs_code": 1,
+	"i": 1, "\\get_split_freq": 1,
+	"x": 2, "\\get_split_mode": 2,
+	"s": 2, "\\get_split_vfo": 2,
+	"n": 1, "\\get_ts": 1,
+	"l": 1, "\\get_level": 1,
+	"u": 1, "\\get_func": 1,
+	"p": 1, "\\get_parm": 1,
+	"_": 1, "\\get_info": 1,
+	"\\get_powerstat": 1,
+}
+
+
+class RigctlException(Exception):
+	pass
+
+
+class RigctlReplyException(RigctlException):
+	"""
+	The rig answered with an error code (RPRT -n), the connection is still in sync and stays open
+	"""
+	def __init__(self, command, reply):
+		RigctlException.__init__(self, "Command %r failed: %s" % (command, reply))
+		self.command = command
+		self.reply = reply
 
 
 class SDRSharp:
-	def __init__(self, host, port=4532, max_retry=5):
+	"""
+	Client for the rigctl (hamlib net protocol) port of the GPredict connector module for SDR#
+
+	With background=True setFrequency() never blocks: the latest requested frequency is handed to a sender thread
+	which coalesces pending updates (latest wins) and pipelines them with the other queued commands
+	"""
+	def __init__(self, host, port=4532, max_retry=5, timeout=2.0, background=True, backoff=0.1, max_backoff=5.0):
 		self.host = host
 		self.port = port
 		self.max_retry = max_retry
+		self.timeout = timeout
+		self.backoff = backoff
+		self.max_backoff = max_backoff
 		self.socket = None
+		self._file = None
+
+		self._io_lock = threading.Lock()
+		self._condition = threading.Condition()
+		self._pending_frequency = None
+		self._pending_commands = []
+		self._busy = False
+		self.running = True
+
+		self.metrics = {
+			"commands_sent": 0,
+			"frequency_updates": 0,
+			"frequency_coalesced": 0,
+			"errors": 0,
+			"reconnects": 0,
+			"last_latency": None,
+			"max_latency": 0.0,
+			"total_latency": 0.0,
+			"batches": 0,
+		}
+		endpoint = "%s:%s" % (host, port)
+		self._commands_total = RIGCTL_COMMANDS.labels(endpoint)
+		self._errors_total = RIGCTL_ERRORS.labels(endpoint)
+		self._reconnects_total = RIGCTL_RECONNECTS.labels(endpoint)
+		self._coalesced_total = RIGCTL_COALESCED.labels(endpoint)
+		self._latency = RIGCTL_LATENCY.labels(endpoint)
+
 		if self.connect():
 			logging.info("Connected to %s:%s" % (self.host, self.port))
 
-	def connect(self, _trynumber=0):
-		logging.info("Trying to connect to %s:%s" % (self.host, self.port))
+		self._thread = None
+		if background:
+			self._thread = threading.Thread(target=self._sender, name="SDRSharp sender", daemon=True)
+			self._thread.start()
+
+	def _close_socket(self):
+		if self.socket is not None:
+			try:
+				self.socket.close()
+			except OSError:
+				pass
+		self.socket = None
+		self._file = None
+
+	def connect(self):
+		"""
+		Try to connect up to max_retry + 1 times with a bounded exponential backoff between tries
+		"""
+		self._close_socket()
+		delay = self.backoff
+		for trynumber in range(self.max_retry + 1):
+			logging.info("Trying to connect to %s:%s" % (self.host, self.port))
+			try:
+				self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+				self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				self._file = self.socket.makefile("rb")
+				return True
+			except OSError as e:
+				logging.info("Failed to connect to %s:%s (try %s): %s" % (self.host, self.port, trynumber + 1, str(e)))
+				self._close_socket()
+				if trynumber < self.max_retry and self.running:
+					time.sleep(delay)
+					delay = min(delay * 2, self.max_backoff)
+		return False
+
+	def _read_line(self):
+		line = self._file.readline()
+		if not line:
+			raise RigctlException("Connection closed by %s:%s" % (self.host, self.port))
+		return line.decode("utf-8").strip()
+
+	@staticmethod
+	def _reply_lines(command):
+		count = REPLY_LINES.get(command.split(" ", 1)[0])
+		if count is None:
+			# The reply length must be known or every following reply would be misread
+			raise RigctlException("Unsupported rigctl command %r" % command)
+		return count
+
+	def _read_reply(self, command):
+		"""
+		Read the whole reply of `command`: None for set commands, the line for single line get commands, the list of lines for
+		the others (see REPLY_LINES). Returns a RigctlReplyException instead of raising it so the batch is still read in full
+		"""
+		count = self._reply_lines(command)
+		line = self._read_line()
+		if count == 0:
+			if line != "RPRT 0":
+				return RigctlReplyException(command, line)
+			return None
+		if line.startswith("RPRT "):
+			return RigctlReplyException(command, line)
+		if count == 1:
+			return line
+		return [line] + [self._read_line() for _ in range(count - 1)]
+
+	def _execute(self, commands):
+		"""
+		Send every command in a single write, then read and validate the replies in order.
+		An error reply is raised (RigctlReplyException) once every reply of the batch has been read, without closing the connection
+		"""
+		for command in commands:
+			self._reply_lines(command)
+		with self._io_lock:
+			if self.socket is None and not self.connect():
+				self.metrics["errors"] += 1
+				self._errors_total.inc()
+				raise RigctlException("Not connected to %s:%s" % (self.host, self.port))
+			start = time.perf_counter()
+			try:
+				self.socket.sendall(("".join(command + "\n" for command in commands)).encode("utf-8"))
+				replies = [self._read_reply(command) for command in commands]
+			except (OSError, RigctlException):
+				self.metrics["errors"] += 1
+				self._errors_total.inc()
+				self._close_socket()
+				raise
+
+		latency = time.perf_counter() - start
+		self.metrics["commands_sent"] += len(commands)
+		self.metrics["batches"] += 1
+		self.metrics["last_latency"] = latency
+		self.metrics["total_latency"] += latency
+		self.metrics["max_latency"] = max(self.metrics["max_latency"], latency)
+		self._commands_total.inc(len(commands))
+		self._latency.observe(latency)
+		errors = [reply for reply in replies if isinstance(reply, RigctlReplyException)]
+		if errors:
+			self.metrics["errors"] += 1
+			self._errors_total.inc()
+			raise errors[0]
+		return replies
+
+	def command(self, command):
+		"""
+		Blocking call of any rigctl command, returns the reply line for get commands (list of lines for the ones in REPLY_LINES)
+		"""
+		return self._execute([command])[0]
+
+	def _execute_with_reconnect(self, commands):
+		# Unsupported commands are refused before anything is sent, not retried
+		for command in commands:
+			self._reply_lines(command)
 		try:
-			self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			self.socket.connect((self.host, self.port))
-			return True
-		except Exception as e:
-			logging.info("Failed to connect to %s:%s (try %s): %s" % (self.host, self.port, _trynumber + 1, str(e)))
-			if _trynumber < self.max_retry + 1:
-				return self.connect(_trynumber=_trynumber)
-			return False
+			return self._execute(commands)
+		except RigctlReplyException:
+			# The rig refused the command, retrying on a new connection would not change that
+			raise
+		except (OSError, RigctlException) as e:
+			# _execute() closed the socket, the retry reconnects under the io lock
+			logging.info("Failed to send %s: %s" % (commands, str(e)))
+			self.metrics["reconnects"] += 1
+			self._reconnects_total.inc()
+			return self._execute(commands)
+
+	def _sender(self):
+		while True:
+			with self._condition:
+				while self.running and self._pending_frequency is None and not self._pending_commands:
+					self._condition.wait()
+				if not self.running:
+					return
+				commands = self._pending_commands
+				self._pending_commands = []
+				if self._pending_frequency is not None:
+					commands.append("F " + str(self._pending_frequency))
+					self._pending_frequency = None
+				self._busy = True
+			try:
+				self._execute_with_reconnect(commands)
+			except (OSError, RigctlException) as e:
+				logging.info("Dropped commands %s: %s" % (commands, str(e)))
+			with self._condition:
+				self._busy = False
+				self._condition.notify_all()
+
+	def queue_command(self, command):
+		self._reply_lines(command)
+		with self._condition:
+			self._pending_commands.append(command)
+			self._condition.notify_all()
 
 	def setFrequency(self, frequency: int):
-		try:
-			self.socket.send(bytes("F " + str(int(frequency)), "utf-8"))
-		except Exception as e:
-			logging.info("Failed to set frequency %s" % (str(e)))
-			if self.connect():
-				logging.info("Reconnected to %s:%s" % (self.host, self.port))
+		frequency = int(frequency)
+		self.metrics["frequency_updates"] += 1
+		if self._thread is None:
+			try:
+				self._execute_with_reconnect(["F " + str(frequency)])
+			except (OSError, RigctlException) as e:
+				logging.info("Failed to set frequency %s" % (str(e)))
+			return
+
+		with self._condition:
+			if self._pending_frequency is not None:
+				self.metrics["frequency_coalesced"] += 1
+				self._coalesced_total.inc()
+			self._pending_frequency = frequency
+			self._condition.notify_all()
+
+	def getFrequency(self) -> int:
+		return int(float(self.command("f")))
+
+	def flush(self, timeout=None):
+		"""
+		Wait until the sender thread has no more pending updates
+		"""
+		with self._condition:
+			return self._condition.wait_for(lambda: not self._busy and self._pending_frequency is None and not self._pending_commands, timeout=timeout)
+
+	@property
+	def mean_latency(self):
+		if self.metrics["batches"] == 0:
+			return None
+		return self.metrics["total_latency"] / self.metrics["batches"]
+
+	def close(self):
+		with self._condition:
+			self.running = False
+			self._condition.notify_all()
+		if self._thread is not None:
+			self._thread.join()
+		with self._io_lock:
+			self._close_socket()
 
 
 if __name__ == "__main__":
 	sdr = SDRSharp("192.168.1.88")
 	sdr.setFrequency(101.1e6)
+	sdr.flush(timeout=5)
+	sdr.close()
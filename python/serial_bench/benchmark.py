@@ -1,22 +1,256 @@
-import serial
+import argparse
+import json
+import os
+import threading
 import time
+
+import serial
+
+from framing import FrameParser, PATTERNS, build_frame, pattern_payload, OVERHEAD
+
 PORT = "COM6"
-SPEED = 2500000
-SPEED = 115200
-SPEED = 57600 
-SPEED = 38400 
-# SPEED = 19200
-#SPEED = 9600
-
-buf = []
-t = time.time()
-
-with serial.Serial(PORT, SPEED, timeout=0) as ser:
-    while True:
-        x = ser.read()
-        if x:
-            buf.append(x)
-        if time.time() > t + 0.5:
-            print("Rx at " + str(len(buf)*2) + " bytes/sec")
-            t = time.time()
-            buf = []
\ No newline at end of file
+SPEEDS = [9600, 19200, 38400, 57600, 115200]
+CHUNK_SIZES = [16, 64, 256]
+READ_BUFFER_SIZE = 64 * 1024
+
+
+class PtyLoopback:
+	"""
+	Linux pty pair with an echo thread on the master side: whatever is written to `port` comes back on it,
+	like a TX/RX jumper on a real adapter. A pty has no real baud rate, so it measures the software path only.
+	"""
+	def __init__(self):
+		# POSIX only, imported here so the COM port path still works on Windows
+		import tty
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.master)
+		tty.setraw(self.slave)
+		self.port = os.ttyname(self.slave)
+		self.running = True
+		self._thread = threading.Thread(target=self._echo, daemon=True)
+		self._thread.start()
+
+	def _echo(self):
+		while self.running:
+			try:
+				data = os.read(self.master, READ_BUFFER_SIZE)
+			except OSError:
+				return
+			view = memoryview(data)
+			while view:
+				written = os.write(self.master, view)
+				view = view[written:]
+
+	def close(self):
+		self.running = False
+		os.close(self.slave)
+		os.close(self.master)
+		self._thread.join(timeout=1)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+class BulkReader:
+	"""
+	Read whatever is available into a preallocated buffer (one syscall per chunk, no per byte allocation)
+	"""
+	def __init__(self, ser, size=READ_BUFFER_SIZE):
+		self.ser = ser
+		self.buffer = bytearray(size)
+		self.view = memoryview(self.buffer)
+
+	def read(self):
+		waiting = self.ser.in_waiting
+		if waiting:
+			n = self.ser.readinto(self.view[:min(waiting, len(self.buffer))])
+		else:
+			# Blocks up to the port timeout for the first byte
+			n = self.ser.readinto(self.view[:1])
+		return self.view[:n or 0]
+
+
+def percentile(sorted_values, p):
+	if not sorted_values:
+		return 0
+	return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def measure_throughput(ser, chunk_size, duration=2.0, drain=0.5):
+	"""
+	Loopback throughput: a writer thread sends sequence numbered frames carrying `chunk_size` bytes for `duration` seconds
+	while the reader parses what comes back
+	"""
+	parser = FrameParser()
+	reader = BulkReader(ser)
+	sent = {"frames": 0, "bytes": 0}
+	stop = threading.Event()
+	payload = bytes(range(256)) * (chunk_size // 256 + 1)
+	payload = payload[:chunk_size]
+
+	def writer():
+		sequence = 0
+		while not stop.is_set():
+			frame = build_frame(sequence, payload)
+			ser.write(frame)
+			sequence += 1
+			sent["frames"] = sequence
+			sent["bytes"] += len(frame)
+
+	ser.reset_input_buffer()
+	thread = threading.Thread(target=writer, daemon=True)
+	received_bytes = 0
+	start = time.perf_counter()
+	thread.start()
+	deadline = start + duration
+	while time.perf_counter() < deadline:
+		data = reader.read()
+		received_bytes += len(data)
+		parser.feed(data)
+	stop.set()
+	thread.join()
+	elapsed = time.perf_counter() - start
+
+	drain_deadline = time.perf_counter() + drain
+	while time.perf_counter() < drain_deadline and parser.frames + parser.lost < sent["frames"]:
+		data = reader.read()
+		received_bytes += len(data)
+		parser.feed(data)
+
+	# Frames never received at the end of the run are losses too
+	missing_tail = max(0, sent["frames"] - (parser.next_sequence or 0))
+	return {
+		"chunk_size": chunk_size,
+		"sent_frames": sent["frames"],
+		"received_frames": parser.frames,
+		"lost_frames": parser.lost + missing_tail,
+		"crc_errors": parser.crc_errors,
+		"out_of_order": parser.out_of_order,
+		"throughput_bytes_per_second": round(received_bytes / elapsed, 1),
+		"goodput_bytes_per_second": round(parser.payload_bytes / elapsed, 1),
+	}
+
+
+def measure_latency(ser, count=100, chunk_size=16, timeout=1.0):
+	"""
+	Round trip latency of single frames through the loopback
+	"""
+	parser = FrameParser()
+	reader = BulkReader(ser)
+	payload = b"\x55" * chunk_size
+	latencies = []
+	timeouts = 0
+
+	ser.reset_input_buffer()
+	for sequence in range(count):
+		start = time.perf_counter()
+		ser.write(build_frame(sequence, payload))
+		deadline = start + timeout
+		received = False
+		while not received and time.perf_counter() < deadline:
+			for frame_sequence, _ in parser.feed(reader.read()):
+				if frame_sequence == sequence:
+					received = True
+		if received:
+			latencies.append(time.perf_counter() - start)
+		else:
+			timeouts += 1
+
+	latencies.sort()
+	return {
+		"chunk_size": chunk_size,
+		"samples": len(latencies),
+		"timeouts": timeouts,
+		"latency_ms_p50": round(percentile(latencies, 50) * 1000, 3),
+		"latency_ms_p90": round(percentile(latencies, 90) * 1000, 3),
+		"latency_ms_p99": round(percentile(latencies, 99) * 1000, 3),
+		"latency_ms_max": round(latencies[-1] * 1000, 3) if latencies else 0,
+	}
+
+
+def measure_receive(ser, duration=2.0, pattern=None, seed=0):
+	"""
+	Receive only mode (pair with flooder.py on the other end): bulk reads, frames are verified if the flooder sends framed data.
+	With `pattern`/`seed` matching the flooder, every payload is also regenerated and compared
+	"""
+	parser = FrameParser()
+	reader = BulkReader(ser)
+	received_bytes = 0
+	payload_mismatches = 0
+	start = time.perf_counter()
+	deadline = start + duration
+	while time.perf_counter() < deadline:
+		data = reader.read()
+		received_bytes += len(data)
+		frames = parser.feed(data)
+		if pattern is not None:
+			for sequence, payload in frames:
+				if payload != pattern_payload(pattern, sequence, len(payload), seed):
+					payload_mismatches += 1
+	elapsed = time.perf_counter() - start
+	result = {"throughput_bytes_per_second": round(received_bytes / elapsed, 1)}
+	result.update(parser.__dict__)
+	if pattern is not None:
+		result["payload_mismatches"] = payload_mismatches
+	return result
+
+
+def run_sweep(port, speeds, chunk_sizes, duration=2.0, latency_samples=100, mode="loopback", pattern=None, seed=0):
+	results = []
+	for speed in speeds:
+		with serial.Serial(port, speed, timeout=0.05, write_timeout=duration + 1) as ser:
+			if mode == "rx":
+				result = {"baud": speed, "mode": "rx"}
+				result.update(measure_receive(ser, duration=duration, pattern=pattern, seed=seed))
+				results.append(result)
+				continue
+			for chunk_size in chunk_sizes:
+				result = {"baud": speed, "mode": "loopback", "theoretical_bytes_per_second": speed // 10}
+				result.update(measure_throughput(ser, chunk_size, duration=duration))
+				if latency_samples:
+					latency = measure_latency(ser, count=latency_samples, chunk_size=chunk_size)
+					latency.pop("chunk_size")
+					result.update(latency)
+				results.append(result)
+	return results
+
+
+def print_results(results):
+	columns = [key for key in results[0].keys()]
+	print("  ".join(columns))
+	for result in results:
+		print("  ".join(str(result[column]).rjust(len(column)) for column in columns))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serial link throughput/latency benchmark (loopback: TX jumped to RX, rx: pair with flooder.py)")
+	parser.add_argument("--port", default=PORT)
+	parser.add_argument("--pty", action="store_true", help="Benchmark against a local pty loopback instead of --port")
+	parser.add_argument("--mode", choices=["loopback", "rx"], default="loopback")
+	parser.add_argument("--speeds", type=int, nargs="+", default=SPEEDS)
+	parser.add_argument("--chunk-sizes", type=int, nargs="+", default=CHUNK_SIZES, help="Payload bytes per frame (frame overhead is %d bytes)" % OVERHEAD)
+	parser.add_argument("--duration", type=float, default=2.0, help="Seconds per throughput measurement")
+	parser.add_argument("--latency-samples", type=int, default=100)
+	parser.add_argument("--pattern", choices=PATTERNS, default=None, help="rx mode: verify the payloads against this flooder.py pattern")
+	parser.add_argument("--seed", type=int, default=0, help="rx mode: seed used by flooder.py for the random pattern")
+	parser.add_argument("--json", action="store_true", help="Print the results as json")
+	args = parser.parse_args()
+
+	loopback = PtyLoopback() if args.pty else None
+	try:
+		results = run_sweep(
+			loopback.port if loopback else args.port, args.speeds, args.chunk_sizes,
+			duration=args.duration, latency_samples=args.latency_samples, mode=args.mode,
+			pattern=args.pattern, seed=args.seed
+		)
+	finally:
+		if loopback:
+			loopback.close()
+
+	if args.json:
+		print(json.dumps(results, indent=4))
+	else:
+		print_results(results)
@@ -1,13 +1,203 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
 import serial
 
+from framing import PATTERNS, build_frame, pattern_payload
+
 PORT = "COM9"
-SPEED = 2500000
 SPEED = 115200
-SPEED = 57600 
-SPEED = 38400 
-# SPEED = 19200
-# SPEED = 9600
-
-with serial.Serial(PORT, SPEED, timeout=1) as ser:
-	while True:
-		ser.write(b'a' * 32)
\ No newline at end of file
+
+
+class Flooder:
+	"""
+	Traffic generator for serial links.
+
+	framed=True sends CRC frames with a sequence number (see framing.py) so `benchmark.py --mode rx` can report
+	drops, reordering and corruption; framed=False writes the raw pattern bytes only.
+	rate (bytes/s) paces the output, burst/burst_interval send `burst` frames back to back every `burst_interval` seconds.
+	"""
+	def __init__(self, ser, pattern="counter", chunk_size=32, framed=True, rate=None, burst=None, burst_interval=1.0, seed=0):
+		if pattern not in PATTERNS:
+			raise ValueError("Unknown pattern %s, expected one of %s" % (pattern, PATTERNS))
+		self.ser = ser
+		self.pattern = pattern
+		self.chunk_size = chunk_size
+		self.framed = framed
+		self.rate = rate
+		self.burst = burst
+		self.burst_interval = burst_interval
+		self.seed = seed
+
+		self.sequence = 0
+		self.bytes_sent = 0
+		self.write_time = 0.0
+		self.sleep_time = 0.0
+		self.write_timeouts = 0
+		self._consecutive_timeouts = 0
+		self.start = None
+		self.end = None
+		# The static patterns do not depend on the sequence, build them once
+		self._static_payload = pattern_payload(pattern, 0, chunk_size, seed) if pattern in ("compressible", "constant") else None
+
+	def next_chunk(self):
+		payload = self._static_payload
+		if payload is None:
+			payload = pattern_payload(self.pattern, self.sequence, self.chunk_size, self.seed)
+		chunk = build_frame(self.sequence, payload) if self.framed else payload
+		self.sequence += 1
+		return chunk
+
+	def _write(self, chunk):
+		start = time.perf_counter()
+		try:
+			self.ser.write(chunk)
+			self.bytes_sent += len(chunk)
+			self._consecutive_timeouts = 0
+		except serial.SerialTimeoutException:
+			# Nobody is draining the other side, the chunk may have been partially written
+			self.write_timeouts += 1
+			self._consecutive_timeouts += 1
+		self.write_time += time.perf_counter() - start
+
+	def _sleep_until(self, deadline):
+		delay = deadline - time.perf_counter()
+		if delay > 0:
+			time.sleep(delay)
+			self.sleep_time += delay
+
+	def run(self, duration=None, count=None, max_consecutive_timeouts=3):
+		"""
+		Send until `duration` seconds elapsed or `count` chunks were sent (forever if both are None).
+		Gives up after `max_consecutive_timeouts` write timeouts in a row (receiver gone)
+		"""
+		self.start = time.perf_counter()
+		deadline = None if duration is None else self.start + duration
+
+		def keep_going():
+			return (count is None or self.sequence < count) and (deadline is None or time.perf_counter() < deadline) and self._consecutive_timeouts < max_consecutive_timeouts
+
+		next_burst = self.start
+		try:
+			while keep_going():
+				if self.burst:
+					self._sleep_until(next_burst)
+					next_burst += self.burst_interval
+					for _ in range(self.burst):
+						if not keep_going():
+							break
+						self._write(self.next_chunk())
+				else:
+					self._write(self.next_chunk())
+
+				if self.rate:
+					self._sleep_until(self.start + self.bytes_sent / self.rate)
+		except KeyboardInterrupt:
+			pass
+		try:
+			self.ser.flush()
+		except serial.SerialTimeoutException:
+			pass
+		self.end = time.perf_counter()
+		return self.summary
+
+	@property
+	def summary(self):
+		elapsed = (self.end or time.perf_counter()) - self.start
+		return {
+			"port": self.ser.port,
+			"baud": self.ser.baudrate,
+			"pattern": self.pattern,
+			"framed": self.framed,
+			"chunk_size": self.chunk_size,
+			"seed": self.seed,
+			"target_rate": self.rate,
+			"burst": self.burst,
+			"burst_interval": self.burst_interval if self.burst else None,
+			"chunks": self.sequence,
+			"bytes": self.bytes_sent,
+			"elapsed": round(elapsed, 3),
+			"bytes_per_second": round(self.bytes_sent / elapsed, 1) if elapsed else 0,
+			# Time blocked in write() means the link (or the receiver) is the bottleneck
+			"write_blocked_ratio": round(self.write_time / elapsed, 3) if elapsed else 0,
+			"sleep_ratio": round(self.sleep_time / elapsed, 3) if elapsed else 0,
+			"write_timeouts": self.write_timeouts,
+		}
+
+
+class PtyPort:
+	"""
+	Master side of a pty pair with the few serial.Serial methods Flooder uses, the receiver opens `slave_path`
+	"""
+	def __init__(self, baudrate=SPEED, write_timeout=1.0):
+		# POSIX only, imported here so the COM port path still works on Windows
+		import tty
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.master)
+		tty.setraw(self.slave)
+		os.set_blocking(self.master, False)
+		self.slave_path = os.ttyname(self.slave)
+		self.port = "pty:" + self.slave_path
+		self.baudrate = baudrate
+		self.write_timeout = write_timeout
+
+	def write(self, data):
+		view = memoryview(data)
+		deadline = time.monotonic() + self.write_timeout
+		while view:
+			try:
+				view = view[os.write(self.master, view):]
+			except BlockingIOError:
+				import select
+				remaining = deadline - time.monotonic()
+				if remaining <= 0 or not select.select([], [self.master], [], remaining)[1]:
+					raise serial.SerialTimeoutException("Write timeout")
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def close(self):
+		os.close(self.master)
+		os.close(self.slave)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serial traffic generator, pair with `benchmark.py --mode rx` to verify the received stream")
+	parser.add_argument("--port", default=PORT)
+	parser.add_argument("--speed", type=int, default=SPEED)
+	parser.add_argument("--pty", action="store_true", help="Flood a local pty, the receiver side path is printed on stderr")
+	parser.add_argument("--pattern", choices=PATTERNS, default="counter")
+	parser.add_argument("--raw", action="store_true", help="Send the raw pattern without sequence/CRC framing")
+	parser.add_argument("--chunk-size", type=int, default=32, help="Payload bytes per write")
+	parser.add_argument("--rate", type=float, default=None, help="Target rate in bytes per second (default: as fast as the port accepts)")
+	parser.add_argument("--burst", type=int, default=None, help="Send this many chunks back to back every --burst-interval seconds")
+	parser.add_argument("--burst-interval", type=float, default=1.0)
+	parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+	parser.add_argument("--count", type=int, default=None, help="Stop after this many chunks")
+	parser.add_argument("--seed", type=int, default=random.randrange(1 << 16), help="Seed of the random pattern")
+	args = parser.parse_args()
+
+	if args.pty:
+		port = PtyPort(baudrate=args.speed)
+		print("Receiver side: %s" % port.slave_path, file=sys.stderr)
+	else:
+		port = serial.Serial(args.port, args.speed, timeout=1, write_timeout=1)
+
+	with port as ser:
+		flooder = Flooder(
+			ser, pattern=args.pattern, chunk_size=args.chunk_size, framed=not args.raw,
+			rate=args.rate, burst=args.burst, burst_interval=args.burst_interval, seed=args.seed
+		)
+		summary = flooder.run(duration=args.duration, count=args.count)
+	print(json.dumps(summary))
@@ -0,0 +1,124 @@
+import random
+import struct
+import zlib
+
+# Frame: MAGIC(2) | sequence(4) | payload length(2) | payload | crc32 of sequence+length+payload (4)
+MAGIC = b"\xa5\x5a"
+HEADER = struct.Struct("!2sIH")
+CRC = struct.Struct("!I")
+OVERHEAD = HEADER.size + CRC.size
+MAX_PAYLOAD = 0xFFFF
+
+
+def build_frame(sequence, payload):
+	header = HEADER.pack(MAGIC, sequence & 0xFFFFFFFF, len(payload))
+	return header + payload + CRC.pack(zlib.crc32(payload, zlib.crc32(header[2:])))
+
+
+class FrameParser:
+	"""
+	Incremental frame decoder, feed() it whatever was read from the port and it returns the complete frames.
+	Keeps track of lost (sequence gaps), duplicated/reordered and corrupted frames.
+	"""
+	def __init__(self, max_payload=MAX_PAYLOAD):
+		self.max_payload = max_payload
+		self._buffer = bytearray()
+		self.next_sequence = None
+		self.frames = 0
+		self.payload_bytes = 0
+		self.lost = 0
+		self.out_of_order = 0
+		self.crc_errors = 0
+		self.discarded_bytes = 0
+
+	def feed(self, data):
+		buffer = self._buffer
+		buffer += data
+		frames = []
+		pos = 0
+		end = len(buffer)
+
+		while True:
+			start = buffer.find(MAGIC, pos)
+			if start == -1:
+				# Keep a possible first magic byte for the next feed
+				keep = 1 if end and buffer[end - 1] == MAGIC[0] else 0
+				self.discarded_bytes += end - pos - keep
+				pos = end - keep
+				break
+			self.discarded_bytes += start - pos
+			if end - start < HEADER.size:
+				pos = start
+				break
+
+			_, sequence, length = HEADER.unpack_from(buffer, start)
+			if length > self.max_payload:
+				# Not a real frame start, resync on the next magic
+				pos = start + 1
+				self.discarded_bytes += 1
+				continue
+			frame_end = start + HEADER.size + length + CRC.size
+			if frame_end > end:
+				pos = start
+				break
+
+			payload = bytes(buffer[start + HEADER.size:frame_end - CRC.size])
+			(crc,) = CRC.unpack_from(buffer, frame_end - CRC.size)
+			if crc != zlib.crc32(payload, zlib.crc32(buffer[start + 2:start + HEADER.size])):
+				self.crc_errors += 1
+				pos = start + 1
+				self.discarded_bytes += 1
+				continue
+
+			self._account(sequence)
+			self.frames += 1
+			self.payload_bytes += length
+			frames.append((sequence, payload))
+			pos = frame_end
+
+		del buffer[:pos]
+		return frames
+
+	def _account(self, sequence):
+		if self.next_sequence is not None:
+			gap = (sequence - self.next_sequence) & 0xFFFFFFFF
+			if gap >= 0x80000000:
+				# Sequence went backward
+				self.out_of_order += 1
+				return
+			self.lost += gap
+		self.next_sequence = (sequence + 1) & 0xFFFFFFFF
+
+	@property
+	def __dict__(self):
+		return {
+			"frames": self.frames,
+			"payload_bytes": self.payload_bytes,
+			"lost": self.lost,
+			"out_of_order": self.out_of_order,
+			"crc_errors": self.crc_errors,
+			"discarded_bytes": self.discarded_bytes,
+		}
+
+
+PATTERNS = ["counter", "random", "compressible", "constant"]
+_COMPRESSIBLE_TEXT = b"The quick brown fox jumps over the lazy dog. "
+_COUNTER = bytes(range(256))
+
+
+def pattern_payload(pattern, sequence, size, seed=0):
+	"""
+	Deterministic payload for a frame so the receiver can regenerate and compare it
+	"""
+	if pattern == "counter":
+		start = sequence & 0xFF
+		repeat = _COUNTER * ((start + size) // 256 + 1)
+		return repeat[start:start + size]
+	if pattern == "random":
+		return random.Random((seed << 32) ^ sequence).randbytes(size)
+	if pattern == "compressible":
+		repeat = _COMPRESSIBLE_TEXT * (size // len(_COMPRESSIBLE_TEXT) + 1)
+		return repeat[:size]
+	if pattern == "constant":
+		return b"a" * size
+	raise ValueError("Unknown pattern %s" % pattern)
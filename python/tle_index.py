@@ -0,0 +1,10 @@
+def build_index(tle_lines):
+	"""
+	name -> (line 1, line 2) of a three line TLE file (celestrak format), ready for ephem.readtle(name, *index[name])
+
+	Kept free of any dependency so the tools that only need the TLEs don't pull GNU Radio / zmq in through doppler
+	"""
+	index = {}
+	for i in range(0, len(tle_lines) - 2, 3):
+		index[tle_lines[i].strip()] = (tle_lines[i + 1], tle_lines[i + 2])
+	return index
@@ -1,55 +1,265 @@
+import asyncio
+import logging
 import socket
 from threading import Thread
 import time
 
+from metrics import REGISTRY
 
-class Chat(Thread):
+logger = logging.getLogger(__name__)
+
+TWITCH_IRC_HOST = "irc.chat.twitch.tv"
+TWITCH_IRC_PORT = 6667
+
+CHAT_LINES = REGISTRY.counter("twitch_chat_lines_total", "IRC lines received, by result (parsed or invalid)", ("channel", "result"))
+CHAT_MESSAGES = REGISTRY.counter("twitch_chat_messages_total", "PRIVMSG received for the joined channel", ("channel",))
+CHAT_SENT = REGISTRY.counter("twitch_chat_sent_total", "IRC lines sent", ("channel",))
+CHAT_CONNECTIONS = REGISTRY.counter("twitch_chat_connections_total", "Connections opened to the IRC server", ("channel",))
+CHAT_HANDLER_SECONDS = REGISTRY.histogram("twitch_chat_handler_seconds", "Time spent in the message handler", ("channel",))
+
+
+class IRCMessage:
+	__slots__ = ("raw", "tags", "prefix", "command", "params")
+
+	def __init__(self, raw, tags, prefix, command, params):
+		self.raw = raw
+		self.tags = tags
+		self.prefix = prefix
+		self.command = command
+		self.params = params
+
+	def __str__(self):
+		return "<IRCMessage Prefix:" + str(self.prefix) + " Command:" + str(self.command) + " Params:" + str(self.params) + ">"
+
+	def __repr__(self):
+		return str(self)
+
+	@property
+	def nick(self):
+		if self.prefix is None:
+			return None
+		return self.prefix.split("!", 1)[0]
+
+	@property
+	def channel(self):
+		if self.params and self.params[0][:1] == "#":
+			return self.params[0][1:]
+		return None
+
+	@property
+	def text(self):
+		return self.params[-1] if self.params else None
+
+	@staticmethod
+	def parse(line):
+		"""
+		Parse one IRC line (without the line terminator) following RFC1459 + IRCv3 message tags:
+		[@tags] [:prefix] command [params] [:trailing]
+		"""
+		tags = None
+		prefix = None
+		pos = 0
+		length = len(line)
+
+		if line[:1] == "@":
+			end = line.find(" ")
+			if end == -1:
+				return None
+			tags = {}
+			for tag in line[1:end].split(";"):
+				key, _, value = tag.partition("=")
+				tags[key] = value
+			pos = end + 1
+			while pos < length and line[pos] == " ":
+				pos += 1
+
+		if line[pos:pos + 1] == ":":
+			end = line.find(" ", pos)
+			if end == -1:
+				return None
+			prefix = line[pos + 1:end]
+			pos = end + 1
+
+		rest = line[pos:]
+		trailing = rest.find(" :")
+		if trailing == -1:
+			params = rest.split()
+		else:
+			params = rest[:trailing].split()
+			params.append(rest[trailing + 2:])
+
+		if not params or trailing == 0:
+			return None
+		command = params.pop(0)
+		return IRCMessage(line, tags, prefix, command.upper(), params)
+
+
+class LineReader:
+	"""
+	Read complete lines from a socket using large recv() calls instead of one syscall per byte
+	"""
+	def __init__(self, sock, chunk_size=65536):
+		self.sock = sock
+		self.chunk_size = chunk_size
+		self._buffer = bytearray()
+
+	def feed(self, data):
+		"""
+		Append raw bytes to the internal buffer and return the list of complete lines decoded as UTF-8
+		"""
+		buffer = self._buffer
+		buffer += data
+		end = buffer.rfind(b"\n")
+		if end == -1:
+			return []
+		lines = bytes(buffer[:end]).decode("UTF-8", errors="replace").split("\n")
+		del buffer[:end + 1]
+		return [line[:-1] if line[-1:] == "\r" else line for line in lines]
+
+	def read_lines(self):
+		"""
+		Block until at least one chunk is received, returns None when the connection is closed
+		"""
+		data = self.sock.recv(self.chunk_size)
+		if not data:
+			return None
+		return self.feed(data)
+
+
+class ChatProtocol:
+	"""
+	Connection independent part of the chat client, decides what to answer to each parsed message
+	"""
 	def __init__(self, channel_id="thestaticturtle", oauth="none", username="TestBot"):
-		Thread.__init__(self)
 		self._channel_id = channel_id
 		self._username = username
 		self._oauth = oauth
-		self._ircsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.is_connected = False
 		self.handler = None
-		self.running = True
+
+		# Precomputed match keys
+		self._channel = "#" + channel_id
+		self._privmsg_prefix = "PRIVMSG " + self._channel + " :"
+
+		self._lines_parsed = CHAT_LINES.labels(channel_id, "parsed")
+		self._lines_invalid = CHAT_LINES.labels(channel_id, "invalid")
+		self._messages = CHAT_MESSAGES.labels(channel_id)
+		self._sent = CHAT_SENT.labels(channel_id)
+		self._connections = CHAT_CONNECTIONS.labels(channel_id)
+		self._handler_seconds = CHAT_HANDLER_SECONDS.labels(channel_id)
 
 	def _send_stuff(self, data):
-		print("< " + data)
-		self._ircsock.send(bytes(data + "\n", "UTF-8"))
+		raise NotImplementedError
+
+	def _login(self):
+		self._send_stuff("PASS " + self._oauth)
+		self._send_stuff("NICK " + self._username)
 
 	def _join(self):
-		self._send_stuff("JOIN #" + self._channel_id)
+		self._send_stuff("JOIN " + self._channel)
 
 	def _handle_line(self, data):
-		print("> " + data)
+		logger.debug("> %s", data)
+		message = IRCMessage.parse(data)
+		if message is not None:
+			self._lines_parsed.inc()
+			self._handle_message(message)
+		else:
+			self._lines_invalid.inc()
 
-		if ":tmi.twitch.tv 376 "+self._username in data:
-			self._join()
+	def _handle_message(self, message):
+		command = message.command
 
-		if "PING :tmi.twitch.tv" in data:
-			self._send_stuff("PONG :tmi.twitch.tv")
+		if command == "PRIVMSG":
+			# A malformed PRIVMSG may come without any parameter
+			if message.params and message.params[0] == self._channel:
+				self._messages.inc()
+				if self.handler is not None:
+					start = time.perf_counter()
+					self.handler(message.text)
+					self._handler_seconds.observe(time.perf_counter() - start)
 
-		if ":"+self._username+".tmi.twitch.tv 366 "+self._username+" #"+self._channel_id+" :End of /NAMES list" in data:
-			self.is_connected = True
+		elif command == "PING":
+			self._send_stuff("PONG :" + (message.text or "tmi.twitch.tv"))
 
-		if self.handler is not None and "PRIVMSG #"+self._channel_id+ " :" in data:
-			self.handler(data.split("PRIVMSG #"+self._channel_id+ " :")[1])
+		elif command == "376":
+			self._join()
+
+		elif command == "366":
+			if len(message.params) > 1 and message.params[1] == self._channel:
+				self.is_connected = True
 
 	def send_text(self, text):
-		self._send_stuff("PRIVMSG #" + self._channel_id + " :" + text[0:450])
+		self._send_stuff(self._privmsg_prefix + text[0:450])
+
+
+class Chat(ChatProtocol, Thread):
+	def __init__(self, channel_id="thestaticturtle", oauth="none", username="TestBot", host=TWITCH_IRC_HOST, port=TWITCH_IRC_PORT):
+		Thread.__init__(self)
+		ChatProtocol.__init__(self, channel_id=channel_id, oauth=oauth, username=username)
+		self._host = host
+		self._port = port
+		self._ircsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.running = True
+
+	def _send_stuff(self, data):
+		logger.debug("< %s", data)
+		self._ircsock.sendall(bytes(data + "\r\n", "UTF-8"))
+		self._sent.inc()
 
 	def stop(self):
 		self.running = False
 
 	def run(self):
-		self._ircsock.connect(("irc.chat.twitch.tv", 6667))
-		self._send_stuff("PASS " + self._oauth)
-		self._send_stuff("NICK " + self._username)
+		self._ircsock.connect((self._host, self._port))
+		self._connections.inc()
+		self._login()
+
+		reader = LineReader(self._ircsock)
+		while self.running:
+			lines = reader.read_lines()
+			if lines is None:
+				break
+			for line in lines:
+				self._handle_line(line)
+
+
+class AsyncChat(ChatProtocol):
+	"""
+	asyncio variant of Chat, use `await chat.run()` inside an event loop
+	"""
+	def __init__(self, channel_id="thestaticturtle", oauth="none", username="TestBot", host=TWITCH_IRC_HOST, port=TWITCH_IRC_PORT):
+		super(AsyncChat, self).__init__(channel_id=channel_id, oauth=oauth, username=username)
+		self._host = host
+		self._port = port
+		self._reader = None
+		self._writer = None
+		self.running = True
+
+	def _send_stuff(self, data):
+		logger.debug("< %s", data)
+		self._writer.write(bytes(data + "\r\n", "UTF-8"))
+		self._sent.inc()
+
+	async def drain(self):
+		await self._writer.drain()
+
+	def stop(self):
+		self.running = False
+		if self._writer is not None:
+			self._writer.close()
+
+	async def run(self):
+		self._reader, self._writer = await asyncio.open_connection(self._host, self._port, limit=2 ** 20)
+		self._connections.inc()
+		self._login()
+		await self._writer.drain()
 
-		msg = b''
+		line_reader = LineReader(None)
 		while self.running:
-			msg += self._ircsock.recv(1)
-			if msg[-1] == 10:
-				self._handle_line(msg.decode("UTF-8")[:-1])
-				msg = b''
+			data = await self._reader.read(line_reader.chunk_size)
+			if not data:
+				break
+			for line in line_reader.feed(data):
+				self._handle_line(line)
+			await self._writer.drain()
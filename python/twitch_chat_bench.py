@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import logging
+import statistics
+import threading
+import time
+
+import twitch_chat
+
+logger = logging.getLogger(__name__)
+
+
+class FakeTwitchServer:
+	"""
+	Local stand-in for irc.chat.twitch.tv: answers PASS/NICK with the 001..376 welcome, JOIN with 353/366,
+	PING with PONG, and can flood every joined client with synthetic PRIVMSG traffic.
+	Runs its own asyncio loop in a background thread so it can be used from blocking code.
+	"""
+	def __init__(self, host="127.0.0.1", port=0):
+		self.host = host
+		self.port = port
+		self.clients = []
+		self.received = []
+		self._loop = None
+		self._server = None
+		self._thread = None
+		self._ready = threading.Event()
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+		self._ready.wait()
+		return self
+
+	def stop(self):
+		if self._loop is not None:
+			asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+		self._thread.join()
+
+	async def _shutdown(self):
+		self._server.close()
+		for client in list(self.clients):
+			client["writer"].close()
+		# Closing the transports makes every _handle_client() see EOF and return on its own
+		tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+		if tasks:
+			await asyncio.wait(tasks, timeout=1)
+		self._loop.stop()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def _run(self):
+		self._loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self._loop)
+		self._server = self._loop.run_until_complete(asyncio.start_server(self._handle_client, self.host, self.port))
+		self.port = self._server.sockets[0].getsockname()[1]
+		self._ready.set()
+		try:
+			self._loop.run_forever()
+		finally:
+			self._loop.close()
+
+	async def _handle_client(self, reader, writer):
+		client = {"writer": writer, "nick": "*", "channels": set(), "joined": asyncio.Event()}
+		self.clients.append(client)
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				line = line.decode("UTF-8").rstrip("\r\n")
+				self.received.append(line)
+				command, _, args = line.partition(" ")
+				command = command.upper()
+
+				if command == "NICK":
+					nick = client["nick"] = args.strip().lower()
+					for code, text in (("001", "Welcome, GLHF!"), ("002", "Your host is tmi.twitch.tv"), ("003", "This server is rather new"), ("004", "-"), ("375", "-"), ("372", "You are in a maze of twisty passages."), ("376", ">")):
+						writer.write((":tmi.twitch.tv " + code + " " + nick + " :" + text + "\r\n").encode())
+
+				elif command == "JOIN":
+					nick = client["nick"]
+					for channel in args.strip().split(","):
+						client["channels"].add(channel)
+						writer.write((":" + nick + "!" + nick + "@" + nick + ".tmi.twitch.tv JOIN " + channel + "\r\n").encode())
+						writer.write((":" + nick + ".tmi.twitch.tv 353 " + nick + " = " + channel + " :" + nick + "\r\n").encode())
+						writer.write((":" + nick + ".tmi.twitch.tv 366 " + nick + " " + channel + " :End of /NAMES list\r\n").encode())
+					client["joined"].set()
+
+				elif command == "PING":
+					writer.write(("PONG :" + args.lstrip(":") + "\r\n").encode())
+
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			if client in self.clients:
+				self.clients.remove(client)
+			writer.close()
+
+	@staticmethod
+	def privmsg(channel, index, payload):
+		# The text starts with the send time (perf_counter, only meaningful in this process) so the chat handler,
+		# which only gets the text, can measure the server -> handler latency
+		return ("@id=" + str(index) + " :bench!bench@bench.tmi.twitch.tv PRIVMSG " + channel + " :" + repr(time.perf_counter()) + " " + payload + "\r\n").encode()
+
+	async def _blast(self, count, rate, payload, batch):
+		for client in list(self.clients):
+			await client["joined"].wait()
+
+		start = time.perf_counter()
+		sent = 0
+		while sent < count:
+			n = min(batch, count - sent)
+			for client in list(self.clients):
+				writer = client["writer"]
+				for channel in client["channels"]:
+					writer.write(b"".join(self.privmsg(channel, sent + i, payload) for i in range(n)))
+				await writer.drain()
+			sent += n
+			if rate:
+				delay = start + sent / rate - time.perf_counter()
+				if delay > 0:
+					await asyncio.sleep(delay)
+
+	def blast(self, count, rate=None, payload="Kappa this is a benchmark message", batch=100):
+		"""
+		Send `count` PRIVMSG to every joined channel of every client, at `rate` messages per second (None = as fast as possible).
+		Blocks until everything was written.
+		"""
+		future = asyncio.run_coroutine_threadsafe(self._blast(count, rate, payload, batch), self._loop)
+		return future.result()
+
+
+def run_benchmark(count=100000, rate=None, payload="Kappa this is a benchmark message", use_async=False):
+	"""
+	Measure how fast twitch_chat parses and dispatches PRIVMSG, returns a dict of results
+	"""
+	latencies = []
+	done = threading.Event()
+
+	with FakeTwitchServer() as server:
+		if use_async:
+			chat = twitch_chat.AsyncChat(channel_id="bench", username="benchbot", host=server.host, port=server.port)
+			loop = asyncio.new_event_loop()
+			thread = threading.Thread(target=loop.run_until_complete, args=(chat.run(),), daemon=True)
+		else:
+			chat = twitch_chat.Chat(channel_id="bench", username="benchbot", host=server.host, port=server.port)
+			thread = chat
+		thread.daemon = True
+
+		# The handler is called by the real _handle_message dispatch (channel check, metrics), it records the latency
+		# from the send time the fake server puts at the start of the text
+		def timed_handler(text):
+			latencies.append(time.perf_counter() - float(text.split(" ", 1)[0]))
+			if len(latencies) >= count:
+				done.set()
+		chat.handler = timed_handler
+
+		thread.start()
+		while not chat.is_connected:
+			time.sleep(0.01)
+
+		cpu_start = time.process_time()
+		start = time.perf_counter()
+		server.blast(count, rate=rate, payload=payload)
+		done.wait(timeout=max(30, count / 1000))
+		duration = time.perf_counter() - start
+		cpu = time.process_time() - cpu_start
+
+		if use_async:
+			loop.call_soon_threadsafe(chat.stop)
+		else:
+			chat.stop()
+
+	received = len(latencies)
+	latencies.sort()
+	return {
+		"client": "AsyncChat" if use_async else "Chat",
+		"messages": received,
+		"duration": round(duration, 3),
+		"messages_per_second": round(received / duration, 1) if duration else 0,
+		# The fake server shares this process, so this is an upper bound of the client cost
+		"cpu_us_per_message": round(cpu / received * 1e6, 2) if received else 0,
+		"latency_ms_p50": round(latencies[received // 2] * 1000, 3) if received else 0,
+		"latency_ms_p99": round(latencies[min(received - 1, int(received * 0.99))] * 1000, 3) if received else 0,
+		"latency_ms_mean": round(statistics.mean(latencies) * 1000, 3) if received else 0,
+	}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Offline throughput benchmark for twitch_chat against a fake twitch IRC server")
+	parser.add_argument("--count", type=int, default=100000, help="Number of PRIVMSG to send")
+	parser.add_argument("--rate", type=float, default=None, help="Messages per second (default: as fast as possible)")
+	parser.add_argument("--async", dest="use_async", action="store_true", help="Benchmark AsyncChat instead of Chat")
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+	for key, value in run_benchmark(count=args.count, rate=args.rate, use_async=args.use_async).items():
+		print("%-20s %s" % (key, value))
@@ -0,0 +1,345 @@
+import asyncio
+import collections
+import logging
+import time
+
+from twitch_chat import IRCMessage, LineReader, TWITCH_IRC_HOST, TWITCH_IRC_PORT
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+	"""
+	Classic token bucket: `capacity` tokens, refilled continuously at `capacity / period` tokens per second
+	"""
+	def __init__(self, capacity, period):
+		self.capacity = capacity
+		self.rate = capacity / period
+		self._tokens = float(capacity)
+		self._last = time.monotonic()
+
+	def _refill(self, now):
+		self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+		self._last = now
+
+	def delay(self, now=None):
+		"""
+		Seconds to wait before a token is available (0 if one is available right now)
+		"""
+		self._refill(time.monotonic() if now is None else now)
+		if self._tokens >= 1:
+			return 0
+		return (1 - self._tokens) / self.rate
+
+	def consume(self, now=None):
+		self._refill(time.monotonic() if now is None else now)
+		self._tokens -= 1
+
+
+class PoolConnection:
+	"""
+	One IRC connection carrying several channels
+	"""
+	def __init__(self, pool, index):
+		self.pool = pool
+		self.index = index
+		self.channels = set()
+		self.is_connected = False
+		self.running = True
+		self._joined = set()
+		self._reader = None
+		self._writer = None
+		self._task = None
+
+	def __str__(self):
+		return "<PoolConnection #" + str(self.index) + " Channels:" + str(len(self.channels)) + ">"
+
+	def __repr__(self):
+		return str(self)
+
+	def _send_stuff(self, data):
+		logger.debug("[%d] < %s", self.index, data)
+		self._writer.write(bytes(data + "\r\n", "UTF-8"))
+
+	def join(self, channel):
+		self.channels.add(channel)
+		if self.is_connected:
+			self.pool._queue_join(self, channel)
+
+	def part(self, channel):
+		self.channels.discard(channel)
+		self._joined.discard(channel)
+		if self.is_connected:
+			self._send_stuff("PART #" + channel)
+
+	def _handle_message(self, message):
+		command = message.command
+
+		if command == "PRIVMSG":
+			channel = message.channel
+			if channel is not None:
+				self.pool._dispatch(channel, message)
+
+		elif command == "PING":
+			self._send_stuff("PONG :" + (message.text or "tmi.twitch.tv"))
+
+		elif command == "376":
+			self.is_connected = True
+			for channel in self.channels:
+				self.pool._queue_join(self, channel)
+
+		elif command == "366":
+			if len(message.params) > 1 and message.params[1][:1] == "#":
+				self._joined.add(message.params[1][1:])
+
+	async def run(self):
+		self._reader, self._writer = await asyncio.open_connection(self.pool.host, self.pool.port, limit=2 ** 20)
+		self._send_stuff("PASS " + self.pool.oauth)
+		self._send_stuff("NICK " + self.pool.username)
+		await self._writer.drain()
+
+		line_reader = LineReader(None)
+		try:
+			while self.running:
+				data = await self._reader.read(line_reader.chunk_size)
+				if not data:
+					break
+				for line in line_reader.feed(data):
+					logger.debug("[%d] > %s", self.index, line)
+					message = IRCMessage.parse(line)
+					if message is not None:
+						self._handle_message(message)
+				await self._writer.drain()
+		finally:
+			self.is_connected = False
+			# Closed on EOF and errors too, the reconnect opens a new socket
+			self._writer.close()
+			try:
+				await self._writer.wait_closed()
+			except OSError:
+				pass
+
+	def stop(self):
+		self.running = False
+		if self._writer is not None:
+			self._writer.close()
+
+
+class ChatPool:
+	"""
+	Shard many channels over a few IRC connections, all running on one asyncio event loop.
+
+	Outgoing messages go through a send queue limited by a global token bucket (shared by every
+	connection since twitch limits per account) and one token bucket per channel.
+	Joins are limited by their own global bucket.
+	"""
+	def __init__(self, oauth="none", username="TestBot", channels_per_connection=50, host=TWITCH_IRC_HOST, port=TWITCH_IRC_PORT,
+				 global_limit=(20, 30), channel_limit=(1, 1), join_limit=(20, 10)):
+		self.oauth = oauth
+		self.username = username
+		self.channels_per_connection = channels_per_connection
+		self.host = host
+		self.port = port
+
+		self.connections = []
+		self.handlers = {}
+		self._channel_connection = {}
+
+		self._global_limit = global_limit
+		self._channel_limit = channel_limit
+		self.global_bucket = TokenBucket(*global_limit)
+		self.join_bucket = TokenBucket(*join_limit)
+		self._channel_buckets = {}
+
+		self._pending = collections.OrderedDict()
+		self._joins = collections.deque()
+		self._wakeup = None
+		self._tasks = []
+		self.running = False
+
+	def _connection_for_new_channel(self):
+		for connection in self.connections:
+			if len(connection.channels) < self.channels_per_connection:
+				return connection
+		connection = PoolConnection(self, len(self.connections))
+		self.connections.append(connection)
+		if self.running:
+			self._start_connection(connection)
+		return connection
+
+	def _start_connection(self, connection):
+		connection._task = asyncio.ensure_future(self._keep_connected(connection))
+		self._tasks.append(connection._task)
+
+	async def _keep_connected(self, connection, max_backoff=60):
+		backoff = 1
+		while self.running and connection.running:
+			try:
+				await connection.run()
+				backoff = 1
+			except OSError as e:
+				logger.warning("Connection %s failed: %s", connection, e)
+			except Exception:
+				# A parser bug must not silently kill this shard, it reconnects with the same backoff
+				logger.exception("Connection %s crashed", connection)
+			connection.is_connected = False
+			connection._joined.clear()
+			if self.running and connection.running:
+				logger.info("Reconnecting %s in %ss", connection, backoff)
+				await asyncio.sleep(backoff)
+				backoff = min(backoff * 2, max_backoff)
+
+	def add_channel(self, channel, handler):
+		"""
+		handler is called with (channel, IRCMessage) for every PRIVMSG received on the channel
+		"""
+		channel = channel.lower()
+		self.handlers[channel] = handler
+		if channel not in self._channel_connection:
+			connection = self._connection_for_new_channel()
+			self._channel_connection[channel] = connection
+			connection.join(channel)
+
+	def remove_channel(self, channel):
+		channel = channel.lower()
+		self.handlers.pop(channel, None)
+		self._pending.pop(channel, None)
+		connection = self._channel_connection.pop(channel, None)
+		if connection is not None:
+			connection.part(channel)
+
+	def _dispatch(self, channel, message):
+		handler = self.handlers.get(channel)
+		if handler is not None:
+			try:
+				handler(channel, message)
+			except Exception:
+				# One failing handler must not take the connection (and its other channels) down
+				logger.exception("Handler of %s failed", channel)
+
+	def _queue_join(self, connection, channel):
+		self._joins.append((connection, channel))
+		self._notify()
+
+	def _notify(self):
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	def send_text(self, channel, text):
+		channel = channel.lower()
+		if channel not in self._channel_connection:
+			raise KeyError("Channel %s is not part of the pool" % channel)
+		queue = self._pending.get(channel)
+		if queue is None:
+			queue = self._pending[channel] = collections.deque()
+		queue.append(text[0:450])
+		self._notify()
+
+	@property
+	def pending_messages(self):
+		return sum(len(queue) for queue in self._pending.values())
+
+	def _channel_bucket(self, channel):
+		bucket = self._channel_buckets.get(channel)
+		if bucket is None:
+			bucket = self._channel_buckets[channel] = TokenBucket(*self._channel_limit)
+		return bucket
+
+	def _send_joins(self, now):
+		while self._joins:
+			connection, channel = self._joins[0]
+			if not connection.is_connected or channel not in connection.channels:
+				self._joins.popleft()
+				continue
+			wait = self.join_bucket.delay(now)
+			if wait > 0:
+				return wait
+			self.join_bucket.consume(now)
+			self._joins.popleft()
+			connection._send_stuff("JOIN #" + channel)
+		return None
+
+	def _send_messages(self, now):
+		"""
+		Send as many queued messages as the buckets allow, round robin over channels.
+		Returns the delay until something can be sent again (None if nothing is pending)
+		"""
+		next_wait = None
+		while self._pending:
+			wait = self.global_bucket.delay(now)
+			if wait > 0:
+				return wait
+
+			sent = False
+			for channel in list(self._pending.keys()):
+				connection = self._channel_connection.get(channel)
+				if connection is None or not connection.is_connected:
+					continue
+				bucket = self._channel_bucket(channel)
+				wait = bucket.delay(now)
+				if wait > 0:
+					next_wait = wait if next_wait is None else min(next_wait, wait)
+					continue
+
+				queue = self._pending[channel]
+				text = queue.popleft()
+				if queue:
+					self._pending.move_to_end(channel)
+				else:
+					del self._pending[channel]
+				bucket.consume(now)
+				self.global_bucket.consume(now)
+				connection._send_stuff("PRIVMSG #" + channel + " :" + text)
+				sent = True
+				break
+
+			if not sent:
+				# Nothing is sendable yet, either per channel limits or not connected (retry later)
+				return next_wait if next_wait is not None else 0.5
+		return None
+
+	async def _sender(self):
+		while self.running:
+			now = time.monotonic()
+			waits = [w for w in (self._send_joins(now), self._send_messages(now)) if w is not None]
+			self._wakeup.clear()
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), timeout=min(waits) if waits else None)
+			except asyncio.TimeoutError:
+				pass
+
+	async def run(self):
+		self.running = True
+		self._wakeup = asyncio.Event()
+		for connection in self.connections:
+			self._start_connection(connection)
+		sender = asyncio.ensure_future(self._sender())
+		try:
+			while self.running:
+				await asyncio.sleep(1)
+		finally:
+			sender.cancel()
+			for task in self._tasks:
+				task.cancel()
+
+	def stop(self):
+		self.running = False
+		for connection in self.connections:
+			connection.stop()
+		self._notify()
+
+
+if __name__ == "__main__":
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+
+	def print_message(channel, message):
+		print(channel, message.nick, message.text)
+
+	pool = ChatPool(username="justinfan12345", oauth="none")
+	for _channel in ["thestaticturtle", "twitch"]:
+		pool.add_channel(_channel, print_message)
+
+	try:
+		asyncio.run(pool.run())
+	except KeyboardInterrupt:
+		pass
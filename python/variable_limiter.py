@@ -1,15 +1,46 @@
 import time
+import weakref
+
+from metrics import REGISTRY
+
+LIMITER_WRITES = REGISTRY.counter("limiter_writes_total", "Messages written to a limiter", ("limiter", "name"))
+LIMITER_REJECTED = REGISTRY.counter("limiter_rejected_total", "Messages dropped by a limiter (never emitted)", ("limiter", "name"))
+LIMITER_HELD = REGISTRY.counter("limiter_held_total", "Messages held back by a limiter to be emitted later", ("limiter", "name"))
+LIMITER_EMITTED = REGISTRY.counter("limiter_emitted_total", "Messages let through by a limiter", ("limiter", "name"))
+LIMITER_QUEUE = REGISTRY.gauge("limiter_queue_length", "Messages waiting in a queueing limiter (sum over the live limiters sharing a name)", ("limiter", "name"))
+
+# (limiter class, name) -> live limiters, held weakly so the gauge never keeps a limiter alive
+_queued_limiters = {}
+
+
+def _limiter_metrics(limiter, name):
+	labels = (type(limiter).__name__, name)
+	return LIMITER_WRITES.labels(*labels), LIMITER_REJECTED.labels(*labels), LIMITER_EMITTED.labels(*labels)
+
+
+def _register_queue(limiter, name):
+	labels = (type(limiter).__name__, name)
+	limiters = _queued_limiters.get(labels)
+	if limiters is None:
+		limiters = _queued_limiters[labels] = weakref.WeakSet()
+		LIMITER_QUEUE.labels(*labels).set_function(lambda: sum(len(live._queue) for live in list(limiters)))
+	limiters.add(limiter)
 
 
 class SameDataLimiter():
-	def __init__(self, wait_for_x_same_message=5):
+	def __init__(self, wait_for_x_same_message=5, name="default"):
 		self.wait_for_x_same_message = wait_for_x_same_message
 		self.data = None
 		self.same_write_counter = 0
+		self._writes, self._rejected, self._emitted = _limiter_metrics(self, name)
 
 	def write(self, data):
+		self._writes.inc()
 		if data == self.data:
 			self.same_write_counter += 1
+			if self.same_write_counter > 3:
+				# Duplicate of a value already emitted (or missed), suppressed
+				self._rejected.inc()
 		else:
 			self.data = data
 			self.same_write_counter = 0
@@ -17,42 +48,58 @@ class SameDataLimiter():
 	def read(self):
 		if self.same_write_counter == 3:
 			self.same_write_counter += 1
+			self._emitted.inc()
 			return self.data
 		return None
 
 
 class RateLimiter():
-	def __init__(self, message_per_seconds=2, discard_blocked_message=True):
+	def __init__(self, message_per_seconds=2, discard_blocked_message=True, name="default"):
 		self.message_per_seconds = message_per_seconds
 		self.discard_blocked_message = discard_blocked_message
 		self._last_message = 0
 		self._queue = []
 
 		self._d = 1.0 / message_per_seconds
+		self._writes, self._rejected, self._emitted = _limiter_metrics(self, name)
+		self._held = LIMITER_HELD.labels(type(self).__name__, name)
+		_register_queue(self, name)
 
 	def write(self, data):
+		self._writes.inc()
 		if self._last_message + self._d < time.time():
 			if self.discard_blocked_message:
+				if self._queue:
+					# Replaced before being read
+					self._rejected.inc(len(self._queue))
 				self._queue = [data]
 			else:
 				self._queue.append(data)
 		else:
 			if not self.discard_blocked_message:
 				self._queue.append(data)
+				self._held.inc()
+			else:
+				self._rejected.inc()
 
 	def read(self):
-		return self._queue.pop()
+		data = self._queue.pop()
+		self._emitted.inc()
+		return data
 
 
 class QueueRateLimiter():
-	def __init__(self, message_per_seconds=2):
+	def __init__(self, message_per_seconds=2, name="default"):
 		self.message_per_seconds = message_per_seconds
 		self._last_message = 0
 		self._queue = []
 
 		self._d = 1.0 / message_per_seconds
+		self._writes, self._rejected, self._emitted = _limiter_metrics(self, name)
+		_register_queue(self, name)
 
 	def queueEverything(self, data):
+		self._writes.inc()
 		self._queue.append(data)
 
 	def __iter__(self):
@@ -63,5 +110,6 @@ class QueueRateLimiter():
 			raise StopIteration
 		if self._last_message + self._d < time.time():
 			self._last_message = time.time()
+			self._emitted.inc()
 			return self._queue.pop()
 		return None
@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+from capture_store import Capture, CaptureStore, CaptureWriter
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_TO = "https://osu.ppy.sh"
+
+# Headers that only make sense for a single connection and must not be forwarded (RFC 7230 6.1)
+HOP_BY_HOP_HEADERS = {
+	"connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+	"te", "trailer", "trailers", "transfer-encoding", "upgrade", "host",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+MODE_PROXY = "proxy"
+MODE_REPLAY = "replay"
+MODE_CACHE = "cache"
+# Requests without a body that can be answered from the cache
+CACHEABLE_METHODS = {"GET", "HEAD"}
+
+
+def forwarded_headers(headers, drop=()):
+	connection_tokens = {token.strip().lower() for token in headers.get("Connection", "").split(",") if token.strip()}
+	return [
+		(key, value) for key, value in headers.items()
+		if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() not in connection_tokens and key.lower() not in drop
+	]
+
+
+class AsyncRedirector:
+	"""
+	Streaming reverse proxy: every request is forwarded to `redirect_to` over a pool of keep-alive connections,
+	request and response bodies are streamed chunk by chunk without being buffered.
+
+	With a capture_dir every request/response pair (up to max_capture_size bytes per body) is recorded in a capture store.
+	mode=MODE_REPLAY serves the captured responses without ever contacting the upstream,
+	mode=MODE_CACHE serves captures younger than cache_ttl seconds and proxies (and records) the rest,
+	only GET/HEAD requests are served from the cache (captures are looked up by method, path and query, not by request body).
+	"""
+	def __init__(self, redirect_to=REDIRECT_TO, pool_size=100, timeout=60, cors=True, capture_dir=None, mode=MODE_PROXY, cache_ttl=60, max_capture_size=10 * 1024 * 1024):
+		self.redirect_to = redirect_to.rstrip("/")
+		self.pool_size = pool_size
+		self.timeout = timeout
+		self.cors = cors
+		self.session = None
+
+		if mode != MODE_PROXY and capture_dir is None:
+			raise ValueError("Mode %s needs a capture_dir" % mode)
+		self.mode = mode
+		self.cache_ttl = cache_ttl
+		self.max_capture_size = max_capture_size
+		self.capture_dir = capture_dir
+		self.capture_writer = None
+		self.capture_store = None
+
+	async def start(self, app=None):
+		connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30, ttl_dns_cache=300)
+		self.session = aiohttp.ClientSession(
+			connector=connector,
+			timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout),
+			auto_decompress=False,
+			cookie_jar=aiohttp.DummyCookieJar(),
+		)
+		if self.capture_dir is not None:
+			self.capture_store = CaptureStore(self.capture_dir)
+			if self.mode != MODE_REPLAY:
+				self.capture_writer = CaptureWriter(self.capture_dir)
+
+	async def close(self, app=None):
+		if self.session is not None:
+			await self.session.close()
+		if self.capture_writer is not None:
+			await asyncio.get_running_loop().run_in_executor(None, self.capture_writer.close)
+
+	async def _request_body(self, request, captured):
+		async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+			if captured is not None:
+				captured[0] += len(chunk)
+				if captured[0] <= self.max_capture_size:
+					captured.append(chunk)
+			yield chunk
+
+	def _cors(self, request, response):
+		if self.cors and "Access-Control-Allow-Origin" not in response.headers:
+			response.headers["Access-Control-Allow-Origin"] = request.headers.get("Origin", "*")
+
+	async def _replay(self, request):
+		if self.mode == MODE_CACHE and request.method not in CACHEABLE_METHODS:
+			return None
+		max_age = self.cache_ttl if self.mode == MODE_CACHE else None
+		try:
+			# sqlite + file read, keep it out of the event loop
+			capture = await asyncio.get_running_loop().run_in_executor(
+				None, self.capture_store.latest, request.method, request.rel_url.path, request.rel_url.query_string, max_age
+			)
+		except Exception as e:
+			logger.debug("No capture available: %s", e)
+			return None
+		if capture is None:
+			return None
+
+		response = web.Response(status=capture.status, body=capture.response_body if request.method != "HEAD" else None)
+		for key, value in capture.response_headers:
+			if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != "content-length":
+				response.headers.add(key, value)
+		response.headers["X-Capture-Id"] = str(capture.id)
+		self._cors(request, response)
+		return response
+
+	async def handle(self, request: web.Request) -> web.StreamResponse:
+		if self.mode != MODE_PROXY:
+			response = await self._replay(request)
+			if response is not None:
+				return response
+			if self.mode == MODE_REPLAY:
+				return web.Response(status=404, text="No capture for %s %s" % (request.method, request.rel_url))
+
+		url = self.redirect_to + request.rel_url.path_qs
+		headers = forwarded_headers(request.headers)
+		# Bodies are teed into lists while streaming, first item is the captured size
+		request_captured = [0] if self.capture_writer is not None else None
+		response_captured = [0] if self.capture_writer is not None else None
+		data = self._request_body(request, request_captured) if request.body_exists else None
+		start = time.perf_counter()
+
+		try:
+			upstream = await self.session.request(request.method, url, headers=headers, data=data, allow_redirects=False)
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			logger.warning("Upstream request %s %s failed: %s", request.method, url, e)
+			return web.Response(status=502, text="Bad gateway: %s" % e)
+
+		async with upstream:
+			response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+			# Content-Length is kept when present so the client response is not re-chunked
+			for key, value in forwarded_headers(upstream.headers):
+				response.headers.add(key, value)
+			self._cors(request, response)
+
+			await response.prepare(request)
+			if request.method != "HEAD":
+				async for chunk in upstream.content.iter_chunked(CHUNK_SIZE):
+					if response_captured is not None:
+						response_captured[0] += len(chunk)
+						if response_captured[0] <= self.max_capture_size:
+							response_captured.append(chunk)
+					await response.write(chunk)
+			await response.write_eof()
+
+		if self.capture_writer is not None:
+			if request_captured[0] > self.max_capture_size or response_captured[0] > self.max_capture_size:
+				logger.debug("Not capturing %s %s, body larger than %s bytes", request.method, url, self.max_capture_size)
+			else:
+				self.capture_writer.capture(Capture(
+					request.method, request.rel_url.path, query=request.rel_url.query_string,
+					request_headers=list(request.headers.items()), request_body=b"".join(request_captured[1:]),
+					status=upstream.status, response_headers=list(upstream.headers.items()), response_body=b"".join(response_captured[1:]),
+					duration=time.perf_counter() - start
+				))
+		return response
+
+	def make_app(self) -> web.Application:
+		app = web.Application(client_max_size=0)
+		app.on_startup.append(self.start)
+		app.on_cleanup.append(self.close)
+		app.router.add_route("*", "/{path:.*}", self.handle)
+		return app
+
+	def run(self, host="0.0.0.0", port=6868):
+		web.run_app(self.make_app(), host=host, port=port, access_log=None)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Async streaming reverse proxy")
+	parser.add_argument("--redirect-to", default=REDIRECT_TO)
+	parser.add_argument("--host", default="0.0.0.0")
+	parser.add_argument("--port", type=int, default=6868)
+	parser.add_argument("--pool-size", type=int, default=100, help="Maximum number of upstream connections")
+	parser.add_argument("--capture-dir", default=None, help="Record every request/response pair in this directory")
+	parser.add_argument("--mode", choices=[MODE_PROXY, MODE_REPLAY, MODE_CACHE], default=MODE_PROXY)
+	parser.add_argument("--cache-ttl", type=float, default=60, help="Maximum age of a capture served in cache mode (seconds)")
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+	AsyncRedirector(
+		redirect_to=args.redirect_to, pool_size=args.pool_size,
+		capture_dir=args.capture_dir, mode=args.mode, cache_ttl=args.cache_ttl
+	).run(host=args.host, port=args.port)
@@ -0,0 +1,302 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Every record on disk: MAGIC, length of the compressed payload, zlib(payload)
+# payload: length of the json meta, json meta, request body, response body
+RECORD_MAGIC = b"CAP1"
+RECORD_HEADER = struct.Struct("!4sI")
+META_HEADER = struct.Struct("!I")
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	time REAL NOT NULL,
+	method TEXT NOT NULL,
+	path TEXT NOT NULL,
+	query TEXT NOT NULL,
+	status INTEGER NOT NULL,
+	duration REAL NOT NULL,
+	segment INTEGER NOT NULL,
+	offset INTEGER NOT NULL,
+	length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_path ON captures (path, method, query, time);
+CREATE INDEX IF NOT EXISTS captures_time ON captures (time);
+"""
+
+
+class CaptureException(Exception):
+	pass
+
+
+class Capture:
+	def __init__(self, method, path, query="", request_headers=None, request_body=b"", status=0, response_headers=None, response_body=b"", timestamp=None, duration=0.0, id=None):
+		self.id = id
+		self.time = time.time() if timestamp is None else timestamp
+		self.method = method
+		self.path = path
+		self.query = query
+		self.request_headers = request_headers or []
+		self.request_body = request_body or b""
+		self.status = status
+		self.response_headers = response_headers or []
+		self.response_body = response_body or b""
+		self.duration = duration
+
+	def __str__(self):
+		return "<Capture #" + str(self.id) + " " + self.method + " " + self.path + ("?" + self.query if self.query else "") + " Status:" + str(self.status) + " Size:" + str(len(self.response_body)) + ">"
+
+	def __repr__(self):
+		return str(self)
+
+	def pack(self) -> bytes:
+		meta = json.dumps({
+			"time": self.time,
+			"method": self.method,
+			"path": self.path,
+			"query": self.query,
+			"request_headers": list(self.request_headers),
+			"request_body_length": len(self.request_body),
+			"status": self.status,
+			"response_headers": list(self.response_headers),
+			"response_body_length": len(self.response_body),
+			"duration": self.duration,
+		}).encode("utf-8")
+		payload = zlib.compress(META_HEADER.pack(len(meta)) + meta + self.request_body + self.response_body, 6)
+		return RECORD_HEADER.pack(RECORD_MAGIC, len(payload)) + payload
+
+	@staticmethod
+	def unpack(raw: bytes, id=None):
+		magic, length = RECORD_HEADER.unpack(raw[:RECORD_HEADER.size])
+		if magic != RECORD_MAGIC:
+			raise CaptureException("Invalid capture record")
+		payload = zlib.decompress(raw[RECORD_HEADER.size:RECORD_HEADER.size + length])
+		(meta_length,) = META_HEADER.unpack(payload[:META_HEADER.size])
+		pos = META_HEADER.size + meta_length
+		meta = json.loads(payload[META_HEADER.size:pos].decode("utf-8"))
+		request_body = payload[pos:pos + meta["request_body_length"]]
+		pos += meta["request_body_length"]
+		response_body = payload[pos:pos + meta["response_body_length"]]
+		return Capture(
+			meta["method"], meta["path"], query=meta["query"],
+			request_headers=[tuple(h) for h in meta["request_headers"]], request_body=request_body,
+			status=meta["status"], response_headers=[tuple(h) for h in meta["response_headers"]], response_body=response_body,
+			timestamp=meta["time"], duration=meta["duration"], id=id
+		)
+
+	@property
+	def __dict__(self):
+		return {
+			"id": self.id,
+			"time": self.time,
+			"method": self.method,
+			"path": self.path,
+			"query": self.query,
+			"status": self.status,
+			"duration": round(self.duration, 4),
+			"request_headers": self.request_headers,
+			"request_body_length": len(self.request_body),
+			"response_headers": self.response_headers,
+			"response_body_length": len(self.response_body),
+		}
+
+
+class CaptureWriter:
+	"""
+	Append captures to segment files (capture-XXXXXX.log) from a background thread so request handlers never block
+	on disk I/O. A sqlite index (index.db) maps method/path/query/time to the record position in the segments.
+	"""
+	def __init__(self, directory, segment_size=64 * 1024 * 1024, max_queue=10000):
+		self.directory = directory
+		self.segment_size = segment_size
+		os.makedirs(directory, exist_ok=True)
+		self._queue = queue.Queue(maxsize=max_queue)
+		self.dropped = 0
+		self.written = 0
+		self.errors = 0
+		self._thread = threading.Thread(target=self._run, name="CaptureWriter", daemon=True)
+		self._thread.start()
+
+	def capture(self, capture: Capture):
+		"""
+		Never blocks: if the writer can't keep up the capture is dropped and counted in self.dropped
+		"""
+		try:
+			self._queue.put_nowait(capture)
+		except queue.Full:
+			self.dropped += 1
+
+	def close(self):
+		# The writer may have died (or be stuck behind a full queue): never block forever on the sentinel
+		while self._thread.is_alive():
+			try:
+				self._queue.put(None, timeout=0.5)
+				break
+			except queue.Full:
+				continue
+		self._thread.join()
+
+	def _segment_path(self, number):
+		return os.path.join(self.directory, "capture-%06d.log" % number)
+
+	def _run(self):
+		try:
+			self._write_loop()
+		except Exception:
+			logger.exception("Capture writer for %s stopped", self.directory)
+
+	def _write_loop(self):
+		index = sqlite3.connect(os.path.join(self.directory, "index.db"))
+		index.executescript(INDEX_SCHEMA)
+		row = index.execute("SELECT MAX(segment) FROM captures").fetchone()
+		segment_number = row[0] or 1
+		segment = open(self._segment_path(segment_number), "ab")
+
+		running = True
+		while running:
+			batch = [self._queue.get()]
+			# Grab everything already waiting so one commit covers the whole batch
+			while True:
+				try:
+					batch.append(self._queue.get_nowait())
+				except queue.Empty:
+					break
+
+			rows = []
+			for capture in batch:
+				if capture is None:
+					running = False
+					continue
+				try:
+					raw = capture.pack()
+					if segment.tell() > 0 and segment.tell() + len(raw) > self.segment_size:
+						segment.close()
+						segment_number += 1
+						segment = open(self._segment_path(segment_number), "ab")
+					offset = segment.tell()
+					segment.write(raw)
+				except Exception:
+					self.errors += 1
+					logger.exception("Failed to write %s", capture)
+					continue
+				rows.append((capture.time, capture.method, capture.path, capture.query, capture.status, capture.duration, segment_number, offset, len(raw)))
+
+			segment.flush()
+			if rows:
+				try:
+					index.executemany("INSERT INTO captures (time, method, path, query, status, duration, segment, offset, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+					index.commit()
+					self.written += len(rows)
+				except sqlite3.Error:
+					# The records stay in the segment but can't be found without their index rows
+					self.errors += len(rows)
+					logger.exception("Failed to index %d captures", len(rows))
+					index.rollback()
+
+		segment.close()
+		index.close()
+
+
+class CaptureStore:
+	"""
+	Read side of the capture directory: query the index and load records
+	"""
+	def __init__(self, directory):
+		self.directory = directory
+		self._local = threading.local()
+
+	@property
+	def _index(self):
+		# sqlite connections can't be shared between threads
+		connection = getattr(self._local, "index", None)
+		if connection is None:
+			path = os.path.join(self.directory, "index.db")
+			if not os.path.exists(path):
+				raise CaptureException("No capture index in %s" % self.directory)
+			connection = self._local.index = sqlite3.connect(path)
+		return connection
+
+	def query(self, path=None, method=None, query=None, since=None, until=None, status=None, limit=100, prefix=False):
+		clauses = []
+		args = []
+		if path is not None:
+			if prefix:
+				clauses.append("path >= ? AND path < ?")
+				args += [path, path + "\uffff"]
+			else:
+				clauses.append("path = ?")
+				args.append(path)
+		for column, value in (("method", method), ("query", query), ("status", status)):
+			if value is not None:
+				clauses.append(column + " = ?")
+				args.append(value)
+		if since is not None:
+			clauses.append("time >= ?")
+			args.append(since)
+		if until is not None:
+			clauses.append("time <= ?")
+			args.append(until)
+		sql = "SELECT id, time, method, path, query, status, duration FROM captures"
+		if clauses:
+			sql += " WHERE " + " AND ".join(clauses)
+		sql += " ORDER BY time DESC LIMIT ?"
+		args.append(limit)
+		return [
+			{"id": row[0], "time": row[1], "method": row[2], "path": row[3], "query": row[4], "status": row[5], "duration": row[6]}
+			for row in self._index.execute(sql, args)
+		]
+
+	def load(self, capture_id) -> Capture:
+		row = self._index.execute("SELECT segment, offset, length FROM captures WHERE id = ?", (capture_id,)).fetchone()
+		if row is None:
+			raise CaptureException("No capture with id %s" % capture_id)
+		segment, offset, length = row
+		with open(os.path.join(self.directory, "capture-%06d.log" % segment), "rb") as f:
+			f.seek(offset)
+			return Capture.unpack(f.read(length), id=capture_id)
+
+	def latest(self, method, path, query="", max_age=None):
+		"""
+		Most recent capture for this exact request, None if there is none (or if it's older than max_age seconds)
+		"""
+		since = None if max_age is None else time.time() - max_age
+		rows = self.query(path=path, method=method, query=query, since=since, limit=1)
+		if not rows:
+			return None
+		return self.load(rows[0]["id"])
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Query the captures recorded by the redirectors")
+	parser.add_argument("directory")
+	parser.add_argument("--path", default=None)
+	parser.add_argument("--prefix", action="store_true", help="Match every path starting with --path")
+	parser.add_argument("--method", default=None)
+	parser.add_argument("--status", type=int, default=None)
+	parser.add_argument("--since", type=float, default=None, help="Unix timestamp")
+	parser.add_argument("--until", type=float, default=None, help="Unix timestamp")
+	parser.add_argument("--limit", type=int, default=100)
+	parser.add_argument("--show", type=int, default=None, help="Dump the capture with this id (response body on stdout)")
+	args = parser.parse_args()
+
+	store = CaptureStore(args.directory)
+	if args.show is not None:
+		capture = store.load(args.show)
+		print(json.dumps(capture.__dict__, indent=4))
+		print(capture.response_body.decode("utf-8", errors="replace"))
+	else:
+		for row in store.query(path=args.path, method=args.method, status=args.status, since=args.since, until=args.until, limit=args.limit, prefix=args.prefix):
+			print("%6d  %s  %-7s %3d %8.1fms  %s%s" % (
+				row["id"], time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(row["time"])), row["method"], row["status"],
+				row["duration"] * 1000, row["path"], "?" + row["query"] if row["query"] else ""
+			))
@@ -1,7 +1,12 @@
+import argparse
+import json
+import time
+
 from flask import Flask
 from flask import request
 from flask_cors import CORS,cross_origin
 import requests
+from capture_store import Capture, CaptureWriter
 app = Flask(__name__)
 CORS(app) # This will enable CORS for all routes
 
@@ -10,13 +15,17 @@ REDIRECT_TO = "https://osu.ppy.sh"
 
 HTTP_METHODS = ['GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'CONNECT', 'OPTIONS', 'TRACE', 'PATCH']
 
+capture_writer = None
+
+# r.content is already decompressed by requests, these headers would not match the captured body anymore
+DECODED_BODY_HEADERS = {"content-encoding", "content-length"}
+
 
 @app.route('/', defaults={'path': ''}, methods=HTTP_METHODS)
 @app.route('/<path:path>', methods=HTTP_METHODS)
 @cross_origin()
 def catch_all(path):
 	# print(request.headers)
-	req_exec = eval("requests."+request.method.lower())
 	try:
 		headers = {
 			"User-Agent": request.headers["User-Agent"],
@@ -27,15 +36,43 @@ def catch_all(path):
 			"User-Agent": request.headers["User-Agent"]
 		}
 
+	# Read (and cached) before request.values/request.data consume the stream, the form parser reuses the cached body
+	request_body = request.get_data(cache=True)
 	data = request.values
 	try:
 		data = json.loads(request.data)
 	except Exception as e:
 		pass
 
-	r = req_exec(REDIRECT_TO + "/" +path, data = data, headers=headers)
-	open(str(path).replace("/","_")+".txt","w").write(r.text)
+	start = time.perf_counter()
+	r = requests.request(request.method, REDIRECT_TO + "/" +path, data = data, headers=headers)
+	if capture_writer is not None:
+		capture_writer.capture(Capture(
+			request.method, "/" + path, query=request.query_string.decode("utf-8"),
+			request_headers=list(request.headers.items()), request_body=request_body,
+			status=r.status_code, response_headers=[(key, value) for key, value in r.headers.items() if key.lower() not in DECODED_BODY_HEADERS], response_body=r.content,
+			duration=time.perf_counter() - start
+		))
 	return r.text
 
 
-app.run(host="0.0.0.0",debug=False,port=6868)
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Redirect every request to REDIRECT_TO and save the responses")
+	parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio streaming proxy (see async_redirector.py)")
+	parser.add_argument("--port", type=int, default=6868)
+	parser.add_argument("--capture-dir", default="captures", help="Where request/response pairs are recorded (see capture_store.py to query them)")
+	parser.add_argument("--mode", choices=["proxy", "replay", "cache"], default="proxy", help="replay/cache serve captured responses (--async only)")
+	parser.add_argument("--cache-ttl", type=float, default=60)
+	args = parser.parse_args()
+
+	if args.use_async:
+		from async_redirector import AsyncRedirector
+		AsyncRedirector(redirect_to=REDIRECT_TO, capture_dir=args.capture_dir, mode=args.mode, cache_ttl=args.cache_ttl).run(host="0.0.0.0", port=args.port)
+	else:
+		if args.mode != "proxy":
+			parser.error("--mode %s needs --async" % args.mode)
+		capture_writer = CaptureWriter(args.capture_dir)
+		try:
+			app.run(host="0.0.0.0",debug=False,port=args.port)
+		finally:
+			capture_writer.close()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+from async_redirector import AsyncRedirector
+
+logger = logging.getLogger(__name__)
+
+
+def make_upstream_app(response_size=4096, delay=0.0):
+	"""
+	Local stand-in for the redirected server: GET returns `response_size` bytes, every other method echoes the body back
+	"""
+	payload = os.urandom(response_size)
+
+	async def handle(request):
+		if delay:
+			await asyncio.sleep(delay)
+		if request.method in ("GET", "HEAD"):
+			return web.Response(body=payload, content_type="application/octet-stream", headers={"X-Upstream": "bench"})
+		response = web.StreamResponse(status=201, headers={"X-Upstream": "bench"})
+		await response.prepare(request)
+		async for chunk in request.content.iter_chunked(64 * 1024):
+			await response.write(chunk)
+		await response.write_eof()
+		return response
+
+	app = web.Application(client_max_size=0)
+	app.router.add_route("*", "/{path:.*}", handle)
+	return app
+
+
+async def start_site(app, host="127.0.0.1", port=0):
+	runner = web.AppRunner(app, access_log=None)
+	await runner.setup()
+	site = web.TCPSite(runner, host, port)
+	await site.start()
+	return runner, runner.addresses[0][1]
+
+
+async def load(url, requests_count=5000, concurrency=50, method="GET", body_size=0):
+	"""
+	Fire `requests_count` requests at `url` from `concurrency` workers, returns a dict of results
+	"""
+	latencies = []
+	errors = 0
+	body = os.urandom(body_size) if body_size else None
+	remaining = requests_count
+
+	async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+		async def worker():
+			nonlocal remaining, errors
+			while remaining > 0:
+				remaining -= 1
+				start = time.perf_counter()
+				try:
+					async with session.request(method, url, data=body) as response:
+						await response.read()
+						if response.status >= 400:
+							errors += 1
+				except aiohttp.ClientError:
+					errors += 1
+				latencies.append(time.perf_counter() - start)
+
+		start = time.perf_counter()
+		await asyncio.gather(*[worker() for _ in range(concurrency)])
+		duration = time.perf_counter() - start
+
+	latencies.sort()
+	count = len(latencies)
+	return {
+		"requests": count,
+		"errors": errors,
+		"duration": round(duration, 3),
+		"requests_per_second": round(count / duration, 1),
+		"latency_ms_p50": round(latencies[count // 2] * 1000, 3),
+		"latency_ms_p99": round(latencies[min(count - 1, int(count * 0.99))] * 1000, 3),
+	}
+
+
+async def wait_for_target(url, timeout=60.0):
+	"""
+	Poll `url` until it answers through to the upstream stand-in (X-Upstream header), an external redirector
+	may still be starting or not pointed at the upstream yet
+	"""
+	deadline = time.monotonic() + timeout
+	async with aiohttp.ClientSession() as session:
+		while True:
+			try:
+				async with session.get(url) as response:
+					await response.read()
+					if response.headers.get("X-Upstream") == "bench":
+						return
+					reason = "status %s without the upstream header" % response.status
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+				reason = str(e)
+			if time.monotonic() > deadline:
+				raise TimeoutError("%s does not reach the upstream stand-in: %s" % (url, reason))
+			await asyncio.sleep(0.5)
+
+
+async def run_benchmark(requests_count=5000, concurrency=50, method="GET", body_size=0, response_size=4096, target=None, upstream_port=0, wait_timeout=60.0):
+	"""
+	Start the upstream stand-in and the async proxy in this process, then load the proxy.
+	With `target` (the URL of an already running redirector pointed at the upstream, use a fixed `upstream_port` to configure
+	it beforehand) the load starts once the target answers through to the upstream, waiting up to `wait_timeout` seconds.
+	"""
+	upstream_runner, upstream_port = await start_site(make_upstream_app(response_size=response_size), port=upstream_port)
+	logger.info("Upstream stand-in on http://127.0.0.1:%s", upstream_port)
+	proxy_runner = None
+	try:
+		if target is None:
+			proxy = AsyncRedirector(redirect_to="http://127.0.0.1:%s" % upstream_port)
+			proxy_runner, proxy_port = await start_site(proxy.make_app())
+			target = "http://127.0.0.1:%s/bench" % proxy_port
+		else:
+			logger.info("Waiting for %s to reach the upstream", target)
+			await wait_for_target(target, timeout=wait_timeout)
+		return await load(target, requests_count=requests_count, concurrency=concurrency, method=method, body_size=body_size)
+	finally:
+		if proxy_runner is not None:
+			await proxy_runner.cleanup()
+		await upstream_runner.cleanup()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the async redirector against a local upstream stand-in")
+	parser.add_argument("--requests", type=int, default=5000)
+	parser.add_argument("--concurrency", type=int, default=50)
+	parser.add_argument("--method", default="GET")
+	parser.add_argument("--body-size", type=int, default=0, help="Request body size in bytes")
+	parser.add_argument("--response-size", type=int, default=4096, help="Upstream GET response size in bytes")
+	parser.add_argument("--target", default=None, help="Benchmark an already running proxy instead of starting one")
+	parser.add_argument("--upstream-port", type=int, default=0, help="Fixed port for the upstream stand-in (to point the --target proxy at), random by default")
+	parser.add_argument("--wait", type=float, default=60.0, help="Seconds to wait for --target to reach the upstream before giving up")
+	args = parser.parse_args()
+
+	logging.basicConfig(format='[%(asctime)s] [%(levelname)05s] [%(name)-20s] %(message)s', level=logging.INFO)
+	results = asyncio.run(run_benchmark(
+		requests_count=args.requests, concurrency=args.concurrency, method=args.method,
+		body_size=args.body_size, response_size=args.response_size, target=args.target,
+		upstream_port=args.upstream_port, wait_timeout=args.wait
+	))
+	for key, value in results.items():
+		print("%-20s %s" % (key, value))